@@ -0,0 +1,110 @@
+"""Per-request CPU cost of the Auth middleware: BaseHTTPMiddleware vs pure ASGI.
+
+Drives a minimal FastAPI app directly through ASGI (no sockets) with the
+previous BaseHTTPMiddleware implementation of Auth and with the current
+pure ASGI one. The rate limiter is replaced with a no-op so only the
+middleware overhead is measured.
+
+    python benchmarks/bench_auth_middleware.py [--requests 20000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+import auth
+from accounts_watcher import AccountsWatcher
+from auth import Auth
+
+ACCOUNTS = {"1111-2222-3333": {"plan": "free", "rate_limit": 1, "daily_limit": 50}}
+
+class NoopRateLimiter:
+    async def is_allowed(self, *args) -> bool:
+        return True
+
+class BaseHTTPAuth(BaseHTTPMiddleware):
+    """The Auth middleware as it was before the pure ASGI rewrite"""
+    TOKEN_PATTERN = Auth.TOKEN_PATTERN
+
+    def __init__(self, app, accounts: AccountsWatcher):
+        super().__init__(app)
+        self.accounts = accounts.snapshot
+
+    async def dispatch(self, request, call_next):
+        auth_token = request.headers.get('authorization')
+        if not auth_token or not self.TOKEN_PATTERN.match(auth_token):
+            return JSONResponse(status_code=403, content={'error': 'Invalid token format!'})
+        if auth_token not in self.accounts:
+            return JSONResponse(status_code=403, content={'error': 'Invalid token!'})
+        account = self.accounts[auth_token]
+        if not await auth.rate_limiter.is_allowed(auth_token, account['rate_limit'], account.get('daily_limit')):
+            return JSONResponse(status_code=429, content={'error': 'Rate limit exceeded!'})
+        request.account = account
+        return await call_next(request)
+
+def build_app(middleware_class) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/joke")
+    async def root():
+        return {"id": "1", "categories": [], "createdAt": "2020-01-05 13:42:25.352697", "joke": "joke"}
+
+    file_helper = Mock()
+    file_helper.read_json_file.return_value = ACCOUNTS
+    app.add_middleware(middleware_class, accounts=AccountsWatcher("accounts.json", file_helper=file_helper))
+    return app
+
+async def drive(app, requests: int, token: str) -> float:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/joke', 'raw_path': b'/joke', 'query_string': b'',
+        'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+        'headers': [(b'host', b'testserver'), (b'authorization', token.encode())]
+    }
+
+    disconnected = asyncio.Event()  # never set: the client stays connected
+
+    def make_receive():
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+
+        return receive
+
+    async def send(message):
+        pass
+
+    for _ in range(requests // 10):  # warm up
+        await app(dict(scope), make_receive(), send)
+    start = time.process_time()
+    for _ in range(requests):
+        await app(dict(scope), make_receive(), send)
+    return (time.process_time() - start) / requests
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    auth.rate_limiter = NoopRateLimiter()
+
+    for label, token in (("authorised", "1111-2222-3333"), ("rejected", "9999-9999-9999")):
+        before = asyncio.run(drive(build_app(BaseHTTPAuth), args.requests, token))
+        after = asyncio.run(drive(build_app(Auth), args.requests, token))
+        print(f"{label:>10}: BaseHTTPMiddleware {before * 1e6:7.1f} us/request | "
+              f"pure ASGI {after * 1e6:7.1f} us/request | "
+              f"saved {(before - after) * 1e6:6.1f} us ({(1 - after / before) * 100:4.1f}%)")
+
+if __name__ == "__main__":
+    main()
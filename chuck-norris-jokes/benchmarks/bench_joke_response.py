@@ -0,0 +1,105 @@
+"""Per-request CPU cost of serving a joke: dataclass + FastAPI encoding vs pre-encoded bytes.
+
+Drives a minimal FastAPI app directly through ASGI (no sockets, no Auth).
+The "before" endpoint returns the previous Joke dataclass, which FastAPI
+runs through jsonable_encoder and JSONResponse; the "after" endpoint returns
+the pre-encoded body of the current Joke in a raw Response. Both return the
+same bytes.
+
+    python benchmarks/bench_joke_response.py [--requests 20000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from joke import Joke
+
+UPSTREAM_JOKE = {
+    "id": "cw5dzlj1rrqvqxtnhmqk4a",
+    "categories": [],
+    "created_at": "2020-01-05 13:42:25.352697",
+    "value": "Chuck Norris doesn't read books. He stares them down until he gets the information he wants."
+}
+
+@dataclass
+class DataclassJoke:
+    """The Joke model as it was before pre-encoding"""
+    id: str
+    categories: List[str]
+    createdAt: str
+    joke: str
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    dataclass_joke = DataclassJoke(UPSTREAM_JOKE["id"], UPSTREAM_JOKE["categories"],
+                                   UPSTREAM_JOKE["created_at"], UPSTREAM_JOKE["value"])
+    joke = Joke.from_dict(UPSTREAM_JOKE)
+
+    @app.get("/before")
+    async def before():
+        return dataclass_joke
+
+    @app.get("/after")
+    async def after():
+        return Response(content=joke.json, media_type="application/json")
+
+    assert JSONResponse(jsonable_encoder(dataclass_joke)).body == joke.json
+    return app
+
+async def drive(app, path: str, requests: int) -> float:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+        'headers': [(b'host', b'testserver')]
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    for _ in range(requests // 10):  # warm up
+        await app(dict(scope), receive, send)
+    start = time.process_time()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.process_time() - start) / requests
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    app = build_app()
+
+    before = asyncio.run(drive(app, "/before", args.requests))
+    after = asyncio.run(drive(app, "/after", args.requests))
+    print(f"dataclass + encoding {before * 1e6:7.1f} us/request | "
+          f"pre-encoded {after * 1e6:7.1f} us/request | "
+          f"saved {(before - after) * 1e6:6.1f} us ({(1 - after / before) * 100:4.1f}%)")
+
+    joke = Joke.from_dict(UPSTREAM_JOKE)
+    dataclass_joke = DataclassJoke(joke.id, joke.categories, joke.createdAt, joke.joke)
+    start = time.process_time()
+    for _ in range(args.requests):
+        JSONResponse(jsonable_encoder(dataclass_joke)).body
+    encoding = (time.process_time() - start) / args.requests
+    start = time.process_time()
+    for _ in range(args.requests):
+        Response(content=joke.json, media_type="application/json").body
+    raw = (time.process_time() - start) / args.requests
+    print(f"serialization only: jsonable_encoder + JSONResponse {encoding * 1e6:6.1f} us | "
+          f"raw Response {raw * 1e6:6.1f} us")
+
+if __name__ == "__main__":
+    main()
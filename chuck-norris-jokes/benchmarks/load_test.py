@@ -0,0 +1,322 @@
+"""Load test: drive the app with concurrent clients against local stand-ins.
+
+Starts a fake jokes API with configurable latency and jitter, and swaps
+the app's Redis clients for in-process stand-ins (fakeredis, see
+benchmarks/requirements.txt) unless --redis-host points at a real Redis.
+With --redis-nodes N, rate limit state is sharded across N stand-ins and
+the results include how many keys each one holds.
+The stand-in runs on the app's own event loop, so absolute latencies are
+only comparable between runs using the same Redis.
+The app is imported with its settings pointed at both and driven in-process
+through httpx' ASGI transport by --clients concurrent clients, using the
+tokens of --accounts plus a share of unknown tokens.
+
+Reports RPS, latency percentiles, status codes, Redis commands and upstream
+calls per request, and writes them to --output as JSON. With --baseline,
+the run is compared against an earlier results file and the script exits
+with status 1 when throughput, p99 latency or Redis ops regress by more
+than --tolerance.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/load_test.py --clients 50 --requests 5000 --output results.json
+    python benchmarks/load_test.py --baseline results.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import httpx
+import redis
+import redis.asyncio
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=5000, help="Measured requests in total")
+    parser.add_argument("--warmup", type=int, default=200, help="Requests sent before measuring")
+    parser.add_argument("--accounts", default=os.path.join(ROOT, 'src', 'configurations_files', 'accounts.json'),
+                        help="Accounts file the app loads; its tokens make up the request mix")
+    parser.add_argument("--invalid-share", type=float, default=0.1, help="Share of requests with unknown tokens")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50.0)
+    parser.add_argument("--upstream-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--redis-host", help="Use this Redis server instead of the in-process stand-in")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-nodes", type=int, default=1,
+                        help="Shard rate limit state across this many Redis stand-ins (REDIS_NODES)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Override an app setting (see src/settings.py), may be repeated")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    return parser.parse_args()
+
+class FakeUpstream:
+    """Minimal HTTP/1.1 keep-alive server answering like the jokes API"""
+
+    def __init__(self, latency: float, jitter: float):
+        self._latency = latency
+        self._jitter = jitter
+        self._server = None
+        self.requests = 0
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/jokes/random"
+
+    async def close(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                self.requests += 1
+                await asyncio.sleep(max(0.0, random.uniform(self._latency - self._jitter,
+                                                            self._latency + self._jitter)))
+                body = json.dumps({
+                    "id": f"bench-{self.requests}",
+                    "categories": [],
+                    "created_at": "2020-01-05 13:42:25.352697",
+                    "value": f"Chuck Norris benchmarked this service before it was written ({self.requests})."
+                }).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                             b"content-length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def install_redis_stand_in() -> Dict[str, Any]:
+    """Point the app's Redis clients at in-process fakeredis servers, one per host:port"""
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("The Redis stand-in needs fakeredis: pip install -r benchmarks/requirements.txt "
+                 "(or pass --redis-host)")
+    servers: Dict[str, Any] = {}
+
+    def server_for(connection_pool) -> Any:
+        kwargs = connection_pool.connection_kwargs if connection_pool is not None else {}
+        node = f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}"
+        if node not in servers:
+            servers[node] = fakeredis.FakeServer()
+        return servers[node]
+
+    class StandInRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, connection_pool=None, **kwargs):
+            super().__init__(server=server_for(connection_pool))
+
+    class AsyncStandInRedis(fakeredis.aioredis.FakeRedis):
+        def __init__(self, *args, connection_pool=None, **kwargs):
+            super().__init__(server=server_for(connection_pool))
+
+    redis.Redis = StandInRedis
+    redis.asyncio.Redis = AsyncStandInRedis
+    return servers
+
+def keys_per_node(servers: Dict[str, Any]) -> Dict[str, int]:
+    import fakeredis
+    return {node: fakeredis.FakeRedis(server=server).dbsize() for node, server in sorted(servers.items())}
+
+class RedisOpCounter:
+    """Counts the Redis commands the app sends, pipelined commands included"""
+
+    def __init__(self):
+        self.ops = 0
+
+    def install(self) -> None:
+        counter = self
+
+        def wrap_async(method):
+            async def execute_command(self, *args, **kwargs):
+                counter.ops += 1
+                return await method(self, *args, **kwargs)
+            return execute_command
+
+        def wrap_sync(method):
+            def execute_command(self, *args, **kwargs):
+                counter.ops += 1
+                return method(self, *args, **kwargs)
+            return execute_command
+
+        def wrap_async_pipeline(method):
+            async def execute(self, *args, **kwargs):
+                counter.ops += len(self.command_stack)
+                return await method(self, *args, **kwargs)
+            return execute
+
+        redis.asyncio.client.Redis.execute_command = wrap_async(redis.asyncio.client.Redis.execute_command)
+        redis.asyncio.client.Pipeline.execute = wrap_async_pipeline(redis.asyncio.client.Pipeline.execute)
+        redis.client.Redis.execute_command = wrap_sync(redis.client.Redis.execute_command)
+
+def load_tokens(accounts_path: str) -> List[str]:
+    with open(accounts_path) as file:
+        return list(json.load(file))
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    random.seed(args.seed)
+    upstream = FakeUpstream(args.upstream_latency_ms / 1000, args.upstream_jitter_ms / 1000)
+    upstream_url = await upstream.start()
+    servers = None
+    if args.redis_host:
+        os.environ.update({'REDIS_HOST': args.redis_host, 'REDIS_PORT': str(args.redis_port)})
+    else:
+        servers = install_redis_stand_in()
+        if args.redis_nodes > 1:
+            os.environ['REDIS_NODES'] = ','.join(f'stand-in-{i}:6379' for i in range(args.redis_nodes))
+
+    # Settings are read when the app is imported, so they go in first
+    os.environ.update({
+        'UPSTREAM_URL': upstream_url,
+        'ACCOUNTS_PATH': os.path.abspath(args.accounts)
+    })
+    for setting in args.set:
+        name, _, value = setting.partition('=')
+        os.environ[name] = value
+    counter = RedisOpCounter()
+    counter.install()
+    app = importlib.import_module('main').app
+
+    tokens = load_tokens(args.accounts)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def request() -> None:
+                if tokens and random.random() >= args.invalid_share:
+                    token = random.choice(tokens)
+                else:
+                    token = f"{random.randrange(10 ** 12):012d}"
+                started = time.perf_counter()
+                response = await client.get("/joke", headers={"Authorization": token})
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+
+            async def clients(total: int) -> None:
+                remaining = [total]
+
+                async def worker() -> None:
+                    while remaining[0] > 0:
+                        remaining[0] -= 1
+                        await request()
+
+                await asyncio.gather(*(worker() for _ in range(args.clients)))
+
+            await clients(args.warmup)
+            latencies.clear()
+            statuses.clear()
+            counter.ops = 0
+            upstream_requests = upstream.requests
+
+            started = time.perf_counter()
+            await clients(args.requests)
+            elapsed = time.perf_counter() - started
+            upstream_requests = upstream.requests - upstream_requests
+    finally:
+        await app.router.shutdown()
+        await upstream.close()
+
+    ordered = sorted(latencies)
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {
+            'clients': args.clients,
+            'requests': args.requests,
+            'accounts': len(tokens),
+            'invalid_share': args.invalid_share,
+            'upstream_latency_ms': args.upstream_latency_ms,
+            'upstream_jitter_ms': args.upstream_jitter_ms,
+            'redis': f"{args.redis_host}:{args.redis_port}" if args.redis_host else 'stand-in',
+            'redis_nodes': args.redis_nodes,
+            'settings': args.set
+        },
+        'duration_s': round(elapsed, 3),
+        'rps': round(len(ordered) / elapsed, 1),
+        'latency_ms': {
+            'mean': round(statistics.mean(ordered) * 1000, 3),
+            'p50': round(percentile(ordered, 0.50) * 1000, 3),
+            'p95': round(percentile(ordered, 0.95) * 1000, 3),
+            'p99': round(percentile(ordered, 0.99) * 1000, 3),
+            'max': round(ordered[-1] * 1000, 3)
+        },
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+        'redis_ops_per_request': round(counter.ops / len(ordered), 3),
+        'upstream_requests_per_request': round(upstream_requests / len(ordered), 3)
+    }
+    if servers is not None and args.redis_nodes > 1:
+        results['redis_keys_per_node'] = keys_per_node(servers)
+    return results
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every metric that regressed by more than `tolerance`"""
+    checks = [
+        ('rps', results['rps'], baseline['rps'], False),
+        ('p99 latency (ms)', results['latency_ms']['p99'], baseline['latency_ms']['p99'], True),
+        ('redis ops/request', results['redis_ops_per_request'], baseline['redis_ops_per_request'], True)
+    ]
+    regressions = []
+    for name, current, previous, lower_is_better in checks:
+        if lower_is_better:
+            regressed = current > previous * (1 + tolerance)
+        else:
+            regressed = current < previous * (1 - tolerance)
+        line = f"{name:>18}: {previous} -> {current}"
+        print(line + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(line)
+    return regressions
+
+def main() -> None:
+    args = parse_args()
+    results = asyncio.run(run(args))
+
+    latency = results['latency_ms']
+    print(f"{results['rps']} req/s over {results['duration_s']} s | "
+          f"p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms | "
+          f"status {results['status_codes']} | "
+          f"redis ops/request {results['redis_ops_per_request']} | "
+          f"upstream calls/request {results['upstream_requests_per_request']}")
+    if 'redis_keys_per_node' in results:
+        print(f"redis keys per node {results['redis_keys_per_node']}")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(f"Compared with {args.baseline} ({baseline.get('commit')}):")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
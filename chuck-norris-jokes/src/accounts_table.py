@@ -0,0 +1,224 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from collections.abc import Mapping as MappingABC
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+from helpers.file_helper import FileError, FileHelper
+from rate_limit_algorithms import ALGORITHMS, APPROXIMATE, EXACT, FIXED_WINDOW
+
+# File layout (all integers little-endian):
+#   header   magic (4s) | version (I) | plan count (I) | token width (I) |
+#            account count (Q) | slot count (Q, a power of two)
+#   plans    (plan count + 1) x Q offsets relative to the plan data, then one
+#            compact JSON object per distinct plan definition
+#   slots    slot count x (token, NUL-padded to token width | plan index + 1 (I)),
+#            an open-addressing hash table probed linearly from crc32(token);
+#            plan index 0 marks an empty slot
+MAGIC = b"CNJA"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQ")
+OFFSET = struct.Struct("<Q")
+PLAN_INDEX = struct.Struct("<I")
+
+# Account fields kept in the compiled table; anything else (e.g. `name`) is
+# not needed to serve requests and is dropped so accounts can share plans
+PLAN_FIELDS = ('plan', 'rate_limit', 'daily_limit', 'rate_limit_mode', 'rate_limit_algorithm')
+
+class AccountsError(Exception):
+    """Custom exception for invalid accounts files"""
+    pass
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def validate_accounts(accounts: Any) -> Mapping[str, Mapping[str, Any]]:
+    """Check an accounts file's content and return it as a read-only snapshot"""
+    if not isinstance(accounts, dict):
+        raise AccountsError("Accounts file must hold an object of token -> account")
+    snapshot = {}
+    for token, account in accounts.items():
+        if not isinstance(account, dict):
+            raise AccountsError(f"Account {token} must be an object")
+        if not _is_int(account.get('rate_limit')) or account['rate_limit'] < 1:
+            raise AccountsError(f"Account {token}: rate_limit must be a positive integer")
+        daily_limit = account.get('daily_limit')
+        if daily_limit is not None and (not _is_int(daily_limit) or daily_limit < 0):
+            raise AccountsError(f"Account {token}: daily_limit must be null or a non-negative integer")
+        if account.get('rate_limit_mode', EXACT) not in (EXACT, APPROXIMATE):
+            raise AccountsError(f"Account {token}: unknown rate_limit_mode {account['rate_limit_mode']}")
+        if account.get('rate_limit_algorithm', FIXED_WINDOW) not in ALGORITHMS:
+            raise AccountsError(f"Account {token}: unknown rate_limit_algorithm {account['rate_limit_algorithm']}")
+        if account.get('rate_limit_mode') == APPROXIMATE and account.get('rate_limit_algorithm', FIXED_WINDOW) != FIXED_WINDOW:
+            # Local admissions are counted per second: approximate accounts only have a fixed window
+            raise AccountsError(f"Account {token}: approximate rate_limit_mode only supports {FIXED_WINDOW}")
+        snapshot[token] = MappingProxyType(dict(account))
+    return MappingProxyType(snapshot)
+
+def is_accounts_table(path: str) -> bool:
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def _slot_count(accounts: int) -> int:
+    # At most half full, so probes stay short and always reach an empty slot
+    slots = 8
+    while slots < accounts * 2:
+        slots *= 2
+    return slots
+
+def build_accounts_table(input_path: str, output_path: str) -> int:
+    """Compile a JSON accounts file into an accounts table, return the account count.
+
+    The table is written to a temporary file and renamed over output_path,
+    so a running AccountsWatcher never maps a partly written table.
+    """
+    try:
+        accounts = validate_accounts(FileHelper.read_json_file(input_path))
+    except FileError as e:
+        raise AccountsError(str(e))
+
+    plans: List[bytes] = []
+    plan_indexes: Dict[tuple, int] = {}
+    rows = []
+    for token, account in accounts.items():
+        plan = tuple((field, account[field]) for field in PLAN_FIELDS if field in account)
+        plan_index = plan_indexes.get(plan)
+        if plan_index is None:
+            plan_index = plan_indexes[plan] = len(plans)
+            plans.append(json.dumps(dict(plan), separators=(',', ':')).encode('utf-8'))
+        rows.append((token.encode('utf-8'), plan_index))
+
+    token_width = max((len(token) for token, _ in rows), default=0)
+    row_size = token_width + PLAN_INDEX.size
+    slot_count = _slot_count(len(rows))
+    mask = slot_count - 1
+    slots = bytearray(slot_count * row_size)
+    used = bytearray(slot_count)
+    for token, plan_index in rows:
+        slot = zlib.crc32(token) & mask
+        while used[slot]:
+            slot = (slot + 1) & mask
+        used[slot] = 1
+        offset = slot * row_size
+        slots[offset:offset + len(token)] = token
+        PLAN_INDEX.pack_into(slots, offset + token_width, plan_index + 1)
+
+    offsets = [0]
+    for plan in plans:
+        offsets.append(offsets[-1] + len(plan))
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    try:
+        with tempfile.NamedTemporaryFile(dir=output_dir, delete=False) as output:
+            output.write(HEADER.pack(MAGIC, VERSION, len(plans), token_width, len(rows), slot_count))
+            output.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+            output.write(b''.join(plans))
+            output.write(slots)
+        os.chmod(output.name, 0o644)
+        os.replace(output.name, output_path)
+    except OSError as e:
+        raise AccountsError(f"Error writing accounts table {output_path}: {str(e)}")
+    return len(rows)
+
+class AccountsTable(MappingABC):
+    """Read-only token -> account mapping over a memory-mapped accounts table.
+
+    Only the distinct plan definitions become Python objects; a lookup
+    hashes the token and probes fixed-width rows in the mapping, so it is
+    O(1) and the accounts themselves never enter the heap. The pages live in
+    the shared page cache, so every worker mapping the same file shares them.
+    An account is returned as its (shared, read-only) plan definition.
+    """
+
+    def __init__(self, path: str):
+        try:
+            with open(path, 'rb') as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise AccountsError(f"Error opening accounts table {path}: {str(e)}")
+
+        try:
+            self._parse_header()
+        except (struct.error, ValueError, AccountsError) as e:
+            self._mmap.close()
+            raise AccountsError(f"Invalid accounts table {path}: {str(e)}")
+
+    def _parse_header(self) -> None:
+        """Read the header and plans; truncated or corrupt tables raise struct.error or ValueError"""
+        if len(self._mmap) < HEADER.size:
+            raise AccountsError("too short")
+        magic, version, plan_count, token_width, count, slot_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise AccountsError("unknown format")
+        # Lookups probe until an empty slot: a power of two slots, never all used
+        if slot_count < 1 or slot_count & (slot_count - 1) or count >= slot_count:
+            raise AccountsError("invalid slot count")
+
+        plans_start = HEADER.size + (plan_count + 1) * OFFSET.size
+        offsets = [OFFSET.unpack_from(self._mmap, HEADER.size + i * OFFSET.size)[0]
+                   for i in range(plan_count + 1)]
+        self._plans = [
+            MappingProxyType(json.loads(self._mmap[plans_start + start:plans_start + end]))
+            for start, end in zip(offsets, offsets[1:])
+        ]
+        self._count = count
+        self._token_width = token_width
+        self._row_size = token_width + PLAN_INDEX.size
+        self._mask = slot_count - 1
+        self._slots_start = plans_start + offsets[-1]
+        if len(self._mmap) != self._slots_start + slot_count * self._row_size:
+            raise AccountsError("size does not match the header")
+
+    def get(self, token: str, default: Any = None) -> Optional[Mapping[str, Any]]:
+        key = token.encode('utf-8')
+        if len(key) > self._token_width:
+            return default
+        slot = zlib.crc32(key) & self._mask
+        key = key.ljust(self._token_width, b'\0')
+        while True:
+            offset = self._slots_start + slot * self._row_size
+            plan_index = PLAN_INDEX.unpack_from(self._mmap, offset + self._token_width)[0]
+            if not plan_index:
+                return default
+            if self._mmap[offset:offset + self._token_width] == key:
+                return self._plans[plan_index - 1]
+            slot = (slot + 1) & self._mask
+
+    def __getitem__(self, token: str) -> Mapping[str, Any]:
+        account = self.get(token)
+        if account is None:
+            raise KeyError(token)
+        return account
+
+    def __contains__(self, token: object) -> bool:
+        return isinstance(token, str) and self.get(token) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for slot in range(self._mask + 1):
+            offset = self._slots_start + slot * self._row_size
+            if PLAN_INDEX.unpack_from(self._mmap, offset + self._token_width)[0]:
+                yield self._mmap[offset:offset + self._token_width].rstrip(b'\0').decode('utf-8')
+
+    def close(self) -> None:
+        self._mmap.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compile accounts.json into an accounts table")
+    parser.add_argument("input", help="JSON accounts file")
+    parser.add_argument("output", help="Accounts table file to write")
+    args = parser.parse_args()
+    count = build_accounts_table(args.input, args.output)
+    print(f"Wrote {count} accounts to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Mapping, Optional, Tuple
+import settings
+from accounts_table import AccountsError, AccountsTable, is_accounts_table, validate_accounts
+from helpers.bloom_filter import BloomFilter
+from helpers.file_helper import FileError, FileHelper
+from helpers.inotify import DirectoryWatch
+from token_filter import TokenFilter
+
+logger = logging.getLogger(__name__)
+
+# (mtime_ns, size, inode) of the accounts file, None when it is missing
+FileSignature = Optional[Tuple[int, int, int]]
+
+def file_signature(path: str) -> FileSignature:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+class AccountsWatcher:
+    """Keeps an immutable snapshot of the accounts file, reloaded when it changes.
+
+    The file is either JSON or a compiled table built by
+    `accounts_table.build_accounts_table`, which is memory-mapped instead of
+    parsed.
+
+    It is read on first use, or by `start` at the latest, so creating a
+    watcher at import time touches no file. After `start`, a background task
+    compares the file's (mtime, size, inode) every `poll_interval` seconds,
+    and right away when inotify reports a change in its directory. A changed
+    file is parsed and validated in a worker thread and swapped in as a new
+    snapshot; readers just take `snapshot` and never lock. A file that fails
+    to load is logged and the previous snapshot stays in use.
+
+    `token_filter` is reset with every new snapshot. Compiled tables also get
+    a Bloom filter of their tokens and a negative cache; a JSON snapshot is
+    an in-memory dict, which already rejects unknown tokens as cheaply as
+    either would, so it gets neither.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        file_helper: FileHelper = None,
+        poll_interval: float = settings.ACCOUNTS_POLL_INTERVAL,
+        use_inotify: bool = settings.ACCOUNTS_USE_INOTIFY,
+        bloom_false_positive_rate: float = settings.ACCOUNTS_BLOOM_FALSE_POSITIVE_RATE,
+    ):
+        self._path = path
+        self._file_helper = file_helper or FileHelper()
+        self._poll_interval = poll_interval
+        self._use_inotify = use_inotify
+        self._bloom_false_positive_rate = bloom_false_positive_rate
+        self._signature: FileSignature = None
+        self._token_filter = TokenFilter()
+        self._snapshot: Optional[Mapping[str, Mapping[str, Any]]] = None
+        self._watch_task = None
+        self._inotify = None
+        self._changed = None
+        self.reloads = 0
+        self.reload_errors = 0
+
+    @property
+    def snapshot(self) -> Mapping[str, Mapping[str, Any]]:
+        if self._snapshot is None:
+            # Taken before reading: a write racing with the read changes it again
+            self._signature = file_signature(self._path)
+            snapshot, bloom = self._load()
+            self._swap(snapshot, bloom)
+        return self._snapshot
+
+    @property
+    def token_filter(self) -> TokenFilter:
+        # Only meaningful for a loaded snapshot (and its Bloom filter)
+        if self._snapshot is None:
+            self.snapshot
+        return self._token_filter
+
+    def _swap(self, snapshot: Mapping[str, Mapping[str, Any]], bloom: Optional[BloomFilter]) -> None:
+        # No await in between: requests never see a filter built for another snapshot
+        self._snapshot = snapshot
+        self._token_filter.reset(bloom, negative_cache=isinstance(snapshot, AccountsTable))
+
+    def _load(self) -> Tuple[Mapping[str, Mapping[str, Any]], Optional[BloomFilter]]:
+        if not is_accounts_table(self._path):
+            return validate_accounts(self._file_helper.read_json_file(self._path)), None
+        table = AccountsTable(self._path)
+        if self._bloom_false_positive_rate <= 0:
+            return table, None
+        return table, BloomFilter.from_keys(table, len(table), self._bloom_false_positive_rate)
+
+    def start(self) -> None:
+        # A missing or invalid file fails the startup rather than the first request
+        self.snapshot
+        # Created here so it binds to the running event loop
+        self._changed = asyncio.Event()
+        if self._use_inotify:
+            try:
+                inotify = DirectoryWatch(os.path.dirname(os.path.abspath(self._path)))
+            except OSError as e:
+                logger.info(f"Watching {self._path} by polling: {e}")
+            else:
+                asyncio.get_running_loop().add_reader(inotify.fileno(), self._changed.set)
+                self._inotify = inotify
+        self._watch_task = asyncio.create_task(self._watch_loop())
+
+    async def close(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fileno())
+            self._inotify.close()
+            self._inotify = None
+
+    async def reload_if_changed(self) -> bool:
+        """Reload the file when its signature changed; returns whether a new snapshot was swapped in"""
+        signature = file_signature(self._path)
+        if signature == self._signature:
+            return False
+        # Taken before reading: a write racing with the read changes it again
+        self._signature = signature
+        try:
+            snapshot, bloom = await asyncio.get_running_loop().run_in_executor(None, self._load)
+        except (FileError, AccountsError) as e:
+            self.reload_errors += 1
+            logger.error(f"Keeping previous accounts, reloading {self._path} failed: {e}")
+            return False
+        self._swap(snapshot, bloom)
+        self.reloads += 1
+        logger.info(f"Reloaded {len(snapshot)} accounts from {self._path}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'accounts': len(self.snapshot),
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+            'inotify': self._inotify is not None,
+            **self.token_filter.stats()
+        }
+
+    async def _watch_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            if self._inotify is not None:
+                self._inotify.drain()
+            try:
+                await self.reload_if_changed()
+            except Exception:
+                # Whatever the file holds, the watcher keeps running
+                self.reload_errors += 1
+                logger.exception(f"Keeping previous accounts, reloading {self._path} failed")
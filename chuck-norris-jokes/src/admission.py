@@ -0,0 +1,175 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Collection, Deque, Dict
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import settings
+from metrics import NO_PLAN, REQUESTS_REJECTED
+
+class AIMDLimit:
+    """Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    A latency sample above `target_latency`, or a failed request, multiplies
+    the limit by `backoff`, at most once per `target_latency` so one slow
+    burst does not collapse it. Other samples add 1/limit, i.e. about one
+    request per limit's worth of completions, but only while the limit is
+    actually in use (at least half of it in flight).
+    """
+
+    def __init__(
+        self,
+        initial: int = settings.ADMISSION_INITIAL_LIMIT,
+        min_limit: int = settings.ADMISSION_MIN_LIMIT,
+        max_limit: int = settings.ADMISSION_MAX_LIMIT,
+        target_latency: float = settings.ADMISSION_TARGET_LATENCY_MS / 1000,
+        backoff: float = 0.9,
+    ):
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError("Admission limits must satisfy 1 <= min <= initial <= max")
+        self.limit = float(initial)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._target_latency = target_latency
+        self._backoff = backoff
+        self._last_decrease = float('-inf')
+
+    @property
+    def capacity(self) -> int:
+        return int(self.limit)
+
+    def on_sample(self, latency: float, in_flight: int, failed: bool = False) -> None:
+        if failed or latency > self._target_latency:
+            now = time.monotonic()
+            if now - self._last_decrease >= self._target_latency:
+                self._last_decrease = now
+                self.limit = max(self._min_limit, self.limit * self._backoff)
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self._max_limit, self.limit + 1 / self.limit)
+
+class AdmissionController:
+    """Admits up to `limit.capacity` concurrent requests and queues a few more.
+
+    A request over the limit waits in a FIFO queue of at most `queue_size`
+    for up to `queue_timeout` seconds; when the queue is full or the wait
+    times out it is shed. A released slot is handed straight to the oldest
+    waiter. Everything runs on one event loop, so no locking is needed.
+    """
+
+    def __init__(self, limit: AIMDLimit = None, queue_size: int = settings.ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = settings.ADMISSION_QUEUE_TIMEOUT_MS / 1000):
+        self.limit = limit or AIMDLimit()
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    async def acquire(self) -> bool:
+        """Take a slot, return False when the request is shed"""
+        if self.in_flight < self.limit.capacity and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self._queue_size:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self._queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                waiter.cancel()
+                self.timeouts += 1
+                self.shed += 1
+                return False
+        except asyncio.CancelledError:
+            # The client went away: give back a slot handed over meanwhile
+            if waiter.done():
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self, latency: float, failed: bool = False) -> None:
+        self.limit.on_sample(latency, self.in_flight, failed)
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        # Slots are handed over, counted in `in_flight` before the waiter resumes
+        while self._waiters and self.in_flight < self.limit.capacity:
+            self.in_flight += 1
+            self._waiters.popleft().set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit.limit,
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'timeouts': self.timeouts
+        }
+
+_OVERLOAD_REJECTIONS = REQUESTS_REJECTED.labels('503', 'overload', NO_PLAN)
+
+class AdmissionControl:
+    """Pure ASGI middleware shedding load before any other work.
+
+    Added outermost, so a shed request gets its 503 (with Retry-After)
+    before authentication or any Redis call. The latency sample of an
+    admitted request is its time from admission to the response start,
+    which covers rate limiting and waiting on the joke source but neither
+    its own queueing nor the length of a streamed body. Only latency drives
+    the limit down: error statuses (e.g. an upstream 502 or a plan
+    scheduler 503) say nothing about this server's load. The slot is held
+    until the response is complete. `public_paths` (e.g. the metrics
+    endpoint) are never shed.
+    """
+    BODY = b'{"error":"Server overloaded, retry later!"}'
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController, public_paths: Collection[str] = (),
+                 retry_after: int = settings.ADMISSION_RETRY_AFTER):
+        self.app = app
+        self.controller = controller
+        self.public_paths = frozenset(public_paths)
+        self._shed_headers = [
+            (b'content-length', str(len(self.BODY)).encode('latin-1')),
+            (b'content-type', b'application/json'),
+            (b'retry-after', str(retry_after).encode('latin-1'))
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'] in self.public_paths:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        if not await controller.acquire():
+            _OVERLOAD_REJECTIONS.inc()
+            await send({'type': 'http.response.start', 'status': 503, 'headers': self._shed_headers})
+            await send({'type': 'http.response.body', 'body': self.BODY})
+            return
+
+        started = time.perf_counter()
+        latency = None
+
+        async def send_and_time(message: Message) -> None:
+            nonlocal latency
+            if message['type'] == 'http.response.start':
+                latency = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_time)
+        finally:
+            controller.release(latency if latency is not None else time.perf_counter() - started)
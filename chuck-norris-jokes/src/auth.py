@@ -1,19 +1,70 @@
 import json
 import re
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi.responses import JSONResponse
-from rate_limiter import RateLimiter
-from fastapi import Request
-from helpers.cached_accounts_file_helper import CachedAccountsFileHelper
+import time
+from typing import Callable, Collection, Optional
+from starlette.types import ASGIApp, Receive, Scope, Send
+import settings
+from daily_counters import DailyCounters
+from rate_limiter import AsyncRateLimiter, RateLimitBackend
+from rate_limit_algorithms import APPROXIMATE, FIXED_WINDOW, MEMORY_BACKEND, RATE_LIMIT_BACKENDS
+from hybrid_rate_limiter import HybridRateLimiter
+from memory_rate_limiter import MemoryRateLimiter
+from accounts_watcher import AccountsWatcher
+from metrics import NO_PLAN, REQUESTS_REJECTED, STAGE_SECONDS
 
-rate_limiter = RateLimiter()
+if settings.RATE_LIMIT_BACKEND not in RATE_LIMIT_BACKENDS:
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
 
-class Auth(BaseHTTPMiddleware):
+# Limiters for exact and approximate accounts, started and closed by the app's lifecycle
+rate_limiter: RateLimitBackend
+hybrid_rate_limiter: RateLimitBackend
+daily_counters = None
+if settings.RATE_LIMIT_BACKEND == MEMORY_BACKEND:
+    # Local state needs no approximation: approximate accounts are limited exactly too
+    rate_limiter = hybrid_rate_limiter = MemoryRateLimiter()
+else:
+    # Write-behind daily limits, started and flushed by the app's lifecycle
+    daily_counters = DailyCounters() if settings.DAILY_LIMIT_WRITE_BEHIND else None
+    rate_limiter = AsyncRateLimiter(daily_counters=daily_counters)
+    hybrid_rate_limiter = HybridRateLimiter()
+
+_AUTH_SECONDS = STAGE_SECONDS.labels('auth')
+_RATE_LIMIT_SECONDS = STAGE_SECONDS.labels('rate_limit')
+_INVALID_FORMAT_REJECTIONS = REQUESTS_REJECTED.labels('403', 'invalid_token_format', NO_PLAN)
+_FILTERED_TOKEN_REJECTIONS = REQUESTS_REJECTED.labels('403', 'unknown_token_filtered', NO_PLAN)
+_UNKNOWN_TOKEN_REJECTIONS = REQUESTS_REJECTED.labels('403', 'unknown_token', NO_PLAN)
+
+def _error_body(message: str) -> bytes:
+    # Same bytes JSONResponse renders for {'error': message}
+    return json.dumps({'error': message}, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+class Auth:
+    """Pure ASGI authentication and rate limiting middleware.
+
+    Works on the raw ASGI scope instead of wrapping requests and responses
+    like BaseHTTPMiddleware, so authorised requests pass straight through to
+    the app (streaming responses included). The account of an authorised
+    request is stored in the scope state, available as `request.state.account`.
+    Accounts are looked up in the watcher's current snapshot, so changes to
+    the accounts file apply without a restart; its token filter sheds
+    unknown tokens before the lookup. Requests to `public_paths` (e.g. the
+    metrics endpoint) skip authentication and rate limiting. `request_cost`
+    says how many requests a request is charged against the limits (e.g. a
+    bulk request for N jokes costs N); by default every request costs 1. A
+    request costing more than the account's `rate_limit` gets a 422.
+    """
     TOKEN_PATTERN = re.compile(r'^[\d-]+$')  # Only numbers and hyphens
 
-    def __init__(self, app, accounts_path: str, file_helper: CachedAccountsFileHelper):
-        super().__init__(app)
-        self.accounts = file_helper.read_json_file(accounts_path)
+    INVALID_TOKEN_FORMAT = _error_body('Invalid token format!')
+    INVALID_TOKEN = _error_body('Invalid token!')
+    RATE_LIMIT_EXCEEDED = _error_body('Rate limit exceeded!')
+
+    def __init__(self, app: ASGIApp, accounts: AccountsWatcher, public_paths: Collection[str] = (),
+                 request_cost: Callable[[Scope], int] = None):
+        self.app = app
+        self.accounts = accounts
+        self.public_paths = frozenset(public_paths)
+        self.request_cost = request_cost
 
     def _validate_token(self, token: str) -> bool:
         """Validate token format"""
@@ -21,26 +72,78 @@ class Auth(BaseHTTPMiddleware):
             return False
         return bool(self.TOKEN_PATTERN.match(token))
 
-    async def dispatch(self, request, call_next):
-        auth_token = request.headers.get('authorization')
-        
+    @staticmethod
+    def _get_token(scope: Scope) -> Optional[str]:
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                return value.decode('latin-1')
+        return None
+
+    @staticmethod
+    async def _reject(send: Send, status_code: int, body: bytes) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': status_code,
+            'headers': [
+                (b'content-length', str(len(body)).encode('latin-1')),
+                (b'content-type', b'application/json')
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'] in self.public_paths:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        auth_token = self._get_token(scope)
+
         if not self._validate_token(auth_token):
-            return JSONResponse(status_code=403, content={'error': 'Invalid token format!'})
-            
-        if auth_token not in self.accounts:
-            return JSONResponse(status_code=403, content={'error': 'Invalid token!'})
-            
-        account = self.accounts[auth_token]
-        # Check rate limits
-        if not rate_limiter.is_allowed(
+            _AUTH_SECONDS.observe(time.perf_counter() - started)
+            _INVALID_FORMAT_REJECTIONS.inc()
+            await self._reject(send, 403, self.INVALID_TOKEN_FORMAT)
+            return
+
+        token_filter = self.accounts.token_filter
+        if token_filter.rejects(auth_token):
+            _AUTH_SECONDS.observe(time.perf_counter() - started)
+            _FILTERED_TOKEN_REJECTIONS.inc()
+            await self._reject(send, 403, self.INVALID_TOKEN)
+            return
+
+        account = self.accounts.snapshot.get(auth_token)
+        if account is None:
+            token_filter.remember(auth_token)
+            _AUTH_SECONDS.observe(time.perf_counter() - started)
+            _UNKNOWN_TOKEN_REJECTIONS.inc()
+            await self._reject(send, 403, self.INVALID_TOKEN)
+            return
+
+        limiter = hybrid_rate_limiter if account.get('rate_limit_mode') == APPROXIMATE else rate_limiter
+        checked = time.perf_counter()
+        _AUTH_SECONDS.observe(checked - started)
+        cost = 1 if self.request_cost is None else self.request_cost(scope)
+        if cost > account['rate_limit']:
+            # No second could ever admit it, whatever the algorithm: say so instead of a 429 on every try
+            REQUESTS_REJECTED.labels('422', 'cost_over_rate_limit', account.get('plan', NO_PLAN)).inc()
+            await self._reject(send, 422, _error_body(
+                f"Request costs {cost} requests, over the rate limit of {account['rate_limit']} per second!"
+            ))
+            return
+        # Check rate limits; the algorithm is an account field like the limits, there are no plan-level settings
+        allowed = await limiter.is_allowed(
             auth_token,
             account['rate_limit'],
-            account.get('daily_limit')
-        ):
-            return JSONResponse(
-                status_code=429,
-                content={'error': 'Rate limit exceeded!'}
-            )
-            
-        request.account = account
-        return await call_next(request)
\ No newline at end of file
+            account.get('daily_limit'),
+            account.get('rate_limit_algorithm', FIXED_WINDOW),
+            cost
+        )
+        _RATE_LIMIT_SECONDS.observe(time.perf_counter() - checked)
+        if not allowed:
+            REQUESTS_REJECTED.labels('429', 'rate_limit', account.get('plan', NO_PLAN)).inc()
+            await self._reject(send, 429, self.RATE_LIMIT_EXCEEDED)
+            return
+
+        scope.setdefault('state', {})['account'] = account
+        await self.app(scope, receive, send)
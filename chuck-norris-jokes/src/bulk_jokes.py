@@ -0,0 +1,49 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
+from urllib.parse import parse_qsl
+from starlette.types import Scope
+import settings
+from joke import Joke
+
+BULK_PATH = '/jokes'
+
+def request_cost(scope: Scope, max_count: int = settings.JOKES_MAX_COUNT) -> int:
+    """Requests a request is charged against the rate limits: `count` for GET /jokes, otherwise 1.
+
+    A missing or invalid count costs 1; the route then rejects it.
+    """
+    if scope['path'] != BULK_PATH:
+        return 1
+    for name, value in parse_qsl(scope.get('query_string', b'').decode('latin-1')):
+        if name == 'count':
+            try:
+                count = int(value)
+            except ValueError:
+                return 1
+            return min(max(count, 1), max_count)
+    return 1
+
+async def stream_jokes(
+    fetch_joke: Callable[[], Awaitable[Joke]],
+    count: int,
+    concurrency: int = settings.JOKES_FETCH_CONCURRENCY,
+) -> AsyncIterator[Joke]:
+    """Yield `count` jokes in completion order, at most `concurrency` fetches in flight.
+
+    Only the fetches in flight are held, so memory does not grow with
+    `count`. The first failed fetch is raised; fetches still in flight are
+    cancelled when the consumer stops early or a fetch fails.
+    """
+    pending = set()
+    started = 0
+    try:
+        while started < count or pending:
+            while started < count and len(pending) < concurrency:
+                pending.add(asyncio.ensure_future(fetch_joke()))
+                started += 1
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
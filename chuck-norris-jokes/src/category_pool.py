@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import random
+import re
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+import settings
+from joke import Joke, UnknownCategoryError
+from upstream_client import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_PATTERN = re.compile(r'^[a-z0-9_-]{1,32}$')
+# Categories upstream answered 404 for, remembered so they fail fast
+MAX_UNKNOWN_CATEGORIES = 1024
+
+class CategoryIndex:
+    """Recently seen jokes, indexed by category and bounded to `size` jokes.
+
+    Every joke fetched for any request is offered to the index, so a
+    category can be served from memory even before it has a buffer of its
+    own. The oldest jokes are evicted first; a random joke of a category is
+    O(1) (each category keeps a list of joke IDs and their positions).
+    """
+
+    def __init__(self, size: int = settings.JOKE_CATEGORY_INDEX_SIZE):
+        self._size = size
+        self._jokes: 'OrderedDict[str, Joke]' = OrderedDict()
+        self._ids: Dict[str, List[str]] = {}
+        self._positions: Dict[str, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._jokes)
+
+    def add(self, joke: Joke) -> None:
+        if self._size <= 0 or not joke.categories or joke.id in self._jokes:
+            return
+        self._jokes[joke.id] = joke
+        for category in set(joke.categories):
+            ids = self._ids.setdefault(category, [])
+            self._positions.setdefault(category, {})[joke.id] = len(ids)
+            ids.append(joke.id)
+        if len(self._jokes) > self._size:
+            _, evicted = self._jokes.popitem(last=False)
+            for category in set(evicted.categories):
+                self._remove(category, evicted.id)
+
+    def _remove(self, category: str, joke_id: str) -> None:
+        ids = self._ids[category]
+        positions = self._positions[category]
+        # Swap with the last ID so removal is O(1)
+        position = positions.pop(joke_id)
+        last = ids.pop()
+        if last != joke_id:
+            ids[position] = last
+            positions[last] = position
+        if not ids:
+            del self._ids[category]
+            del self._positions[category]
+
+    def random_joke(self, category: str) -> Optional[Joke]:
+        ids = self._ids.get(category)
+        if not ids:
+            return None
+        return self._jokes[random.choice(ids)]
+
+    def categories(self) -> List[str]:
+        return sorted(self._ids)
+
+class _Category:
+    """Buffer and demand of one category"""
+    __slots__ = ('jokes', 'target', 'demand')
+
+    def __init__(self):
+        self.jokes: Deque[Joke] = deque()
+        self.target = 0
+        self.demand = 0.0
+
+class CategoryJokePools:
+    """Per-category prefetch buffers sharing one capacity, split by demand.
+
+    `fetch_joke(category)` pops from the category's buffer. When the buffer
+    is empty it serves a recently seen joke of the category from the
+    `index` instead (which may repeat a joke), and only fetches upstream
+    when the category has never been seen.
+
+    A category gets a buffer once it has been fetched successfully. Every
+    `rebalance_interval` seconds (and when a category is added), `capacity`
+    is split between the categories in proportion to their demand, which
+    halves each interval so the split follows recent traffic. A background
+    task keeps each buffer filled up to its share, refilling it once it
+    drops to a quarter of it, with `refill_fetch_joke` when given (e.g. to
+    bypass a coalescer). Jokes fetched for any other path can be fed to the
+    index with `observe` or the `indexing` wrapper.
+    """
+
+    def __init__(
+        self,
+        fetch_joke: Callable[[str], Awaitable[Joke]],
+        capacity: int = settings.JOKE_CATEGORY_POOL_SIZE,
+        index: CategoryIndex = None,
+        rebalance_interval: float = settings.JOKE_CATEGORY_REBALANCE_INTERVAL,
+        refill_concurrency: int = settings.JOKE_POOL_REFILL_CONCURRENCY,
+        retry_delay: float = 1.0,
+        refill_fetch_joke: Callable[[str], Awaitable[Joke]] = None,
+    ):
+        self._fetch_joke = fetch_joke
+        self._refill_fetch_joke = refill_fetch_joke or fetch_joke
+        self._capacity = capacity
+        self.index = index if index is not None else CategoryIndex()
+        self._rebalance_interval = rebalance_interval
+        self._refill_concurrency = refill_concurrency
+        self._retry_delay = retry_delay
+        self._categories: Dict[str, _Category] = {}
+        self._unknown = set()
+        self._refill_needed = asyncio.Event()
+        self._refill_task = None
+        self.hits = 0
+        self.index_hits = 0
+        self.misses = 0
+
+    def start(self) -> None:
+        self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def close(self) -> None:
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    def observe(self, joke: Joke) -> None:
+        self.index.add(joke)
+
+    def indexing(self, fetch_joke: Callable[[], Awaitable[Joke]]) -> Callable[[], Awaitable[Joke]]:
+        """Wrap a random joke source so everything it fetches is indexed"""
+        async def fetch_and_index() -> Joke:
+            joke = await fetch_joke()
+            self.index.add(joke)
+            return joke
+        return fetch_and_index
+
+    def targets(self) -> Dict[str, int]:
+        return {name: category.target for name, category in self._categories.items()}
+
+    async def fetch_joke(self, category: str) -> Joke:
+        if not CATEGORY_PATTERN.match(category) or category in self._unknown:
+            raise UnknownCategoryError(f"Unknown joke category: {category}")
+
+        state = self._categories.get(category)
+        if state is not None:
+            state.demand += 1
+            if state.jokes:
+                self.hits += 1
+                joke = state.jokes.popleft()
+                if len(state.jokes) <= state.target // 4:
+                    self._refill_needed.set()
+                return joke
+
+        joke = self.index.random_joke(category)
+        if joke is not None:
+            self.index_hits += 1
+        else:
+            self.misses += 1
+            try:
+                joke = await self._fetch_joke(category)
+            except UnknownCategoryError:
+                self._mark_unknown(category)
+                raise
+            self.index.add(joke)
+        if state is None:
+            self._add_category(category)
+        self._refill_needed.set()
+        return joke
+
+    def _mark_unknown(self, name: str) -> None:
+        if len(self._unknown) >= MAX_UNKNOWN_CATEGORIES:
+            self._unknown.clear()
+        self._unknown.add(name)
+
+    def _add_category(self, name: str) -> None:
+        state = self._categories.get(name)
+        if state is None:
+            state = self._categories[name] = _Category()
+            state.demand = 1
+            self._rebalance(decay=False)
+
+    def _rebalance(self, decay: bool = True) -> None:
+        """Split the capacity between categories in proportion to their demand"""
+        categories = self._categories
+        total = sum(category.demand for category in categories.values())
+        if total <= 0:
+            return
+        shares = {name: self._capacity * category.demand / total for name, category in categories.items()}
+        targets = {name: int(share) for name, share in shares.items()}
+        # Largest remainders get the slots left over by rounding down
+        leftover = self._capacity - sum(targets.values())
+        for name in sorted(shares, key=lambda name: shares[name] - targets[name], reverse=True)[:leftover]:
+            targets[name] += 1
+        for name, category in categories.items():
+            category.target = targets[name]
+            while len(category.jokes) > category.target:
+                category.jokes.pop()
+            if decay:
+                category.demand /= 2
+
+    async def _refill_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_rebalance = loop.time() + self._rebalance_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), max(0.0, next_rebalance - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._refill_needed.clear()
+            if loop.time() >= next_rebalance:
+                self._rebalance()
+                next_rebalance = loop.time() + self._rebalance_interval
+            try:
+                await self._refill()
+            except UpstreamError as e:
+                logger.warning(f"Category pool refill failed, retrying in {self._retry_delay}s: {e}")
+                await asyncio.sleep(self._retry_delay)
+                self._refill_needed.set()
+
+    async def _refill(self) -> None:
+        """Refill the categories due at once; one failing does not hold up the others"""
+        due = [(name, category) for name, category in self._categories.items()
+               if len(category.jokes) <= category.target // 4]
+        # Bounds the fetches of all categories together
+        slots = asyncio.Semaphore(self._refill_concurrency)
+        results = await asyncio.gather(*(self._refill_category(name, category, slots) for name, category in due),
+                                       return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise UpstreamError(f"Refilling {len(errors)} of {len(due)} categories failed: {errors[0]}")
+
+    async def _refill_category(self, name: str, category: _Category, slots: asyncio.Semaphore) -> None:
+        async def fetch() -> Joke:
+            async with slots:
+                return await self._refill_fetch_joke(name)
+
+        while len(category.jokes) < category.target:
+            batch = min(self._refill_concurrency, category.target - len(category.jokes))
+            results = await asyncio.gather(*(fetch() for _ in range(batch)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Joke):
+                    self.index.add(result)
+                    if len(category.jokes) < category.target:
+                        category.jokes.append(result)
+            if any(isinstance(result, UnknownCategoryError) for result in results):
+                # The category disappeared upstream: don't serve it from the index either
+                self._categories.pop(name, None)
+                self._mark_unknown(name)
+                return
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                raise UpstreamError(f"{len(errors)} of {batch} fetches for {name} failed: {errors[0]}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'categories': len(self._categories),
+            'buffered': sum(len(category.jokes) for category in self._categories.values()),
+            'indexed': len(self.index),
+            'hits': self.hits,
+            'index_hits': self.index_hits,
+            'misses': self.misses
+        }
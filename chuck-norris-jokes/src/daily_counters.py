@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+from redis import RedisError
+import settings
+from helpers.circuit_breaker import CircuitBreaker
+from rate_limit_algorithms import SECONDS_IN_DAY, SYNC_COUNTERS_SCRIPT
+from redis_connection import get_async_redis, get_circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+class _DailyCount:
+    """Last known total of one daily counter + unflushed local increments"""
+    __slots__ = ('client', 'breaker', 'count', 'pending', 'flushing', 'last_seen')
+
+    def __init__(self, client: Any, breaker: CircuitBreaker, count: int):
+        self.client = client
+        self.breaker = breaker
+        self.count = count
+        self.pending = 0
+        self.flushing = 0
+        self.last_seen = time.monotonic()
+
+class DailyCounters:
+    """Write-behind daily limit counters.
+
+    `charge` enforces a daily limit against the counter's last known total
+    plus the increments not flushed yet, without a Redis call; only the first
+    charge of a counter in this worker reads its total. Every
+    `flush_interval` seconds the pending increments of all counters are
+    added to Redis in one script call per node, whose replies refresh their
+    totals with the other workers' admissions; a counter gets its TTL only
+    when the increment created it. Pending increments are kept when a flush
+    fails, and pushed by `close` on shutdown, after a flush still running.
+    A flush only visits the counters charged since the last one, and
+    counters idle for `idle_timeout` are dropped oldest first, so neither
+    scans every counter.
+
+    Over-admission bound: a worker admits against totals at most one flush
+    interval old, so a token can exceed its daily limit by what its other
+    workers admit in one interval (at most their per-second limit times the
+    interval).
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = settings.DAILY_LIMIT_FLUSH_INTERVAL_MS / 1000,
+        idle_timeout: float = 60.0,
+        breaker: CircuitBreaker = None,
+    ):
+        self.redis = get_async_redis()
+        self._sync_counters_script = self.redis.register_script(SYNC_COUNTERS_SCRIPT)
+        self._breaker = breaker or get_circuit_breaker()
+        self._flush_interval = flush_interval
+        self._idle_timeout = idle_timeout
+        # In order of last charge, oldest first
+        self._counts: 'OrderedDict[str, _DailyCount]' = OrderedDict()
+        # Counters with pending increments
+        self._dirty: Set[str] = set()
+        # Increments not in Redis yet, pending or being flushed
+        self._unflushed = 0
+        self._flush_task = None
+        # Created on first use so it binds to the running event loop
+        self._flush_lock = None
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def start(self) -> None:
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Stop the background flush and push the remaining increments"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def charge(self, key: str, limit: int, amount: int = 1, client: Any = None,
+                     breaker: CircuitBreaker = None) -> bool:
+        """Add `amount` to the counter `key` (kept on `client`'s node) if the total stays within `limit`"""
+        state = self._counts.get(key)
+        if state is None:
+            state = await self._load(key, self.redis if client is None else client,
+                                     self._breaker if breaker is None else breaker)
+        state.last_seen = time.monotonic()
+        self._counts.move_to_end(key)
+        if state.count + state.pending + state.flushing + amount > limit:
+            return False
+        state.pending += amount
+        self._unflushed += amount
+        self._dirty.add(key)
+        return True
+
+    async def _load(self, key: str, client: Any, breaker: CircuitBreaker) -> _DailyCount:
+        count = 0
+        if breaker.allow_request():
+            try:
+                count = int(await client.get(key) or 0)
+            except RedisError as e:
+                breaker.record_failure()
+                logger.error(f"Reading daily counter {key} failed, counting from 0: {e}")
+            else:
+                breaker.record_success()
+        # Another request may have loaded it meanwhile
+        return self._counts.setdefault(key, _DailyCount(client, breaker, count))
+
+    async def flush(self) -> bool:
+        """Push pending increments and refresh the totals they were added to"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        # Flushes are serialised so the same increments are never pushed twice
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> bool:
+        if not self._dirty:
+            return True
+        nodes: Dict[Tuple[Any, CircuitBreaker], List[str]] = {}
+        for key in self._dirty:
+            state = self._counts[key]
+            nodes.setdefault((state.client, state.breaker), []).append(key)
+        # Charges made while the scripts run mark their counters dirty again
+        self._dirty = set()
+        results = await asyncio.gather(*(self._flush_node(client, breaker, keys)
+                                         for (client, breaker), keys in nodes.items()))
+        return all(results)
+
+    async def _flush_node(self, client: Any, breaker: CircuitBreaker, keys: List[str]) -> bool:
+        if not breaker.allow_request():
+            self._dirty.update(keys)
+            return False
+        deltas = []
+        for key in keys:
+            state = self._counts[key]
+            # Admissions made while the script runs stay pending for the next flush
+            state.flushing, state.pending = state.pending, 0
+            deltas.append(state.flushing)
+        try:
+            totals = await self._sync_counters_script(keys=keys, args=deltas + [SECONDS_IN_DAY] * len(keys),
+                                                      client=client)
+        except asyncio.CancelledError:
+            # Cancelled by a shutdown: keep the increments for the final flush
+            self._restore(keys)
+            raise
+        except RedisError as e:
+            self._restore(keys)
+            breaker.record_failure()
+            self.flush_errors += 1
+            logger.error(f"Flushing daily counters failed, retrying later: {e}")
+            return False
+        breaker.record_success()
+        self.flushes += 1
+
+        for key, total in zip(keys, totals):
+            state = self._counts[key]
+            state.count = total
+            self._unflushed -= state.flushing
+            state.flushing = 0
+        return True
+
+    def _restore(self, keys: List[str]) -> None:
+        for key in keys:
+            state = self._counts[key]
+            state.pending += state.flushing
+            state.flushing = 0
+            self._dirty.add(key)
+
+    def _prune_idle(self) -> None:
+        cutoff = time.monotonic() - self._idle_timeout
+        while self._counts:
+            key, state = next(iter(self._counts.items()))
+            # Counters not in Redis yet stay, and so do the ones charged after them
+            if state.last_seen >= cutoff or state.pending or state.flushing:
+                break
+            del self._counts[key]
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            # Shielded: cancelling the loop on shutdown lets a running flush finish
+            await asyncio.shield(self.flush())
+            self._prune_idle()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'counters': len(self._counts),
+            'pending': self._unflushed,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors
+        }
@@ -0,0 +1,55 @@
+import math
+from typing import Iterable
+
+class BloomFilter:
+    """Bloom filter over strings, sized for `capacity` keys at `false_positive_rate`.
+
+    Answers "definitely absent" or "maybe present". Probe positions come from
+    the key's built-in hash (cached on str objects) split into two halves for
+    double hashing, so a filter is only meaningful inside the process that
+    built it.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false_positive_rate must be between 0 and 1")
+        capacity = max(1, capacity)
+        bits = -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        self._hashes = max(1, round(bits / capacity * math.log(2)))
+        # A power of two, so probe positions are a mask away from the hash
+        self._size = 1 << max(3, math.ceil(math.log2(bits)))
+        self._mask = self._size - 1
+        self._bits = bytearray(self._size // 8)
+
+    @classmethod
+    def from_keys(cls, keys: Iterable[str], capacity: int, false_positive_rate: float = 0.01) -> 'BloomFilter':
+        bloom = cls(capacity, false_positive_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def add(self, key: str) -> None:
+        h = hash(key)
+        position = h & 0xFFFFFFFF
+        step = (h >> 32 & 0xFFFFFFFF) | 1
+        bits = self._bits
+        mask = self._mask
+        for _ in range(self._hashes):
+            position = (position + step) & mask
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        h = hash(key)
+        position = h & 0xFFFFFFFF
+        step = (h >> 32 & 0xFFFFFFFF) | 1
+        bits = self._bits
+        mask = self._mask
+        for _ in range(self._hashes):
+            position = (position + step) & mask
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        """Size in bits"""
+        return self._size
@@ -0,0 +1,70 @@
+import logging
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    rejects calls for `reset_timeout` seconds. It then lets a single probe
+    through (half-open): a success closes it again, a failure re-opens it.
+    Callers check `allow_request` before the call and report the outcome
+    with `record_success` / `record_failure`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        # A probe that never reported back (e.g. a cancelled request) expires
+        # after another reset_timeout, so the breaker cannot stay half-open forever.
+        if state == HALF_OPEN and (
+            not self._probe_in_flight or
+            self._clock() - self._probe_started_at >= self._reset_timeout
+        ):
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+            self._probe_started_at = self._clock()
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self._state != CLOSED:
+            logger.info("Circuit breaker closed")
+        self._state = CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._state == HALF_OPEN or self._failures >= self._failure_threshold:
+            if self._state != OPEN:
+                logger.warning(f"Circuit breaker opened after {self._failures} consecutive failures")
+            self._state = OPEN
+            self._opened_at = self._clock()
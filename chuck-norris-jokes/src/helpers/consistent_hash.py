@@ -0,0 +1,61 @@
+from bisect import bisect
+from hashlib import blake2b
+from typing import Dict, Generic, Iterable, List, TypeVar
+
+Node = TypeVar('Node')
+
+def _hash(key: str) -> int:
+    # Stable across processes and hosts, unlike the built-in hash of str
+    return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class ConsistentHashRing(Generic[Node]):
+    """Consistent hash ring mapping keys to nodes named by their str().
+
+    Each node is placed on the ring at `replicas` points (virtual nodes), so
+    keys spread evenly and adding or removing one of N nodes only moves about
+    1/N of the keys, all of them to or from that node. Every process building
+    a ring from the same node names maps keys the same way.
+    """
+
+    def __init__(self, nodes: Iterable[Node] = (), replicas: int = 160):
+        if replicas < 1:
+            raise ValueError("replicas must be at least 1")
+        self._replicas = replicas
+        self._nodes: Dict[str, Node] = {}
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def nodes(self) -> List[Node]:
+        return list(self._nodes.values())
+
+    def add(self, node: Node) -> None:
+        name = str(node)
+        if name in self._nodes:
+            raise ValueError(f"Node {name} is already on the ring")
+        self._nodes[name] = node
+        self._rebuild()
+
+    def remove(self, node: Node) -> None:
+        del self._nodes[str(node)]
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        points = sorted((_hash(f'{name}#{replica}'), name)
+                        for name in self._nodes for replica in range(self._replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [name for _, name in points]
+
+    def node_for(self, key: str) -> Node:
+        """The node owning `key`: the first virtual node clockwise from its hash"""
+        if not self._points:
+            raise LookupError("The ring has no nodes")
+        index = bisect(self._points, _hash(key))
+        if index == len(self._points):
+            index = 0
+        return self._nodes[self._owners[index]]
@@ -0,0 +1,59 @@
+import ctypes
+import ctypes.util
+import os
+
+# Event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+# Everything that can change a file in place or replace it (editors and
+# deploy tools usually write a temp file and rename it over the original)
+FILE_CHANGES = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+class DirectoryWatch:
+    """Non-blocking inotify watch on one directory (Linux only).
+
+    Raises OSError when inotify is not available. Only tells that something
+    in the directory changed; callers decide what changed.
+    """
+
+    def __init__(self, path: str, mask: int = FILE_CHANGES):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify is not available: {e}")
+
+        self._fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), path)
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def drain(self) -> bool:
+        """Discard the queued events; returns whether there were any"""
+        had_events = False
+        while True:
+            try:
+                if not os.read(self._fd, 65536):
+                    return had_events
+            except BlockingIOError:
+                return had_events
+            had_events = True
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
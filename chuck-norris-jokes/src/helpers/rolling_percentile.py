@@ -0,0 +1,45 @@
+from typing import List, Optional
+
+class RollingPercentile:
+    """A percentile of the last `size` samples.
+
+    Samples go into a ring buffer in O(1). The percentile is recomputed by
+    sorting the buffer only every `refresh_every` samples, so reading it on
+    every request stays cheap and it tracks shifts in the distribution
+    within `refresh_every` samples. It is None until `min_samples` samples
+    were seen.
+    """
+
+    def __init__(self, percentile: float, size: int = 1000, min_samples: int = 20, refresh_every: int = 50):
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100")
+        if size < 1 or not 1 <= min_samples <= size or refresh_every < 1:
+            raise ValueError("Need size >= min_samples >= 1 and refresh_every >= 1")
+        self._percentile = percentile
+        self._samples: List[float] = []
+        self._size = size
+        self._next = 0
+        self._min_samples = min_samples
+        self._refresh_every = refresh_every
+        self._until_refresh = min_samples
+        self.value: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, sample: float) -> None:
+        if len(self._samples) < self._size:
+            self._samples.append(sample)
+        else:
+            self._samples[self._next] = sample
+            self._next = (self._next + 1) % self._size
+        self._until_refresh -= 1
+        if self._until_refresh <= 0:
+            self._until_refresh = self._refresh_every
+            self._refresh()
+
+    def _refresh(self) -> None:
+        ordered = sorted(self._samples)
+        # Nearest rank
+        rank = max(1, -(-len(ordered) * self._percentile // 100))
+        self.value = ordered[int(rank) - 1]
@@ -0,0 +1,82 @@
+from typing import Dict, Generic, Hashable, Iterable, List, Optional, Set, TypeVar
+
+Key = TypeVar('Key', bound=Hashable)
+
+class TimingWheel(Generic[Key]):
+    """Hashed timing wheel with one bucket per tick: keys expired without scanning other keys.
+
+    Time is cut into `resolution`-second ticks and a key sits in the bucket
+    of its deadline's tick. Buckets are kept in a dict keyed by tick rather
+    than in a fixed ring of slots, so keys due laps ahead never share a
+    bucket with keys due now. Scheduling or moving a key is O(1), and
+    `expire` only visits the buckets of the ticks that ended since its last
+    call and the keys in them, all of which are due.
+    """
+
+    def __init__(self, resolution: float = 1.0):
+        if resolution <= 0:
+            raise ValueError("A timing wheel needs a positive resolution")
+        self._resolution = resolution
+        self._buckets: Dict[int, Set[Key]] = {}
+        self._ticks: Dict[Key, int] = {}
+        # Last tick processed by `expire`, None before its first call
+        self._tick: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._ticks)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self._ticks
+
+    def schedule(self, key: Key, deadline: float) -> None:
+        """Expire `key` once `deadline` has passed, replacing its previous deadline"""
+        tick = int(deadline // self._resolution)
+        if self._tick is not None and tick <= self._tick:
+            # That tick was processed already: expire with the next one
+            tick = self._tick + 1
+        previous = self._ticks.get(key)
+        if previous == tick:
+            return
+        if previous is not None:
+            self._discard(key, previous)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = set()
+        bucket.add(key)
+        self._ticks[key] = tick
+
+    def cancel(self, key: Key) -> None:
+        tick = self._ticks.pop(key, None)
+        if tick is not None:
+            self._discard(key, tick)
+
+    def _discard(self, key: Key, tick: int) -> None:
+        bucket = self._buckets[tick]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[tick]
+
+    def expire(self, now: float) -> List[Key]:
+        """Remove and return the keys whose deadline tick ended by `now`.
+
+        Keys expire up to one `resolution` late; calls within a tick already
+        processed return at once.
+        """
+        done = int(now // self._resolution) - 1  # Last tick fully in the past
+        if self._tick is not None and done <= self._tick:
+            return []
+        ticks: Iterable[int]
+        if self._tick is None or done - self._tick > len(self._buckets):
+            # After a long pause there are fewer buckets than ticks to walk
+            ticks = sorted(tick for tick in self._buckets if tick <= done)
+        else:
+            ticks = range(self._tick + 1, done + 1)
+        expired = []
+        for tick in ticks:
+            bucket = self._buckets.pop(tick, None)
+            if bucket:
+                for key in bucket:
+                    del self._ticks[key]
+                expired.extend(bucket)
+        self._tick = done
+        return expired
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from redis import RedisError
+import settings
+from helpers.circuit_breaker import CircuitBreaker
+from helpers.time_helpers import get_current_timestamp, get_start_of_day_timestamp
+from rate_limit_algorithms import SYNC_COUNTERS_SCRIPT
+from rate_limiter import BaseRateLimiter, RateLimitBackend, SECONDS_IN_DAY
+from redis_connection import get_async_redis, get_async_redis_shards
+
+logger = logging.getLogger(__name__)
+
+class _TokenState:
+    """Local view of one token's counters: last synced total + unsynced admissions"""
+    __slots__ = ('rate_window', 'rate_count', 'rate_pending',
+                 'daily_window', 'daily_count', 'daily_pending', 'last_seen')
+
+    def __init__(self, rate_window: int, daily_window: int):
+        self.rate_window = rate_window
+        self.rate_count = 0
+        self.rate_pending = 0
+        self.daily_window = daily_window
+        self.daily_count = 0
+        self.daily_pending = 0
+        self.last_seen = 0.0
+
+class HybridRateLimiter(BaseRateLimiter, RateLimitBackend):
+    """Approximate rate limiter deciding locally and reconciling with Redis in batches.
+
+    Each worker admits requests against its last known global counts plus
+    the admissions it has not synced yet, so most decisions never touch
+    Redis. Unsynced admissions are added to the shared `rate:` and `daily:`
+    counters in one script call (per Redis node when sharded) every
+    `sync_interval` seconds, or inline once a token has `batch` unsynced
+    admissions, which also refreshes the global counts. The periodic sync
+    only visits the tokens admitted since the last one, and tokens idle for
+    `idle_timeout` are dropped oldest first, so neither scans every token.
+
+    Over-admission bound: a worker never holds more than `batch` unsynced
+    admissions per token, where batch = min(sync_requests,
+    ceil(local_share * rate_limit)): an admission whose `cost` would take it
+    past that syncs first, and one costing more than `batch` is decided on
+    the refreshed counts and pushed right away. Once a token's global count reaches its
+    limit, each worker admits at most `batch` more before it syncs and sees
+    it, so with W workers a token can exceed its per-second or daily limit
+    by at most W * batch requests per window. While Redis is unavailable
+    and the limiter fails open, each worker enforces the limits on its own.
+    """
+
+    def __init__(
+        self,
+        sync_interval: float = settings.RATE_LIMIT_SYNC_INTERVAL_MS / 1000,
+        sync_requests: int = settings.RATE_LIMIT_SYNC_REQUESTS,
+        local_share: float = settings.RATE_LIMIT_LOCAL_SHARE,
+        idle_timeout: float = 60.0,
+        breaker: CircuitBreaker = None,
+        fail_open: bool = settings.RATE_LIMIT_FAIL_OPEN,
+    ):
+        super().__init__(breaker, fail_open, get_async_redis_shards())
+        self.redis = get_async_redis()
+        self._sync_counters_script = self.redis.register_script(SYNC_COUNTERS_SCRIPT)
+        self._sync_interval = sync_interval
+        self._sync_requests = sync_requests
+        self._local_share = local_share
+        self._idle_timeout = idle_timeout
+        # In order of last use, oldest first
+        self._states: 'OrderedDict[str, _TokenState]' = OrderedDict()
+        # Tokens with unsynced admissions
+        self._unsynced: Set[str] = set()
+        self._sync_task = None
+        # Created on first use so it binds to the running event loop
+        self._sync_lock = None
+        self.local_decisions = 0
+        self.syncs = 0
+
+    def start(self) -> None:
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def close(self) -> None:
+        """Stop the background sync and push the remaining admissions"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+        await self.sync(list(self._unsynced))
+
+    def _batch_size(self, rate_limit: int) -> int:
+        return max(1, min(self._sync_requests, math.ceil(self._local_share * rate_limit)))
+
+    def _state_for(self, token: str) -> _TokenState:
+        rate_window = get_current_timestamp()
+        daily_window = get_start_of_day_timestamp()
+        state = self._states.get(token)
+        if state is None:
+            state = self._states[token] = _TokenState(rate_window, daily_window)
+        else:
+            self._states.move_to_end(token)
+        if state.rate_window != rate_window:
+            # Admissions of a past second no longer affect any rate decision
+            state.rate_window = rate_window
+            state.rate_count = 0
+            state.rate_pending = 0
+        if state.daily_window != daily_window:
+            state.daily_window = daily_window
+            state.daily_count = 0
+            state.daily_pending = 0
+        state.last_seen = time.monotonic()
+        return state
+
+    async def is_allowed(self, token: str, rate_limit: int, daily_limit: int = None, algorithm: str = None,
+                         cost: int = 1) -> bool:
+        """Local fixed-window check charging `cost` requests; `algorithm` is ignored, validation keeps approximate accounts on a fixed window"""
+        state = self._state_for(token)
+        batch = self._batch_size(rate_limit)
+        if state.rate_pending + cost > batch or state.daily_pending + cost > batch:
+            # Sync first so this admission cannot take the token past `batch` unsynced ones
+            if not await self.sync([token]) and not self._fail_open:
+                return False
+            state = self._state_for(token)
+        else:
+            self.local_decisions += 1
+
+        if state.rate_count + state.rate_pending + cost > rate_limit:
+            return False
+        if daily_limit is not None and state.daily_count + state.daily_pending + cost > daily_limit:
+            return False
+
+        state.rate_pending += cost
+        if daily_limit is not None:
+            state.daily_pending += cost
+        self._unsynced.add(token)
+        if state.rate_pending > batch or state.daily_pending > batch:
+            # A request costing more than a batch was decided on fresh counts; push it at once
+            await self.sync([token])
+        return True
+
+    async def sync(self, tokens: Iterable[str]) -> bool:
+        """Push unsynced admissions of `tokens` and refresh their global counts"""
+        if self._sync_lock is None:
+            self._sync_lock = asyncio.Lock()
+        # Syncs are serialised so the same pending admissions are never pushed twice
+        async with self._sync_lock:
+            return await self._sync(tokens)
+
+    async def _sync(self, tokens: Iterable[str]) -> bool:
+        # Tokens, keys, deltas, TTLs and the states they update, batched per Redis node (client and breaker)
+        batches: Dict[Tuple[Any, CircuitBreaker], Tuple[List[str], List[str], List[int], List[int], list]] = {}
+        for token in tokens:
+            # Admissions made while the scripts run mark their tokens unsynced again
+            self._unsynced.discard(token)
+            state = self._states.get(token)
+            if state is None or not (state.rate_pending or state.daily_pending):
+                continue
+            node = (self._redis_for(token), self._breaker_for(token))
+            synced, keys, deltas, ttls, targets = batches.setdefault(node, ([], [], [], [], []))
+            synced.append(token)
+            if state.rate_pending:
+                keys.append(self._rate_limit_key(token, state.rate_window))
+                deltas.append(state.rate_pending)
+                ttls.append(1)
+                targets.append((state, False, state.rate_window, state.rate_pending))
+            if state.daily_pending:
+                keys.append(self._daily_limit_key(token, state.daily_window))
+                deltas.append(state.daily_pending)
+                ttls.append(SECONDS_IN_DAY)
+                targets.append((state, True, state.daily_window, state.daily_pending))
+        if not batches:
+            return True
+        results = await asyncio.gather(*(self._sync_node(client, breaker, *batch)
+                                         for (client, breaker), batch in batches.items()))
+        return all(results)
+
+    async def _sync_node(self, client: Any, breaker: CircuitBreaker, tokens: List[str], keys: List[str],
+                         deltas: List[int], ttls: List[int], targets: list) -> bool:
+        if not breaker.allow_request():
+            self._unsynced.update(tokens)
+            return False
+        try:
+            counts = await self._sync_counters_script(keys=keys, args=deltas + ttls, client=client)
+        except RedisError as e:
+            self._unsynced.update(tokens)
+            self._on_redis_error(e, breaker)
+            return False
+        breaker.record_success()
+        self.syncs += 1
+
+        # Admissions made while the script ran stay pending for the next sync
+        for (state, daily, window, delta), count in zip(targets, counts):
+            if daily and state.daily_window == window:
+                state.daily_count = count
+                state.daily_pending -= delta
+            elif not daily and state.rate_window == window:
+                state.rate_count = count
+                state.rate_pending -= delta
+        return True
+
+    def _prune_idle(self) -> None:
+        cutoff = time.monotonic() - self._idle_timeout
+        while self._states:
+            token, state = next(iter(self._states.items()))
+            # Tokens not synced yet stay, and so do the ones used after them
+            if state.last_seen >= cutoff or state.rate_pending or state.daily_pending:
+                break
+            del self._states[token]
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._sync_interval)
+            await self.sync(list(self._unsynced))
+            self._prune_idle()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'tokens': len(self._states), 'local_decisions': self.local_decisions, 'syncs': self.syncs}
@@ -1,12 +1,37 @@
-from dataclasses import dataclass
+import json
 from typing import Any, List
 
-@dataclass
+class UnknownCategoryError(Exception):
+    """Custom exception for joke categories no source knows"""
+    pass
+
 class Joke:
-    id: str
-    categories: List[str]
-    createdAt: str
-    joke: str
+    """A joke in the public response shape, with its JSON body encoded once.
+
+    `json` holds the exact bytes FastAPI's JSONResponse would render for the
+    joke, encoded when the joke is created (fetched, pooled or read from the
+    corpus), so serving it costs no encoding work.
+    """
+    __slots__ = ('id', 'categories', 'createdAt', 'joke', 'json')
+
+    def __init__(self, id: str, categories: List[str], createdAt: str, joke: str):
+        self.id = id
+        self.categories = categories
+        self.createdAt = createdAt
+        self.joke = joke
+        self.json = json.dumps(
+            {'id': id, 'categories': categories, 'createdAt': createdAt, 'joke': joke},
+            ensure_ascii=False,
+            separators=(",", ":")
+        ).encode('utf-8')
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Joke):
+            return NotImplemented
+        return self.json == other.json
+
+    def __repr__(self) -> str:
+        return f"Joke(id={self.id!r}, categories={self.categories!r}, createdAt={self.createdAt!r}, joke={self.joke!r})"
 
     @staticmethod
     def from_dict(obj: Any):
@@ -0,0 +1,236 @@
+import argparse
+import json
+import mmap
+import random
+import re
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+from joke import Joke, UnknownCategoryError
+
+# File layout (all integers little-endian):
+#   header      magic (4s) | version (I) | joke count (Q) | categories offset (Q)
+#   offsets     (count + 1) x Q, record boundaries relative to the data section
+#   data        one compact JSON record per joke, in upstream format
+#   categories  category count (I), then per category: name length (I) |
+#               UTF-8 name, NUL-padded to 4 bytes | joke count (I) | joke indexes (I each)
+# Version 1 files (no categories section) are no longer read: rebuild them.
+MAGIC = b"CNJC"
+VERSION = 2
+PREFIX = struct.Struct("<4sI")
+HEADER = struct.Struct("<4sIQQ")
+OFFSET = struct.Struct("<Q")
+RECORD_BOUNDS = struct.Struct("<QQ")
+UINT = struct.Struct("<I")
+
+class CorpusError(Exception):
+    """Custom exception for joke corpus errors"""
+    pass
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def _iter_json_array(file: TextIO, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Yield the elements of the JSON array in `file` one by one, reading it in chunks.
+
+    Only the current chunk and the element being decoded are held in memory.
+    Elements are expected to be objects, which only decode once complete.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    opened = expect_comma = False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if not opened:
+                if char != '[':
+                    raise ValueError("expected a JSON array")
+                opened = True
+                position += 1
+                continue
+            if char == ']':
+                return
+            if expect_comma:
+                if char != ',':
+                    raise ValueError(f"expected ',' or ']' in JSON array, got {char!r}")
+                expect_comma = False
+                position += 1
+                continue
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield value
+                expect_comma = True
+                continue
+        elif eof:
+            raise ValueError("unterminated JSON array")
+        # Needs more input: keep only what is not decoded yet
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+def _iter_jokes(input_path: str) -> Iterator[Dict[str, Any]]:
+    """Yield upstream-format jokes from a JSON array or an NDJSON file"""
+    with open(input_path, 'r') as file:
+        first = file.read(1)
+        while first.isspace():
+            first = file.read(1)
+        file.seek(0)
+        if first == '[':
+            yield from _iter_json_array(file)
+            return
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def _encode_record(obj: Dict[str, Any]) -> bytes:
+    record = {
+        "id": str(obj.get("id")),
+        "categories": obj.get("categories") or [],
+        "created_at": obj.get("created_at"),
+        "value": str(obj.get("value"))
+    }
+    return json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+def _encode_categories(categories: Dict[str, array]) -> bytes:
+    parts = [UINT.pack(len(categories))]
+    for name, indexes in sorted(categories.items()):
+        encoded = name.encode('utf-8')
+        parts.append(UINT.pack(len(encoded)))
+        parts.append(encoded + b'\0' * (-len(encoded) % 4))
+        parts.append(UINT.pack(len(indexes)))
+        parts.append(_little_endian(indexes).tobytes())
+    return b''.join(parts)
+
+def build_corpus(input_path: str, output_path: str) -> int:
+    """Ingest jokes from input_path into a corpus file, return the joke count.
+
+    Both input formats are parsed one joke at a time and records are
+    streamed to a temporary file, so only the offset index (8 bytes per
+    joke) and the category index (4 bytes per joke and category) are held
+    in memory while building.
+    """
+    offsets = array('Q', [0])
+    categories: Dict[str, array] = {}
+    try:
+        with tempfile.TemporaryFile() as data:
+            for index, obj in enumerate(_iter_jokes(input_path)):
+                if index > 0xFFFFFFFF:
+                    raise ValueError("too many jokes")
+                data.write(_encode_record(obj))
+                offsets.append(data.tell())
+                for category in set(obj.get("categories") or []):
+                    categories.setdefault(str(category), array('I')).append(index)
+            data.seek(0)
+            count = len(offsets) - 1
+            categories_offset = HEADER.size + len(offsets) * OFFSET.size + offsets[-1]
+            with open(output_path, 'wb') as output:
+                output.write(HEADER.pack(MAGIC, VERSION, count, categories_offset))
+                _little_endian(offsets).tofile(output)
+                shutil.copyfileobj(data, output)
+                output.write(_encode_categories(categories))
+    except (OSError, ValueError) as e:
+        raise CorpusError(f"Error building corpus from {input_path}: {str(e)}")
+    return count
+
+class JokeCorpus:
+    """Memory-mapped reader for corpus files written by `build_corpus`.
+
+    Picking a random joke reads two offsets and one record from the mapping,
+    so lookups are O(1) and the corpus is never loaded into the heap; its
+    pages live in the shared page cache instead. The category index written
+    by `build_corpus` makes a random joke of a category O(1) as well; only
+    the category names and their positions are read into memory.
+    """
+
+    def __init__(self, path: str):
+        try:
+            with open(path, 'rb') as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise CorpusError(f"Error opening corpus {path}: {str(e)}")
+
+        try:
+            magic, version = PREFIX.unpack_from(self._mmap, 0)
+            if magic == MAGIC and version != VERSION:
+                raise CorpusError(f"Corpus {path} has format version {version}, rebuild it with joke_corpus.py")
+            if magic != MAGIC:
+                raise ValueError("bad header")
+            _, _, count, categories_offset = HEADER.unpack_from(self._mmap, 0)
+            self._categories = self._read_categories(categories_offset)
+        except (struct.error, ValueError, UnicodeDecodeError):
+            raise CorpusError(f"Invalid corpus file: {path}")
+        if count == 0:
+            raise CorpusError(f"Corpus is empty: {path}")
+
+        self._count = count
+        self._offsets_start = HEADER.size
+        self._data_start = HEADER.size + (count + 1) * OFFSET.size
+
+    def _read_categories(self, offset: int) -> Dict[str, Tuple[int, int]]:
+        """Map each category to the (position, count) of its joke indexes in the file"""
+        categories = {}
+        (category_count,) = UINT.unpack_from(self._mmap, offset)
+        offset += UINT.size
+        for _ in range(category_count):
+            (length,) = UINT.unpack_from(self._mmap, offset)
+            offset += UINT.size
+            name = self._mmap[offset:offset + length].decode('utf-8')
+            offset += length + (-length % 4)
+            (count,) = UINT.unpack_from(self._mmap, offset)
+            offset += UINT.size
+            if offset + count * UINT.size > len(self._mmap):
+                raise ValueError("truncated category index")
+            categories[name] = (offset, count)
+            offset += count * UINT.size
+        return categories
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get_joke(self, index: int) -> Joke:
+        start, end = RECORD_BOUNDS.unpack_from(self._mmap, self._offsets_start + index * OFFSET.size)
+        record = self._mmap[self._data_start + start:self._data_start + end]
+        return Joke.from_dict(json.loads(record))
+
+    def categories(self) -> List[str]:
+        return sorted(self._categories)
+
+    def random_joke(self, category: Optional[str] = None) -> Joke:
+        if category is None:
+            return self.get_joke(random.randrange(self._count))
+        position = self._categories.get(category)
+        if position is None:
+            raise UnknownCategoryError(f"Unknown joke category: {category}")
+        start, count = position
+        (index,) = UINT.unpack_from(self._mmap, start + random.randrange(count) * UINT.size)
+        return self.get_joke(index)
+
+    async def fetch_joke(self, category: Optional[str] = None) -> Joke:
+        return self.random_joke(category)
+
+    def close(self) -> None:
+        self._mmap.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build a joke corpus file")
+    parser.add_argument("input", help="JSON array or NDJSON file of upstream-format jokes")
+    parser.add_argument("output", help="Corpus file to write")
+    args = parser.parse_args()
+    count = build_corpus(args.input, args.output)
+    print(f"Wrote {count} jokes to {args.output}")
+
+if __name__ == "__main__":
+    main()
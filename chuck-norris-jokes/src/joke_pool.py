@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict
+import settings
+from joke import Joke
+from upstream_client import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+class JokePool:
+    """Bounded in-memory buffer of prefetched jokes.
+
+    A background task keeps the buffer filled: whenever it drops to the low
+    watermark, it is refilled up to the high watermark using up to
+    `refill_concurrency` parallel fetches. `fetch_joke` pops from the buffer
+    and only falls back to a direct fetch when the buffer is empty. Refills
+    use `refill_fetch_joke` when given, e.g. to bypass a coalescer that
+    would merge the parallel fetches into one shared joke.
+    """
+
+    def __init__(
+        self,
+        fetch_joke: Callable[[], Awaitable[Joke]],
+        size: int = settings.JOKE_POOL_SIZE,
+        low_watermark: int = settings.JOKE_POOL_LOW_WATERMARK,
+        high_watermark: int = settings.JOKE_POOL_HIGH_WATERMARK,
+        refill_concurrency: int = settings.JOKE_POOL_REFILL_CONCURRENCY,
+        retry_delay: float = 1.0,
+        refill_fetch_joke: Callable[[], Awaitable[Joke]] = None,
+    ):
+        if not 0 <= low_watermark < high_watermark <= size:
+            raise ValueError("Pool watermarks must satisfy 0 <= low < high <= size")
+        self._fetch_joke = fetch_joke
+        self._refill_fetch_joke = refill_fetch_joke or fetch_joke
+        self._low_watermark = low_watermark
+        self._high_watermark = high_watermark
+        self._refill_concurrency = refill_concurrency
+        self._retry_delay = retry_delay
+        self._jokes: Deque[Joke] = deque(maxlen=size)
+        self._refill_needed = asyncio.Event()
+        self._refill_task = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._jokes)
+
+    def start(self) -> None:
+        self._refill_needed.set()
+        self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def close(self) -> None:
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    async def fetch_joke(self) -> Joke:
+        if self._jokes:
+            self.hits += 1
+            joke = self._jokes.popleft()
+            if len(self._jokes) <= self._low_watermark:
+                self._refill_needed.set()
+            return joke
+
+        self.misses += 1
+        self._refill_needed.set()
+        return await self._fetch_joke()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._jokes),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    async def _refill_loop(self) -> None:
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            try:
+                await self._refill()
+            except UpstreamError as e:
+                logger.warning(f"Joke pool refill failed, retrying in {self._retry_delay}s: {e}")
+                await asyncio.sleep(self._retry_delay)
+                self._refill_needed.set()
+
+    async def _refill(self) -> None:
+        while len(self._jokes) < self._high_watermark:
+            batch = min(self._refill_concurrency, self._high_watermark - len(self._jokes))
+            results = await asyncio.gather(
+                *(self._refill_fetch_joke() for _ in range(batch)),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Joke):
+                    self._jokes.append(result)
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                raise UpstreamError(f"{len(errors)} of {batch} fetches failed: {errors[0]}")
@@ -0,0 +1,170 @@
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import settings
+from joke import Joke
+from plan_scheduler import PlanScheduler
+from upstream_client import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+# Values accepted by the JOKE_SOURCE setting
+UPSTREAM = 'upstream'
+CORPUS = 'corpus'
+UPSTREAM_WITH_FALLBACK = 'upstream_with_fallback'
+JOKE_SOURCES = (UPSTREAM, CORPUS, UPSTREAM_WITH_FALLBACK)
+
+def _call(fetch_joke: Callable[..., Awaitable[Joke]], category: Optional[str]) -> Awaitable[Joke]:
+    # Sources that only serve random jokes take no category argument
+    return fetch_joke() if category is None else fetch_joke(category)
+
+class FallbackJokeSource:
+    """Serve from the primary source, and from the fallback when it fails"""
+
+    def __init__(self, primary: Callable[..., Awaitable[Joke]], fallback: Callable[..., Awaitable[Joke]]):
+        self._primary = primary
+        self._fallback = fallback
+        self.fallbacks = 0
+
+    async def fetch_joke(self, category: Optional[str] = None) -> Joke:
+        try:
+            return await _call(self._primary, category)
+        except UpstreamError as e:
+            logger.warning(f"Serving joke from fallback source: {e}")
+            self.fallbacks += 1
+            return await _call(self._fallback, category)
+
+class ScheduledJokeSource:
+    """Run the fetches of a source in plan scheduler slots.
+
+    Each fetch is scheduled for the plan `plan()` returns when it starts,
+    so only the fetches that reach this source (e.g. pool misses) take a
+    slot.
+    """
+
+    def __init__(self, fetch_joke: Callable[..., Awaitable[Joke]], scheduler: PlanScheduler,
+                 plan: Callable[[], str]):
+        self._fetch_joke = fetch_joke
+        self._scheduler = scheduler
+        self._plan = plan
+
+    async def fetch_joke(self, category: Optional[str] = None) -> Joke:
+        return await self._scheduler.run(self._plan(), _call, self._fetch_joke, category)
+
+class _Batch:
+    """Callers sharing one round of upstream fetches"""
+    __slots__ = ('category', 'waiters', 'delivered', 'jokes', 'fetches', 'pending', 'error')
+
+    def __init__(self, category: Optional[str]):
+        self.category = category
+        self.waiters: List[asyncio.Future] = []
+        self.delivered = 0
+        self.jokes: List[Joke] = []
+        self.fetches = 0
+        self.pending = 0
+        self.error: Optional[Exception] = None
+
+class CoalescingJokeSource:
+    """Single-flight front for a joke source: concurrent callers share fetches.
+
+    Callers arriving while a batch of fetches is in flight join it. Each
+    caller adds one more fetch to the batch until it has `max_fan_out`;
+    further callers only wait. Fetched jokes go to the waiters in arrival
+    order, so every caller gets a distinct joke while there are enough.
+    When the batch's last fetch settles, the remaining waiters share the
+    batch's jokes, or get its error if every fetch failed. Callers asking
+    for a category only share batches with callers of the same category.
+    `amplification` is callers served per upstream fetch.
+    """
+
+    def __init__(
+        self,
+        fetch_joke: Callable[..., Awaitable[Joke]],
+        max_fan_out: int = settings.UPSTREAM_COALESCE_MAX_FAN_OUT,
+    ):
+        if max_fan_out < 1:
+            raise ValueError("max_fan_out must be at least 1")
+        self._fetch_joke = fetch_joke
+        self._max_fan_out = max_fan_out
+        self._batches: Dict[Optional[str], _Batch] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.callers = 0
+        self.fetches = 0
+        self.shared = 0
+
+    @property
+    def amplification(self) -> float:
+        return self.callers / self.fetches if self.fetches else 0.0
+
+    async def fetch_joke(self, category: Optional[str] = None) -> Joke:
+        batch = self._batches.get(category)
+        if batch is None:
+            batch = self._batches[category] = _Batch(category)
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append(future)
+        self.callers += 1
+        if batch.fetches < self._max_fan_out:
+            batch.fetches += 1
+            batch.pending += 1
+            self.fetches += 1
+            task = asyncio.create_task(_call(self._fetch_joke, category))
+            self._tasks.add(task)
+            task.add_done_callback(functools.partial(self._fetched, batch))
+        return await future
+
+    async def close(self) -> None:
+        """Cancel the fetches in flight; their waiters get an UpstreamError"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'callers': self.callers,
+            'fetches': self.fetches,
+            'shared': self.shared,
+            'amplification': self.amplification
+        }
+
+    def _fetched(self, batch: _Batch, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        batch.pending -= 1
+        if not task.cancelled():
+            error = task.exception()
+            if error is not None:
+                batch.error = error
+            else:
+                batch.jokes.append(task.result())
+                self._deliver(batch, task.result())
+        if batch.pending == 0:
+            self._finish(batch)
+
+    @staticmethod
+    def _next_waiter(batch: _Batch) -> Optional[asyncio.Future]:
+        # Waiters whose caller went away are skipped
+        while batch.delivered < len(batch.waiters):
+            waiter = batch.waiters[batch.delivered]
+            batch.delivered += 1
+            if not waiter.done():
+                return waiter
+        return None
+
+    def _deliver(self, batch: _Batch, joke: Joke) -> None:
+        waiter = self._next_waiter(batch)
+        if waiter is not None:
+            waiter.set_result(joke)
+
+    def _finish(self, batch: _Batch) -> None:
+        if self._batches.get(batch.category) is batch:
+            del self._batches[batch.category]
+        error = batch.error or UpstreamError("Upstream fetch cancelled")
+        waiter = self._next_waiter(batch)
+        while waiter is not None:
+            if batch.jokes:
+                waiter.set_result(batch.jokes[self.shared % len(batch.jokes)])
+                self.shared += 1
+            else:
+                waiter.set_exception(error)
+            waiter = self._next_waiter(batch)
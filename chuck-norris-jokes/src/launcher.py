@@ -0,0 +1,292 @@
+"""Multi-worker launcher: python launcher.py --workers 4 --host 0.0.0.0 --port 8000
+
+The master process compiles the accounts into a memory-mapped table, imports
+the app once and binds the listening socket, then forks the workers. Every
+worker maps the same table pages (a JSON ACCOUNTS_PATH is compiled to
+SHARED_ACCOUNTS_DIR, a tmpfs by default), so the accounts are held in memory
+once however many workers run. Redis pools notice the fork and start empty in
+each worker, and everything else that holds connections or event loop state
+is created at startup inside the worker.
+
+While the workers run, the master recompiles the table whenever the JSON
+file changes; each worker's AccountsWatcher sees the table replaced and
+maps the new one, so reloads reach every worker. Workers that die are
+restarted; SIGTERM or SIGINT stops them all gracefully.
+"""
+import argparse
+import importlib
+import logging
+import math
+import os
+import select
+import signal
+import socket
+import time
+from typing import Any, Dict, Optional
+import uvicorn
+import settings
+from accounts_table import AccountsError, build_accounts_table, is_accounts_table
+from accounts_watcher import file_signature
+from helpers.inotify import DirectoryWatch
+from rate_limit_algorithms import MEMORY_BACKEND
+
+logger = logging.getLogger(__name__)
+
+class AccountsCompiler:
+    """Keeps a compiled accounts table in sync with a JSON accounts file.
+
+    `build` compiles it once. The supervisor then calls `rebuild_if_changed`
+    every `poll_interval` seconds, and right away when the inotify watch
+    opened by `start` becomes readable; the file is recompiled when its
+    (mtime, size, inode) changed. A file that fails to compile is logged and
+    the previous table stays in place.
+    """
+
+    def __init__(self, source: str, table_path: str, poll_interval: float = settings.ACCOUNTS_POLL_INTERVAL,
+                 use_inotify: bool = settings.ACCOUNTS_USE_INOTIFY):
+        self.source = source
+        self.table_path = table_path
+        self.poll_interval = poll_interval
+        self._use_inotify = use_inotify
+        self._signature = None
+        self.inotify = None
+        self.builds = 0
+        self.build_errors = 0
+
+    def build(self) -> int:
+        """Compile the table, return the account count; raises AccountsError"""
+        self._signature = file_signature(self.source)
+        count = build_accounts_table(self.source, self.table_path)
+        self.builds += 1
+        return count
+
+    def rebuild_if_changed(self) -> bool:
+        if self.inotify is not None:
+            self.inotify.drain()
+        signature = file_signature(self.source)
+        if signature == self._signature:
+            return False
+        try:
+            count = self.build()
+        except AccountsError as e:
+            self.build_errors += 1
+            logger.error(f"Keeping previous accounts table, compiling {self.source} failed: {e}")
+            return False
+        logger.info(f"Recompiled {count} accounts from {self.source}")
+        return True
+
+    def start(self) -> None:
+        if self._use_inotify:
+            try:
+                self.inotify = DirectoryWatch(os.path.dirname(os.path.abspath(self.source)))
+            except OSError as e:
+                logger.info(f"Watching {self.source} by polling: {e}")
+
+    def close(self) -> None:
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        try:
+            os.unlink(self.table_path)
+        except FileNotFoundError:
+            pass
+
+def shared_table_path(directory: str = settings.SHARED_ACCOUNTS_DIR) -> str:
+    return os.path.join(directory, f'chuck-norris-accounts-{os.getpid()}.table')
+
+def _cgroup_cpu_quota(cgroup_root: str) -> Optional[float]:
+    # cgroup v2: "<quota> <period>", or "max <period>" without a quota
+    try:
+        with open(os.path.join(cgroup_root, 'cpu.max')) as f:
+            quota, period = f.read().split()
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    # cgroup v1: a quota of -1 means none
+    try:
+        with open(os.path.join(cgroup_root, 'cpu', 'cpu.cfs_quota_us')) as f:
+            quota = int(f.read())
+        with open(os.path.join(cgroup_root, 'cpu', 'cpu.cfs_period_us')) as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 else None
+
+def available_cpus(cgroup_root: str = '/sys/fs/cgroup') -> int:
+    """CPUs this process may use: its CPU affinity, capped by a cgroup CPU quota (e.g. a container limit)"""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return cpus
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+class Supervisor:
+    """Forks `workers` uvicorn servers sharing one listening socket and keeps them running.
+
+    The master stays single-threaded: it sleeps in select() on a signal
+    wakeup socket (SIGCHLD, SIGTERM, SIGINT) and the accounts compiler's
+    inotify watch, reaps and restarts workers, and recompiles the accounts.
+    Each worker has a slot 0..workers-1 that its replacement takes over;
+    with `metrics_port`, the worker in slot i also listens on
+    metrics_port + i, so its metrics can be scraped apart from the others.
+    """
+
+    def __init__(self, app: Any, sock: socket.socket, workers: int, uvicorn_options: Dict[str, Any] = None,
+                 compiler: AccountsCompiler = None, restart_delay: float = 1.0, metrics_port: int = 0):
+        self._app = app
+        self._sock = sock
+        self._workers = workers
+        self._uvicorn_options = uvicorn_options or {}
+        self._compiler = compiler
+        self._restart_delay = restart_delay
+        self._metrics_port = metrics_port
+        # Slot of each running worker
+        self._pids: Dict[int, int] = {}
+        self._stopping = False
+        self._wakeup = None
+
+    def run(self) -> None:
+        self._wakeup = socket.socketpair()
+        for end in self._wakeup:
+            end.setblocking(False)
+        signal.set_wakeup_fd(self._wakeup[1].fileno())
+        # set_wakeup_fd only fires for signals with a Python handler
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            for slot in range(self._workers):
+                self._spawn(slot)
+            self._loop()
+        finally:
+            signal.set_wakeup_fd(-1)
+            for end in self._wakeup:
+                end.close()
+
+    def _loop(self) -> None:
+        readable = [self._wakeup[0]]
+        timeout = None
+        if self._compiler is not None:
+            timeout = self._compiler.poll_interval
+            if self._compiler.inotify is not None:
+                readable.append(self._compiler.inotify)
+        while self._pids:
+            select.select(readable, [], [], timeout)
+            try:
+                while self._wakeup[0].recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+            self._reap()
+            if self._compiler is not None and not self._stopping:
+                self._compiler.rebuild_if_changed()
+
+    def _reap(self) -> None:
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._pids.clear()
+                return
+            if pid == 0:
+                return
+            slot = self._pids.pop(pid, None)
+            if self._stopping or slot is None:
+                continue
+            logger.error(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            # Keeps a worker that fails on startup from spinning
+            time.sleep(self._restart_delay)
+            if not self._stopping:
+                self._spawn(slot)
+
+    def _spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+        self._pids[pid] = slot
+        logger.info(f"Started worker {pid} in slot {slot}")
+
+    def _run_worker(self, slot: int) -> None:
+        # Child process: never returns into the supervisor's code
+        code = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            for end in self._wakeup:
+                end.close()
+            if self._compiler is not None and self._compiler.inotify is not None:
+                self._compiler.inotify.close()
+            sockets = [self._sock]
+            if self._metrics_port:
+                sockets.append(bind_socket(self._sock.getsockname()[0], self._metrics_port + slot))
+            config = uvicorn.Config(self._app, **self._uvicorn_options)
+            uvicorn.Server(config).run(sockets=sockets)
+            code = 0
+        except BaseException:
+            logger.exception("Worker failed")
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum: int, frame: Optional[Any]) -> None:
+        self._stopping = True
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the jokes server with several worker processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WORKERS,
+                        help="worker processes, 0 for one per available CPU")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    if args.workers <= 0:
+        args.workers = available_cpus()
+
+    if settings.RATE_LIMIT_BACKEND == MEMORY_BACKEND and args.workers > 1:
+        logger.warning(f"RATE_LIMIT_BACKEND=memory keeps rate limits per worker: each of the {args.workers} "
+                       f"workers enforces the full limits")
+
+    compiler = None
+    if not is_accounts_table(settings.ACCOUNTS_PATH):
+        compiler = AccountsCompiler(settings.ACCOUNTS_PATH, shared_table_path())
+        try:
+            count = compiler.build()
+        except AccountsError as e:
+            raise SystemExit(f"Cannot load accounts: {e}")
+        logger.info(f"Compiled {count} accounts from {settings.ACCOUNTS_PATH} to {compiler.table_path}")
+        # Read by the app's AccountsWatcher when main is imported below
+        settings.ACCOUNTS_PATH = compiler.table_path
+
+    try:
+        # Imported once here, so the workers inherit the loaded app and accounts
+        app = importlib.import_module('main').app
+        sock = bind_socket(args.host, args.port)
+        if compiler is not None:
+            compiler.start()
+        logger.info(f"Serving on {args.host}:{args.port} with {args.workers} workers")
+        # log_config=None: uvicorn logs through the root handler above, tagged with the worker pid
+        Supervisor(app, sock, args.workers, {'log_level': args.log_level, 'log_config': None}, compiler,
+                   metrics_port=settings.METRICS_WORKER_PORT).run()
+    finally:
+        if compiler is not None:
+            compiler.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,227 @@
-import requests
-from fastapi import FastAPI
-from auth import Auth
-from joke import Joke
-from helpers.cached_accounts_file_helper import CachedAccountsFileHelper
+import time
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import settings
+from accounts_watcher import AccountsWatcher
+from admission import AdmissionControl, AdmissionController
+from auth import Auth, daily_counters, hybrid_rate_limiter, rate_limiter
+from bulk_jokes import BULK_PATH, request_cost, stream_jokes
+from category_pool import CategoryJokePools
+from joke import UnknownCategoryError
+from joke_corpus import JokeCorpus
+from joke_pool import JokePool
+from joke_source import (
+    CORPUS, JOKE_SOURCES, UPSTREAM, UPSTREAM_WITH_FALLBACK, CoalescingJokeSource, FallbackJokeSource,
+    ScheduledJokeSource
+)
+from metrics import CONTENT_TYPE, NO_PLAN, STAGE_SECONDS, metrics, stats_gauges
+from plan_scheduler import PlanScheduler, SchedulerOverloadedError
+from redis_connection import close_async_redis, get_async_redis_shards, get_circuit_breaker, get_redis_stats
+from upstream_client import UpstreamClient, UpstreamError
 
 app = FastAPI()
 # Create single instance
-file_helper = CachedAccountsFileHelper(refresh_interval=300)  # 5 minutes
+accounts_watcher = AccountsWatcher(settings.ACCOUNTS_PATH)
+admission_controller = AdmissionController() if settings.ADMISSION_CONTROL else None
+
+@app.on_event("startup")
+async def startup():
+    accounts_watcher.start()
+    rate_limiter.start()
+    if hybrid_rate_limiter is not rate_limiter:
+        hybrid_rate_limiter.start()
+    if daily_counters is not None:
+        daily_counters.start()
+    if settings.JOKE_SOURCE not in JOKE_SOURCES:
+        raise ValueError(f"Unknown JOKE_SOURCE: {settings.JOKE_SOURCE}")
+    app.state.upstream_client = None
+    app.state.joke_coalescer = None
+    app.state.joke_pool = None
+    app.state.category_pools = None
+    app.state.joke_corpus = None
+    app.state.plan_scheduler = None
+
+    if settings.JOKE_SOURCE != UPSTREAM:
+        app.state.joke_corpus = JokeCorpus(settings.JOKE_CORPUS_PATH)
+    if settings.JOKE_SOURCE == CORPUS:
+        app.state.joke_source = app.state.joke_corpus
+        app.state.category_source = app.state.joke_corpus
+        return
+
+    app.state.upstream_client = UpstreamClient()
+    if settings.PLAN_SCHEDULER:
+        app.state.plan_scheduler = PlanScheduler()
+    upstream = app.state.upstream_client
+    if app.state.plan_scheduler is not None:
+        # Only upstream fetches take scheduler slots, not pool or index hits
+        upstream = ScheduledJokeSource(upstream.fetch_joke, app.state.plan_scheduler, _request_plan.get)
+    if settings.UPSTREAM_COALESCE:
+        app.state.joke_coalescer = CoalescingJokeSource(upstream.fetch_joke)
+        upstream = app.state.joke_coalescer
+    # Category requests: per-category buffers, and an index of every joke fetched.
+    # Refills need distinct jokes, so they go straight to the client instead of the coalescer.
+    client = app.state.upstream_client
+    app.state.category_pools = CategoryJokePools(upstream.fetch_joke, refill_fetch_joke=client.fetch_joke)
+    app.state.category_pools.start()
+    app.state.category_source = app.state.category_pools
+    app.state.joke_source = upstream
+    if settings.JOKE_POOL_SIZE > 0:
+        index = app.state.category_pools.indexing
+        app.state.joke_pool = JokePool(index(upstream.fetch_joke), refill_fetch_joke=index(client.fetch_joke))
+        app.state.joke_pool.start()
+        app.state.joke_source = app.state.joke_pool
+    if settings.JOKE_SOURCE == UPSTREAM_WITH_FALLBACK:
+        app.state.joke_source = FallbackJokeSource(
+            app.state.joke_source.fetch_joke,
+            app.state.joke_corpus.fetch_joke
+        )
+        app.state.category_source = FallbackJokeSource(
+            app.state.category_pools.fetch_joke,
+            app.state.joke_corpus.fetch_joke
+        )
+
+@app.on_event("shutdown")
+async def shutdown():
+    if app.state.joke_pool is not None:
+        await app.state.joke_pool.close()
+    if app.state.category_pools is not None:
+        await app.state.category_pools.close()
+    if app.state.joke_coalescer is not None:
+        await app.state.joke_coalescer.close()
+    if app.state.upstream_client is not None:
+        await app.state.upstream_client.close()
+    if app.state.joke_corpus is not None:
+        app.state.joke_corpus.close()
+    await rate_limiter.close()
+    if hybrid_rate_limiter is not rate_limiter:
+        await hybrid_rate_limiter.close()
+    if daily_counters is not None:
+        await daily_counters.close()
+    await close_async_redis()
+    await accounts_watcher.close()
+
+_JOKE_SOURCE_SECONDS = STAGE_SECONDS.labels('joke_source')
+
+# Plan of the request being served: the upstream fetches it triggers are scheduled for it.
+# Fetches shared by coalesced callers run for the plan of the caller that started them.
+_request_plan: ContextVar[str] = ContextVar('request_plan', default=NO_PLAN)
+
+def _set_request_plan(request: Request) -> None:
+    account = getattr(request.state, 'account', None)
+    _request_plan.set(account.get('plan', NO_PLAN) if account else NO_PLAN)
+
+def _overloaded() -> JSONResponse:
+    return JSONResponse(status_code=503, content={'error': 'Server overloaded, retry later!'},
+                        headers={'Retry-After': str(settings.ADMISSION_RETRY_AFTER)})
 
 @app.get("/joke")
-async def root():
-    response = requests.get("https://api.chucknorris.io/jokes/random").json()
-    return Joke.from_dict(response)
+async def root(request: Request, category: Optional[str] = None):
+    started = time.perf_counter()
+    _set_request_plan(request)
+    try:
+        if category is None:
+            joke = await app.state.joke_source.fetch_joke()
+        else:
+            joke = await app.state.category_source.fetch_joke(category)
+    except UnknownCategoryError:
+        return JSONResponse(status_code=404, content={'error': 'Unknown category!'})
+    except UpstreamError:
+        return JSONResponse(status_code=502, content={'error': 'Upstream unavailable!'})
+    except SchedulerOverloadedError:
+        return _overloaded()
+    finally:
+        _JOKE_SOURCE_SECONDS.observe(time.perf_counter() - started)
+    # Pre-encoded body: skips jsonable_encoder and JSON rendering on every request
+    return Response(content=joke.json, media_type="application/json")
+
+_UPSTREAM_ERROR_LINE = b'{"error":"Upstream unavailable!"}\n'
+_OVERLOADED_LINE = b'{"error":"Server overloaded, retry later!"}\n'
+
+@app.get(BULK_PATH)
+async def jokes(request: Request, count: int = Query(ge=1, le=settings.JOKES_MAX_COUNT),
+                category: Optional[str] = None):
+    """`count` jokes as NDJSON, one per line, streamed as they are fetched"""
+    _set_request_plan(request)
+    if category is None:
+        fetch_joke = app.state.joke_source.fetch_joke
+    else:
+        async def fetch_joke():
+            return await app.state.category_source.fetch_joke(category)
+    jokes = stream_jokes(fetch_joke, count)
+    # The first joke is awaited here, so a failing source still gets a proper status code
+    try:
+        first = await jokes.__anext__()
+    except UnknownCategoryError:
+        await jokes.aclose()
+        return JSONResponse(status_code=404, content={'error': 'Unknown category!'})
+    except UpstreamError:
+        await jokes.aclose()
+        return JSONResponse(status_code=502, content={'error': 'Upstream unavailable!'})
+    except SchedulerOverloadedError:
+        await jokes.aclose()
+        return _overloaded()
+
+    async def lines():
+        try:
+            yield first.json + b'\n'
+            async for joke in jokes:
+                yield joke.json + b'\n'
+        except UpstreamError:
+            # Headers are sent already: end the stream with an error line instead
+            yield _UPSTREAM_ERROR_LINE
+        except SchedulerOverloadedError:
+            yield _OVERLOADED_LINE
+        finally:
+            await jokes.aclose()
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _component_gauges():
+    """Gauges read from the components' own counters at scrape time"""
+    state = app.state
+    yield from stats_gauges('accounts', accounts_watcher.stats())
+    yield from stats_gauges('redis', get_redis_stats())
+    yield ('redis_circuit_breaker_rejected', 'Redis calls skipped by the open circuit breaker',
+           [({}, get_circuit_breaker().rejected)])
+    shards = get_async_redis_shards()
+    if shards is not None:
+        yield ('redis_node_circuit_breaker_rejected', 'Redis calls skipped by the open circuit breaker, by node',
+               [({'node': node}, breaker.rejected) for node, breaker in shards.breakers.items()])
+    yield from stats_gauges('rate_limiter', rate_limiter.stats())
+    if hybrid_rate_limiter is not rate_limiter:
+        yield from stats_gauges('hybrid_rate_limiter', hybrid_rate_limiter.stats())
+    if daily_counters is not None:
+        yield from stats_gauges('daily_counters', daily_counters.stats())
+    if admission_controller is not None:
+        yield from stats_gauges('admission', admission_controller.stats())
+    if getattr(state, 'joke_pool', None) is not None:
+        yield from stats_gauges('joke_pool', state.joke_pool.stats())
+    if getattr(state, 'category_pools', None) is not None:
+        yield from stats_gauges('category_pools', state.category_pools.stats())
+    if getattr(state, 'upstream_client', None) is not None:
+        yield from stats_gauges('upstream', state.upstream_client.stats())
+    if getattr(state, 'joke_coalescer', None) is not None:
+        yield from stats_gauges('upstream_coalescer', state.joke_coalescer.stats())
+    if getattr(state, 'plan_scheduler', None) is not None:
+        yield from stats_gauges('plan_scheduler', state.plan_scheduler.stats())
+        yield from state.plan_scheduler.plan_gauges()
+
+if settings.METRICS_ENABLED:
+    metrics.add_collector(_component_gauges)
+
+    @app.get(settings.METRICS_PATH, include_in_schema=False)
+    async def metrics_endpoint():
+        return Response(content=metrics.render(), media_type=CONTENT_TYPE)
 
 # Add middleware with dependencies
+public_paths = (settings.METRICS_PATH,) if settings.METRICS_ENABLED else ()
 app.add_middleware(
     Auth,
-    accounts_path="./accounts.json",
-    file_helper=file_helper
-)
\ No newline at end of file
+    accounts=accounts_watcher,
+    public_paths=public_paths,
+    request_cost=request_cost
+)
+if admission_controller is not None:
+    # Added last so it runs first: shed requests never reach Auth or Redis
+    app.add_middleware(AdmissionControl, controller=admission_controller, public_paths=public_paths)
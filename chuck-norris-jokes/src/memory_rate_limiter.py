@@ -0,0 +1,73 @@
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+from helpers.timing_wheel import TimingWheel
+from rate_limit_algorithms import FIXED_WINDOW, SECONDS_IN_DAY, LocalRateState, get_algorithm
+from rate_limiter import RateLimitBackend
+
+# Daily counts are dropped up to this long after their day ends, spread by token
+DAILY_EXPIRY_SPREAD = 3600  # seconds
+
+class MemoryRateLimiter(RateLimitBackend):
+    """Rate limiter keeping its state in the process instead of Redis.
+
+    For single-process deployments: every algorithm runs the same decision
+    as its Redis script (see `RateLimitAlgorithm.check_local`) in O(1), with
+    no round trip and nothing that can fail. A token's state lives until
+    neither its per-second state nor its daily count matter any more (the
+    TTLs of the Redis keys), and is then dropped by a timing wheel, so
+    memory is bounded by the tokens active today. Tokens with a daily count
+    expire at a stable per-token offset into the next day's first hour, so
+    they are not all dropped by one request at midnight.
+
+    State is not shared between processes: with several workers, each one
+    enforces the full limits on its own.
+    """
+
+    def __init__(self):
+        self._states: Dict[str, LocalRateState] = {}
+        self._expiry: TimingWheel[str] = TimingWheel()
+        self.expired = 0
+
+    def check_limits(self, token: str, rate_limit: int, daily_limit: int = None,
+                     algorithm: str = FIXED_WINDOW, cost: int = 1) -> Tuple[bool, int, Optional[int]]:
+        """Check both limits charging `cost` requests, return (allowed, rate count, daily count)"""
+        now = time.time()
+        for expired in self._expiry.expire(now):
+            del self._states[expired]
+            self.expired += 1
+
+        rate_limit_algorithm = get_algorithm(algorithm)
+        state = self._states.get(token)
+        if state is None:
+            state = self._states[token] = LocalRateState()
+        allowed, rate_count = rate_limit_algorithm.check_local(state, rate_limit, now, cost)
+
+        day = int(now) // SECONDS_IN_DAY * SECONDS_IN_DAY
+        if state.day != day:
+            state.day = day
+            state.daily_count = 0
+        # Same as the scripts' daily tail: only charged once the per-second check passed
+        if daily_limit is None:
+            daily_count = None
+        elif allowed:
+            state.daily_count += cost
+            daily_count = state.daily_count
+            allowed = daily_count <= daily_limit
+        else:
+            daily_count = state.daily_count
+
+        expiry = rate_limit_algorithm.local_expiry(state)
+        if state.daily_count:
+            spread = zlib.crc32(token.encode('utf-8')) % DAILY_EXPIRY_SPREAD
+            expiry = max(expiry, day + SECONDS_IN_DAY + spread)
+        self._expiry.schedule(token, expiry)
+        return allowed, rate_count, daily_count
+
+    async def is_allowed(self, token: str, rate_limit: int, daily_limit: int = None,
+                         algorithm: str = FIXED_WINDOW, cost: int = 1) -> bool:
+        allowed, _, _ = self.check_limits(token, rate_limit, daily_limit, algorithm, cost)
+        return allowed
+
+    def stats(self) -> Dict[str, Any]:
+        return {'tokens': len(self._states), 'expired': self.expired}
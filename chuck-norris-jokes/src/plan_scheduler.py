@@ -0,0 +1,196 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Mapping, TypeVar
+import settings
+from metrics import GaugeFamily, PLAN_QUEUE_WAIT_SECONDS, REQUESTS_REJECTED
+
+Result = TypeVar('Result')
+
+class SchedulerOverloadedError(Exception):
+    """Custom exception for requests shed by the plan scheduler"""
+    pass
+
+def parse_plan_weights(value: str) -> Dict[str, float]:
+    """Parse `plan=weight,...` (e.g. `enterprise=10,pro=3,free=1`)"""
+    weights = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        plan, _, weight = entry.partition('=')
+        try:
+            weights[plan.strip()] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid plan weight {entry!r}, expected plan=weight")
+        if weights[plan.strip()] <= 0:
+            raise ValueError(f"Plan weight of {plan.strip()} must be positive")
+    return weights
+
+class _Waiter:
+    __slots__ = ('future', 'finish', 'enqueued')
+
+    def __init__(self, future: asyncio.Future, finish: float):
+        self.future = future
+        self.finish = finish
+        self.enqueued = time.perf_counter()
+
+class _PlanQueue:
+    """Waiters of one plan, their last finish tag and counters"""
+    __slots__ = ('plan', 'weight', 'waiters', 'finish', 'admitted', 'shed', 'timeouts', 'wait_seconds', 'rejections')
+
+    def __init__(self, plan: str, weight: float):
+        self.plan = plan
+        self.weight = weight
+        self.waiters: Deque[_Waiter] = deque()
+        self.finish = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.wait_seconds = PLAN_QUEUE_WAIT_SECONDS.labels(plan)
+        self.rejections = REQUESTS_REJECTED.labels('503', 'plan_scheduler', plan)
+
+class PlanScheduler:
+    """Weighted fair queuing of joke fetches by account plan.
+
+    At most `concurrency` fetches run at once. Over that, fetches wait in
+    one FIFO queue per plan and a freed slot goes to the queued fetch with
+    the smallest finish tag (self-clocked fair queuing): each fetch is
+    tagged 1/weight after the later of its plan's previous tag and the
+    tag last served, so under contention each plan with waiters gets slots
+    in proportion to its weight, and an idle plan builds up no credit.
+    Plans missing from `weights` weigh `default_weight`.
+
+    At most `queue_size` fetches wait in total. When the queues are full, a
+    new fetch evicts the newest waiter of the lightest plan lighter than its
+    own, or is shed itself; a fetch waiting longer than `queue_timeout` is
+    shed too. Shed fetches raise SchedulerOverloadedError. Without
+    contention a fetch takes a free slot at once, so the scheduler costs
+    nothing until the upstream capacity is actually scarce.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = settings.PLAN_SCHEDULER_CONCURRENCY,
+        weights: Mapping[str, float] = None,
+        default_weight: float = 1.0,
+        queue_size: int = settings.PLAN_SCHEDULER_QUEUE_SIZE,
+        queue_timeout: float = settings.PLAN_SCHEDULER_QUEUE_TIMEOUT_MS / 1000,
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if weights is None:
+            weights = parse_plan_weights(settings.PLAN_WEIGHTS)
+        self._concurrency = concurrency
+        self._default_weight = default_weight
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._plans: Dict[str, _PlanQueue] = {plan: _PlanQueue(plan, weight) for plan, weight in weights.items()}
+        self._virtual_time = 0.0
+        self.queued = 0
+        self.in_flight = 0
+
+    def _plan_queue(self, plan: str) -> _PlanQueue:
+        queue = self._plans.get(plan)
+        if queue is None:
+            queue = self._plans[plan] = _PlanQueue(plan, self._default_weight)
+        return queue
+
+    async def run(self, plan: str, fetch: Callable[..., Awaitable[Result]], *args: Any) -> Result:
+        """Await `fetch(*args)` in a slot scheduled for `plan`"""
+        await self.acquire(plan)
+        try:
+            return await fetch(*args)
+        finally:
+            self.release()
+
+    async def acquire(self, plan: str) -> None:
+        """Take a slot for `plan`, raise SchedulerOverloadedError when shed"""
+        queue = self._plan_queue(plan)
+        if self.in_flight < self._concurrency and not self.queued:
+            self.in_flight += 1
+            queue.admitted += 1
+            queue.wait_seconds.observe(0.0)
+            return
+        if self.queued >= self._queue_size and not self._evict_for(queue):
+            queue.shed += 1
+            queue.rejections.inc()
+            raise SchedulerOverloadedError("Upstream capacity exhausted")
+
+        queue.finish = max(self._virtual_time, queue.finish) + 1 / queue.weight
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), queue.finish)
+        queue.waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                self._remove(queue, waiter)
+                queue.timeouts += 1
+                queue.shed += 1
+                queue.rejections.inc()
+                raise SchedulerOverloadedError("Timed out waiting for upstream capacity")
+        except asyncio.CancelledError:
+            if waiter.future.done() and waiter.future.exception() is None:
+                # The slot was handed over before the caller went away
+                self.release()
+            elif not waiter.future.done():
+                self._remove(queue, waiter)
+            raise
+        # Raises if the waiter was evicted just as its wait timed out
+        waiter.future.result()
+        queue.admitted += 1
+        queue.wait_seconds.observe(time.perf_counter() - waiter.enqueued)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        while self.queued and self.in_flight < self._concurrency:
+            queue = min((queue for queue in self._plans.values() if queue.waiters),
+                        key=lambda queue: queue.waiters[0].finish)
+            waiter = queue.waiters.popleft()
+            self.queued -= 1
+            self._virtual_time = waiter.finish
+            self.in_flight += 1
+            waiter.future.set_result(None)
+
+    def _evict_for(self, newcomer: _PlanQueue) -> bool:
+        """Shed the newest waiter of the lightest plan lighter than `newcomer`'s"""
+        lighter = [queue for queue in self._plans.values() if queue.waiters and queue.weight < newcomer.weight]
+        if not lighter:
+            return False
+        victim = min(lighter, key=lambda queue: queue.weight)
+        waiter = victim.waiters[-1]
+        waiter.future.set_exception(SchedulerOverloadedError("Evicted by a higher priority plan"))
+        self._remove(victim, waiter)
+        victim.shed += 1
+        victim.rejections.inc()
+        return True
+
+    def _remove(self, queue: _PlanQueue, waiter: _Waiter) -> None:
+        queue.waiters.remove(waiter)
+        self.queued -= 1
+        if not waiter.future.done():
+            waiter.future.cancel()
+        # The plan's next waiter should not queue behind a tag never served
+        queue.finish = queue.waiters[-1].finish if queue.waiters else self._virtual_time
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': self.in_flight, 'queued': self.queued}
+
+    def plan_gauges(self) -> List[GaugeFamily]:
+        """Per-plan queue depth and counters, labelled by plan"""
+        queues = list(self._plans.values())
+
+        def family(name: str, help: str, value: Callable[[_PlanQueue], int]) -> GaugeFamily:
+            return name, help, [({'plan': queue.plan}, float(value(queue))) for queue in queues]
+
+        return [
+            family('plan_scheduler_queue_depth', 'Fetches waiting for upstream capacity, by plan',
+                   lambda queue: len(queue.waiters)),
+            family('plan_scheduler_admitted', 'Fetches given upstream capacity, by plan',
+                   lambda queue: queue.admitted),
+            family('plan_scheduler_shed', 'Fetches shed for lack of upstream capacity, by plan',
+                   lambda queue: queue.shed),
+            family('plan_scheduler_timeouts', 'Fetches shed after waiting too long, by plan',
+                   lambda queue: queue.timeouts),
+        ]
@@ -0,0 +1,244 @@
+import math
+from typing import Dict, List, Optional, Tuple
+import settings
+
+SECONDS_IN_DAY = 86400
+
+# Values accepted by the `rate_limit_algorithm` field of an account
+FIXED_WINDOW = 'fixed_window'
+SLIDING_WINDOW = 'sliding_window'
+GCRA = 'gcra'
+
+# Values accepted by the `rate_limit_mode` field of an account
+EXACT = 'exact'
+APPROXIMATE = 'approximate'
+
+# Values accepted by the RATE_LIMIT_BACKEND setting
+REDIS_BACKEND = 'redis'
+MEMORY_BACKEND = 'memory'
+RATE_LIMIT_BACKENDS = (REDIS_BACKEND, MEMORY_BACKEND)
+
+# Every algorithm is one server-side script that checks the per-second limit
+# and the daily limit in a single round trip. The script heads below decide
+# the per-second limit and set `rate_allowed` / `rate_count`; the shared tail
+# then charges the daily counter, but only when the per-second check passed.
+#   KEYS[1] per-second state, KEYS[2] daily counter, KEYS[3] extra state
+#   ARGV[1] rate limit, ARGV[2] daily limit (-1 = none), ARGV[3] daily ttl,
+#   ARGV[4] now (ms), ARGV[5] algorithm parameter, ARGV[6] cost (requests charged)
+# Returns {allowed (0/1), rate count, daily count (-1 when not tracked)}
+_DAILY_LIMIT_TAIL = """
+local daily_limit = tonumber(ARGV[2])
+if not rate_allowed then
+    if daily_limit < 0 then
+        return {0, rate_count, -1}
+    end
+    return {0, rate_count, tonumber(redis.call('GET', KEYS[2]) or 0)}
+end
+if daily_limit < 0 then
+    return {1, rate_count, -1}
+end
+local daily_count = redis.call('INCRBY', KEYS[2], cost)
+if daily_count == cost then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+if daily_count > daily_limit then
+    return {0, rate_count, daily_count}
+end
+return {1, rate_count, daily_count}
+"""
+
+# Adds each delta to its counter and returns the new totals; a counter gets
+# its TTL when the delta created it.
+#   KEYS[i] counter, ARGV[i] delta, ARGV[#KEYS + i] ttl
+SYNC_COUNTERS_SCRIPT = """
+local counts = {}
+for i, key in ipairs(KEYS) do
+    local delta = tonumber(ARGV[i])
+    local count = redis.call('INCRBY', key, delta)
+    if count == delta then
+        redis.call('EXPIRE', key, ARGV[#KEYS + i])
+    end
+    counts[i] = count
+end
+return counts
+"""
+
+class LocalRateState:
+    """One token's state in the in-process backend, standing in for its Redis keys"""
+    __slots__ = ('window', 'count', 'previous', 'tat', 'day', 'daily_count')
+
+    def __init__(self):
+        self.window = 0         # second of `count`
+        self.count = 0          # requests counted in `window`
+        self.previous = 0       # requests counted in the second before it
+        self.tat = 0.0          # GCRA theoretical arrival time (ms)
+        self.day = 0
+        self.daily_count = 0
+
+    def roll(self, window: int) -> None:
+        if self.window != window:
+            self.previous = self.count if self.window == window - 1 else 0
+            self.count = 0
+            self.window = window
+
+class RateLimitAlgorithm:
+    """Per-second limit algorithm, run as a server-side script or in process by `check_local`"""
+    name: str = None
+    script: str = None
+
+    def keys(self, token: str, now: float) -> List[str]:
+        raise NotImplementedError
+
+    def check_local(self, state: LocalRateState, rate_limit: int, now: float, cost: int = 1) -> Tuple[bool, int]:
+        """The script head's decision on in-process state, return (allowed, rate count)"""
+        raise NotImplementedError
+
+    def local_expiry(self, state: LocalRateState) -> float:
+        """When the per-second state stops affecting decisions, like the script's key TTLs"""
+        raise NotImplementedError
+
+    def args(self, rate_limit: int, daily_limit: Optional[int], now: float, cost: int = 1) -> list:
+        return [
+            rate_limit,
+            -1 if daily_limit is None else daily_limit,
+            SECONDS_IN_DAY,
+            int(now * 1000),
+            self.parameter(rate_limit),
+            cost
+        ]
+
+    def parameter(self, rate_limit: int) -> int:
+        return 0
+
+    def _daily_limit_key(self, token: str, now: float) -> str:
+        return f"daily:{token}:{int(now) // SECONDS_IN_DAY * SECONDS_IN_DAY}"
+
+class FixedWindow(RateLimitAlgorithm):
+    """Counter per one-second window; allows up to 2x bursts across window edges"""
+    name = FIXED_WINDOW
+    # INCR + EXPIRE on the first hit is atomic inside the script, so
+    # concurrent first hits can no longer both reset the counter to 1.
+    script = """
+local cost = tonumber(ARGV[6])
+local rate_count = redis.call('INCRBY', KEYS[1], cost)
+if rate_count == cost then
+    redis.call('EXPIRE', KEYS[1], 1)
+end
+local rate_allowed = rate_count <= tonumber(ARGV[1])
+""" + _DAILY_LIMIT_TAIL
+
+    def keys(self, token: str, now: float) -> List[str]:
+        return [f"rate:{token}:{int(now)}", self._daily_limit_key(token, now)]
+
+    def check_local(self, state: LocalRateState, rate_limit: int, now: float, cost: int = 1) -> Tuple[bool, int]:
+        state.roll(int(now))
+        state.count += cost
+        return state.count <= rate_limit, state.count
+
+    def local_expiry(self, state: LocalRateState) -> float:
+        return state.window + 1
+
+class SlidingWindow(RateLimitAlgorithm):
+    """Sliding window counter.
+
+    Weighs the previous second's count by how much of it still overlaps the
+    last second, which removes the edge bursts of the fixed window. Rejected
+    requests are not counted.
+    """
+    name = SLIDING_WINDOW
+    script = """
+local cost = tonumber(ARGV[6])
+local previous = tonumber(redis.call('GET', KEYS[3]) or 0)
+local current = tonumber(redis.call('GET', KEYS[1]) or 0)
+local estimate = previous * (1000 - tonumber(ARGV[4]) % 1000) / 1000 + current
+local rate_allowed = estimate + cost <= tonumber(ARGV[1])
+if rate_allowed then
+    if redis.call('INCRBY', KEYS[1], cost) == cost then
+        redis.call('EXPIRE', KEYS[1], 2)
+    end
+    estimate = estimate + cost
+end
+local rate_count = math.ceil(estimate)
+""" + _DAILY_LIMIT_TAIL
+
+    def keys(self, token: str, now: float) -> List[str]:
+        return [
+            f"rate:{token}:{int(now)}",
+            self._daily_limit_key(token, now),
+            f"rate:{token}:{int(now) - 1}"
+        ]
+
+    def check_local(self, state: LocalRateState, rate_limit: int, now: float, cost: int = 1) -> Tuple[bool, int]:
+        state.roll(int(now))
+        estimate = state.previous * (1000 - int(now * 1000) % 1000) / 1000 + state.count
+        allowed = estimate + cost <= rate_limit
+        if allowed:
+            state.count += cost
+            estimate += cost
+        return allowed, math.ceil(estimate)
+
+    def local_expiry(self, state: LocalRateState) -> float:
+        return state.window + 2
+
+class GenericCellRateAlgorithm(RateLimitAlgorithm):
+    """GCRA: one key per token holding its theoretical arrival time (TAT).
+
+    Requests are spaced 1/rate_limit seconds apart, with a burst allowance of
+    `burst` requests, so at most burst + rate_limit requests fit in any one
+    second and there is no per-window key churn. The rate count reported is
+    the number of requests currently queued within the burst allowance.
+    A request costing more than the burst is admitted only when the token
+    has nothing queued, and then pushes the TAT out by its full cost.
+    """
+    name = GCRA
+    script = """
+local cost = tonumber(ARGV[6])
+local interval = 1000 / tonumber(ARGV[1])
+local now = tonumber(ARGV[4])
+local tat = tonumber(redis.call('GET', KEYS[1]) or 0)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval * cost
+local rate_allowed = now >= new_tat - interval * math.max(tonumber(ARGV[5]), cost)
+local rate_count = math.ceil((tat - now) / interval)
+if rate_allowed then
+    redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+    rate_count = rate_count + cost
+end
+""" + _DAILY_LIMIT_TAIL
+
+    def __init__(self, burst_ratio: float = settings.RATE_LIMIT_GCRA_BURST_RATIO):
+        self._burst_ratio = burst_ratio
+
+    def keys(self, token: str, now: float) -> List[str]:
+        return [f"gcra:{token}", self._daily_limit_key(token, now)]
+
+    def parameter(self, rate_limit: int) -> int:
+        return max(1, math.ceil(rate_limit * self._burst_ratio))
+
+    def check_local(self, state: LocalRateState, rate_limit: int, now: float, cost: int = 1) -> Tuple[bool, int]:
+        interval = 1000 / rate_limit
+        now = int(now * 1000)
+        tat = max(state.tat, now)
+        new_tat = tat + interval * cost
+        allowed = now >= new_tat - interval * max(self.parameter(rate_limit), cost)
+        rate_count = math.ceil((tat - now) / interval)
+        if allowed:
+            state.tat = new_tat
+            rate_count += cost
+        return allowed, rate_count
+
+    def local_expiry(self, state: LocalRateState) -> float:
+        return state.tat / 1000
+
+ALGORITHMS: Dict[str, RateLimitAlgorithm] = {
+    algorithm.name: algorithm
+    for algorithm in (FixedWindow(), SlidingWindow(), GenericCellRateAlgorithm())
+}
+
+def get_algorithm(name: str) -> RateLimitAlgorithm:
+    try:
+        return ALGORITHMS[name]
+    except KeyError:
+        raise ValueError(f"Unknown rate limit algorithm: {name}")
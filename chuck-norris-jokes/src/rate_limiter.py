@@ -1,33 +1,124 @@
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+from redis import RedisError
+import settings
+from helpers.circuit_breaker import CircuitBreaker
 from helpers.time_helpers import get_current_timestamp, get_start_of_day_timestamp
-from redis_connection import get_redis
+from daily_counters import DailyCounters
+from rate_limit_algorithms import ALGORITHMS, FIXED_WINDOW, SECONDS_IN_DAY, get_algorithm
+from redis_connection import (
+    RedisShards, get_async_redis, get_async_redis_shards, get_circuit_breaker, get_redis, get_redis_shards
+)
 
-SECONDS_IN_DAY = 86400
+logger = logging.getLogger(__name__)
 
-class RateLimiter:
-    def __init__(self):
-        # *******************************************************
-        # The system will crach if redis connection is lost.
-        # Connection recovery is not implemented.
-        # *******************************************************
-        self.redis = get_redis()
+class RateLimitBackend:
+    """What the Auth middleware needs from a rate limiter.
+
+    Implemented by the Redis limiters (AsyncRateLimiter and
+    HybridRateLimiter, state shared by every worker) and MemoryRateLimiter
+    (state in the process). `start` and `close` run at app startup and
+    shutdown.
+    """
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def is_allowed(self, token: str, rate_limit: int, daily_limit: int = None,
+                         algorithm: str = FIXED_WINDOW, cost: int = 1) -> bool:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+class BaseRateLimiter:
+    """Key layout, limit checks and failure policy shared by the sync and async limiters.
+
+    Redis calls go through the shared circuit breaker. While Redis is failing
+    or the breaker is open, `is_allowed` answers with the failure policy:
+    True when failing open, False when failing closed. With `shards`, each
+    token's keys live on the Redis node the ring assigns it, and its calls
+    go through that node's breaker.
+    """
+
+    def __init__(self, breaker: CircuitBreaker = None, fail_open: bool = settings.RATE_LIMIT_FAIL_OPEN,
+                 shards: RedisShards = None):
+        self._breaker = breaker or get_circuit_breaker()
+        self._fail_open = fail_open
+        self._shards = shards
 
-    def _increment_key(self, key: str, expiration: int) -> int:
-        if self.redis.get(key) is None:
-            self.redis.setex(key, expiration, 1)
-            return 1
-        return self.redis.incr(key)
+    def _redis_for(self, token: str):
+        """Client of the Redis node holding the token's keys"""
+        return self.redis if self._shards is None else self._shards.for_token(token)
+
+    def _breaker_for(self, token: str) -> CircuitBreaker:
+        """Circuit breaker of the Redis node holding the token's keys"""
+        return self._breaker if self._shards is None else self._shards.breaker_for(token)
+
+    def _on_redis_error(self, error: RedisError, breaker: CircuitBreaker) -> bool:
+        breaker.record_failure()
+        logger.error(f"Rate limit Redis call failed, failing {'open' if self._fail_open else 'closed'}: {error}")
+        return self._fail_open
+
+    def _rate_limit_key(self, token: str, timestamp: int = None) -> str:
+        if timestamp is None:
+            timestamp = get_current_timestamp()
+        return f"rate:{token}:{timestamp}"
+
+    def _daily_limit_key(self, token: str, timestamp: int = None) -> str:
+        if timestamp is None:
+            timestamp = get_start_of_day_timestamp()
+        return f"daily:{token}:{timestamp}"
 
     def _is_within_limit(self, count: int, limit: int) -> bool:
         return count <= limit
 
-    def _is_within_rate_limit(self, token: str, rate_limit: int) -> bool:
-        rate_limit_key = f"rate:{token}:{get_current_timestamp()}"
-        count = self._increment_key(rate_limit_key, expiration=1)
+    def _register_scripts(self) -> None:
+        # Registered scripts are invoked by SHA and only (re)loaded on NOSCRIPT
+        self._scripts = {name: self.redis.register_script(algorithm.script)
+                         for name, algorithm in ALGORITHMS.items()}
+
+    def _script_call(self, token: str, rate_limit: int, daily_limit: Optional[int], algorithm: str,
+                     cost: int = 1):
+        rate_limit_algorithm = get_algorithm(algorithm)
+        now = time.time()
+        return self._scripts[algorithm](
+            keys=rate_limit_algorithm.keys(token, now),
+            args=rate_limit_algorithm.args(rate_limit, daily_limit, now, cost),
+            client=self._redis_for(token)
+        )
+
+    def _script_result(self, result: list) -> Tuple[bool, int, Optional[int]]:
+        allowed, rate_count, daily_count = result
+        return bool(allowed), rate_count, None if daily_count < 0 else daily_count
+
+class RateLimiter(BaseRateLimiter):
+    def __init__(self, use_script: bool = settings.RATE_LIMIT_USE_SCRIPT, breaker: CircuitBreaker = None,
+                 fail_open: bool = settings.RATE_LIMIT_FAIL_OPEN):
+        super().__init__(breaker, fail_open, get_redis_shards())
+        self.redis = get_redis()
+        self._use_script = use_script
+        self._register_scripts()
+
+    def _increment_key(self, key: str, expiration: int, amount: int = 1, client=None) -> int:
+        redis = self.redis if client is None else client
+        if redis.get(key) is None:
+            redis.setex(key, expiration, amount)
+            return amount
+        return redis.incrby(key, amount)
+
+    def _is_within_rate_limit(self, token: str, rate_limit: int, cost: int = 1) -> bool:
+        count = self._increment_key(self._rate_limit_key(token), expiration=1, amount=cost,
+                                    client=self._redis_for(token))
         return self._is_within_limit(count, rate_limit)
 
-    def _is_within_daily_limit(self, token: str, daily_limit: int) -> bool:
-        daily_limit_key = f"daily:{token}:{get_start_of_day_timestamp()}"
-        count = self._increment_key(daily_limit_key, expiration=SECONDS_IN_DAY)
+    def _is_within_daily_limit(self, token: str, daily_limit: int, cost: int = 1) -> bool:
+        count = self._increment_key(self._daily_limit_key(token), expiration=SECONDS_IN_DAY, amount=cost,
+                                    client=self._redis_for(token))
         return self._is_within_limit(count, daily_limit)
 
     # ****************************************************************************************************
@@ -44,14 +135,107 @@ class RateLimiter:
     #     if daily_limit is not None and (not isinstance(daily_limit, int) or daily_limit <= 0):
     #         raise ValueError("Daily limit must be a positive integer")
 
-    def is_allowed(self, token: str, rate_limit: int, daily_limit: int = None) -> bool:
+    def check_limits(self, token: str, rate_limit: int, daily_limit: int = None,
+                     algorithm: str = FIXED_WINDOW, cost: int = 1) -> Tuple[bool, int, Optional[int]]:
+        """Atomically check both limits charging `cost` requests, return (allowed, rate count, daily count)"""
+        return self._script_result(self._script_call(token, rate_limit, daily_limit, algorithm, cost))
+
+    def is_allowed(self, token: str, rate_limit: int, daily_limit: int = None,
+                   algorithm: str = FIXED_WINDOW, cost: int = 1) -> bool:
+        """Whether a request worth `cost` requests (e.g. a bulk request) fits both limits"""
+        breaker = self._breaker_for(token)
+        if not breaker.allow_request():
+            return self._fail_open
+        try:
+            allowed = self._check(token, rate_limit, daily_limit, algorithm, cost)
+        except RedisError as e:
+            return self._on_redis_error(e, breaker)
+        breaker.record_success()
+        return allowed
+
+    def _check(self, token: str, rate_limit: int, daily_limit: int = None,
+               algorithm: str = FIXED_WINDOW, cost: int = 1) -> bool:
+        # Only the fixed window has a command-based implementation
+        if self._use_script or algorithm != FIXED_WINDOW:
+            allowed, _, _ = self.check_limits(token, rate_limit, daily_limit, algorithm, cost)
+            return allowed
 
-        if not self._is_within_rate_limit(token, rate_limit):
+        if not self._is_within_rate_limit(token, rate_limit, cost):
             return False
             
-        if daily_limit is not None and not self._is_within_daily_limit(token, daily_limit):
+        if daily_limit is not None and not self._is_within_daily_limit(token, daily_limit, cost):
             return False
             
         return True
 
+class AsyncRateLimiter(BaseRateLimiter, RateLimitBackend):
+    """asyncio variant of RateLimiter with the same semantics.
+
+    Runs on the shared async Redis connection pool, so a rate check only
+    suspends the calling request instead of blocking the event loop. With
+    `daily_counters` (write-behind mode), only the per-second limit is
+    checked in Redis; daily limits are enforced by the counters in process.
+    """
+
+    def __init__(self, use_script: bool = settings.RATE_LIMIT_USE_SCRIPT, breaker: CircuitBreaker = None,
+                 fail_open: bool = settings.RATE_LIMIT_FAIL_OPEN, daily_counters: DailyCounters = None):
+        super().__init__(breaker, fail_open, get_async_redis_shards())
+        self.redis = get_async_redis()
+        self._use_script = use_script
+        self._daily_counters = daily_counters
+        self._register_scripts()
 
+    async def _increment_key(self, key: str, expiration: int, amount: int = 1, client=None) -> int:
+        redis = self.redis if client is None else client
+        if await redis.get(key) is None:
+            await redis.setex(key, expiration, amount)
+            return amount
+        return await redis.incrby(key, amount)
+
+    async def _is_within_rate_limit(self, token: str, rate_limit: int, cost: int = 1) -> bool:
+        count = await self._increment_key(self._rate_limit_key(token), expiration=1, amount=cost,
+                                          client=self._redis_for(token))
+        return self._is_within_limit(count, rate_limit)
+
+    async def _is_within_daily_limit(self, token: str, daily_limit: int, cost: int = 1) -> bool:
+        if self._daily_counters is not None:
+            return await self._daily_counters.charge(self._daily_limit_key(token), daily_limit, cost,
+                                                     self._redis_for(token), self._breaker_for(token))
+        count = await self._increment_key(self._daily_limit_key(token), expiration=SECONDS_IN_DAY, amount=cost,
+                                          client=self._redis_for(token))
+        return self._is_within_limit(count, daily_limit)
+
+    async def check_limits(self, token: str, rate_limit: int, daily_limit: int = None,
+                           algorithm: str = FIXED_WINDOW, cost: int = 1) -> Tuple[bool, int, Optional[int]]:
+        """Atomically check both limits charging `cost` requests, return (allowed, rate count, daily count)"""
+        return self._script_result(await self._script_call(token, rate_limit, daily_limit, algorithm, cost))
+
+    async def is_allowed(self, token: str, rate_limit: int, daily_limit: int = None,
+                         algorithm: str = FIXED_WINDOW, cost: int = 1) -> bool:
+        """Whether a request worth `cost` requests (e.g. a bulk request) fits both limits"""
+        breaker = self._breaker_for(token)
+        if not breaker.allow_request():
+            return self._fail_open
+        try:
+            allowed = await self._check(token, rate_limit, daily_limit, algorithm, cost)
+        except RedisError as e:
+            return self._on_redis_error(e, breaker)
+        breaker.record_success()
+        return allowed
+
+    async def _check(self, token: str, rate_limit: int, daily_limit: int = None,
+                     algorithm: str = FIXED_WINDOW, cost: int = 1) -> bool:
+        # Only the fixed window has a command-based implementation
+        if self._use_script or algorithm != FIXED_WINDOW:
+            # Write-behind mode leaves the daily limit to the local counters
+            script_daily_limit = daily_limit if self._daily_counters is None else None
+            allowed, _, _ = await self.check_limits(token, rate_limit, script_daily_limit, algorithm, cost)
+            if not allowed or self._daily_counters is None:
+                return allowed
+        elif not await self._is_within_rate_limit(token, rate_limit, cost):
+            return False
+
+        if daily_limit is not None and not await self._is_within_daily_limit(token, daily_limit, cost):
+            return False
+
+        return True
@@ -1,30 +1,207 @@
-import os
-from redis import Redis, ConnectionError
+from typing import Any, Dict, List, Optional, Tuple
+from redis import Redis, BlockingConnectionPool, Connection, ConnectionError, TimeoutError
+from redis import asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 import logging
+import settings
+from helpers.circuit_breaker import CLOSED, CircuitBreaker
+from helpers.consistent_hash import ConsistentHashRing
+from metrics import REDIS_ROUND_TRIPS
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 _redis_client = None
+_async_redis_client = None
+_redis_shards = None
+_async_redis_shards = None
+_circuit_breaker = None
 
-# !!!!!! This is a simple solution for now !!!!!
-# Robust solution can be achieved using:
-#  connection pool 
-#  connection recovery
-# Handling only CREATE connection (ignoring all the rests like CLOSE, DISCONNECT, etc.)
+# Connections come from bounded blocking pools: a caller waits at most
+# REDIS_POOL_TIMEOUT for a free connection, sockets time out after
+# REDIS_SOCKET_TIMEOUT, idle connections are health-checked with PING and
+# commands failing with a connection error or timeout are retried on a new
+# connection with exponential backoff. A Redis outage therefore
+# costs bounded latency per call; the circuit breaker then stops callers from
+# waiting on a dead server at all.
+
+_SYNC_ROUND_TRIPS = REDIS_ROUND_TRIPS.labels('sync')
+_ASYNC_ROUND_TRIPS = REDIS_ROUND_TRIPS.labels('async')
+
+class _CountingConnection(Connection):
+    """Counts round trips: one per command, or per pipeline sent in one write"""
+
+    def send_packed_command(self, command, check_health=True):
+        _SYNC_ROUND_TRIPS.inc()
+        return super().send_packed_command(command, check_health)
+
+class _AsyncCountingConnection(aioredis.Connection):
+    async def send_packed_command(self, command, check_health=True):
+        _ASYNC_ROUND_TRIPS.inc()
+        return await super().send_packed_command(command, check_health)
+
+def _connection_kwargs(host: str = None, port: int = None) -> Dict[str, Any]:
+    return dict(
+        host=settings.REDIS_HOST if host is None else host,
+        port=settings.REDIS_PORT if port is None else port,
+        db=0,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        # Without these the retry policy only covers opening connections
+        retry_on_error=[ConnectionError, TimeoutError]
+    )
+
+def _backoff() -> ExponentialBackoff:
+    return ExponentialBackoff(cap=settings.REDIS_BACKOFF_CAP, base=settings.REDIS_BACKOFF_BASE)
 
 def get_redis() -> Redis:
     global _redis_client
     if _redis_client is None:
         try:
-            _redis_client = Redis(
-                host=os.getenv('REDIS_HOST', 'localhost'),  # Use environment variable
-                port=int(os.getenv('REDIS_PORT', 6379)),    # Use environment variable
-                db=0
+            pool = BlockingConnectionPool(
+                connection_class=_CountingConnection,
+                retry=Retry(_backoff(), settings.REDIS_RETRIES),
+                **_connection_kwargs()
             )
+            _redis_client = Redis(connection_pool=pool)
             _redis_client.ping()  # Verify connection
             logger.info("Successfully connected to Redis")
         except ConnectionError as e:
+            _redis_client = None
             logger.error(f"Failed to connect to Redis: {e}")
             raise
-    return _redis_client
\ No newline at end of file
+    return _redis_client
+
+def _async_client(host: str = None, port: int = None) -> aioredis.Redis:
+    pool = aioredis.BlockingConnectionPool(
+        connection_class=_AsyncCountingConnection,
+        retry=AsyncRetry(_backoff(), settings.REDIS_RETRIES),
+        **_connection_kwargs(host, port)
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+def get_async_redis() -> aioredis.Redis:
+    """Shared asyncio client; connections are opened lazily from its pool"""
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = _async_client()
+    return _async_redis_client
+
+def _new_circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        failure_threshold=settings.REDIS_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.REDIS_BREAKER_RESET_TIMEOUT
+    )
+
+class RedisShards:
+    """Clients of several Redis nodes, each token assigned to one node by consistent hashing.
+
+    All keys of a token (its rate, daily and GCRA keys) live on the node
+    `for_token` picks, so the per-token scripts stay atomic; adding a node
+    moves only about 1/N of the tokens. Each node has its own circuit
+    breaker, so one failing node does not cut off the tokens of the others.
+    """
+
+    def __init__(self, clients: Dict[str, Any], replicas: int = settings.REDIS_RING_REPLICAS):
+        self.clients = clients
+        self.breakers = {node: _new_circuit_breaker() for node in clients}
+        self._ring = ConsistentHashRing(clients, replicas)
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def for_token(self, token: str) -> Any:
+        return self.clients[self._ring.node_for(token)]
+
+    def breaker_for(self, token: str) -> CircuitBreaker:
+        """Circuit breaker of the node `for_token` picks"""
+        return self.breakers[self._ring.node_for(token)]
+
+def parse_redis_nodes(value: str) -> List[Tuple[str, int]]:
+    """`host:port` pairs of a comma-separated REDIS_NODES list, the port defaulting to 6379"""
+    nodes = []
+    for node in filter(None, (node.strip() for node in value.split(','))):
+        host, _, port = node.rpartition(':')
+        if not host:
+            host, port = port, '6379'
+        nodes.append((host, int(port)))
+    return nodes
+
+def _shards(client_factory) -> Optional[RedisShards]:
+    nodes = parse_redis_nodes(settings.REDIS_NODES)
+    if len(nodes) < 2:
+        return None
+    return RedisShards({f'{host}:{port}': client_factory(host, port) for host, port in nodes})
+
+def get_redis_shards() -> Optional[RedisShards]:
+    """Sync clients of the REDIS_NODES ring, or None when one node holds all rate limit state"""
+    global _redis_shards
+    if _redis_shards is None:
+        _redis_shards = _shards(lambda host, port: Redis(connection_pool=BlockingConnectionPool(
+            connection_class=_CountingConnection,
+            retry=Retry(_backoff(), settings.REDIS_RETRIES),
+            **_connection_kwargs(host, port)
+        )))
+    return _redis_shards
+
+def get_async_redis_shards() -> Optional[RedisShards]:
+    """Asyncio clients of the REDIS_NODES ring, or None when one node holds all rate limit state"""
+    global _async_redis_shards
+    if _async_redis_shards is None:
+        _async_redis_shards = _shards(_async_client)
+    return _async_redis_shards
+
+async def close_async_redis() -> None:
+    """Close pooled connections; the pools reconnect lazily if used again"""
+    if _async_redis_client is not None:
+        await _async_redis_client.connection_pool.disconnect()
+    if _async_redis_shards is not None:
+        for client in _async_redis_shards.clients.values():
+            await client.connection_pool.disconnect()
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Breaker shared by everything that talks to the REDIS_HOST server; shards have their own"""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = _new_circuit_breaker()
+    return _circuit_breaker
+
+def _pool_stats(pool) -> Dict[str, int]:
+    if not hasattr(pool, 'pool'):
+        # Only blocking pools keep a queue of free slots to inspect
+        return {'max_connections': pool.max_connections}
+    # Free slots hold either an idle connection or a None placeholder
+    queued = getattr(pool.pool, 'queue', None)  # queue.LifoQueue (sync pool)
+    if queued is None:
+        queued = pool.pool._queue               # asyncio.LifoQueue (async pool)
+    created = len(pool._connections)
+    idle = sum(1 for connection in queued if connection is not None)
+    return {
+        'max_connections': pool.max_connections,
+        'created_connections': created,
+        'in_use_connections': created - idle
+    }
+
+def get_redis_stats() -> Dict[str, Any]:
+    """Pool utilisation and breaker states, for monitoring"""
+    stats = {'circuit_breaker': get_circuit_breaker().state}
+    if _async_redis_client is not None:
+        stats['async_pool'] = _pool_stats(_async_redis_client.connection_pool)
+    if _redis_client is not None:
+        stats['pool'] = _pool_stats(_redis_client.connection_pool)
+    if _async_redis_shards is not None:
+        stats['shards'] = len(_async_redis_shards)
+        # Summed over the nodes; per-node pools are sized like the single-node one
+        shard_pool: Dict[str, int] = {}
+        for client in _async_redis_shards.clients.values():
+            for key, value in _pool_stats(client.connection_pool).items():
+                shard_pool[key] = shard_pool.get(key, 0) + value
+        stats['shard_pool'] = shard_pool
+        stats['shard_breakers_open'] = sum(1 for breaker in _async_redis_shards.breakers.values()
+                                           if breaker.state != CLOSED)
+    return stats
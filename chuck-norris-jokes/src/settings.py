@@ -0,0 +1,135 @@
+import os
+
+# Every setting can be overridden with an environment variable of the same name.
+
+# Upstream jokes API
+UPSTREAM_URL = os.getenv('UPSTREAM_URL', 'https://api.chucknorris.io/jokes/random')
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 2.0))  # seconds
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv('UPSTREAM_MAX_KEEPALIVE', 20))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', 50))
+# Each upstream attempt is cut off after UPSTREAM_ATTEMPT_TIMEOUT_MS and a fetch, hedges
+# included, after UPSTREAM_TOTAL_TIMEOUT_MS. With UPSTREAM_HEDGE, a fetch slower than the
+# UPSTREAM_HEDGE_PERCENTILE of recent attempts (at least UPSTREAM_HEDGE_MIN_DELAY_MS) sends a
+# second request; at most UPSTREAM_HEDGE_BUDGET of fetches are hedged
+UPSTREAM_ATTEMPT_TIMEOUT_MS = int(os.getenv('UPSTREAM_ATTEMPT_TIMEOUT_MS', 2000))
+UPSTREAM_TOTAL_TIMEOUT_MS = int(os.getenv('UPSTREAM_TOTAL_TIMEOUT_MS', 4000))
+# A read can never outlast its attempt, so by default it gets the attempt's deadline
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', UPSTREAM_ATTEMPT_TIMEOUT_MS / 1000))  # seconds
+UPSTREAM_HEDGE = os.getenv('UPSTREAM_HEDGE', 'true').lower() == 'true'
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', 95))
+UPSTREAM_HEDGE_MIN_DELAY_MS = int(os.getenv('UPSTREAM_HEDGE_MIN_DELAY_MS', 5))
+UPSTREAM_HEDGE_BUDGET = float(os.getenv('UPSTREAM_HEDGE_BUDGET', 0.05))
+# Unused hedge budget saved up for bursts of slow fetches, in hedges
+UPSTREAM_HEDGE_BURST = float(os.getenv('UPSTREAM_HEDGE_BURST', 10.0))
+# Concurrent callers share upstream fetches, at most UPSTREAM_COALESCE_MAX_FAN_OUT per batch
+UPSTREAM_COALESCE = os.getenv('UPSTREAM_COALESCE', 'true').lower() == 'true'
+UPSTREAM_COALESCE_MAX_FAN_OUT = int(os.getenv('UPSTREAM_COALESCE_MAX_FAN_OUT', 4))
+
+# Plan-aware scheduling of /joke and /jokes fetches: at most PLAN_SCHEDULER_CONCURRENCY run at
+# once, the rest queue (up to PLAN_SCHEDULER_QUEUE_SIZE, for PLAN_SCHEDULER_QUEUE_TIMEOUT_MS) and
+# are served by weighted fair queuing with PLAN_WEIGHTS (plans not listed weigh 1)
+PLAN_SCHEDULER = os.getenv('PLAN_SCHEDULER', 'true').lower() == 'true'
+PLAN_SCHEDULER_CONCURRENCY = int(os.getenv('PLAN_SCHEDULER_CONCURRENCY', UPSTREAM_MAX_CONCURRENCY))
+PLAN_WEIGHTS = os.getenv('PLAN_WEIGHTS', 'enterprise=10,pro=3,free=1')
+PLAN_SCHEDULER_QUEUE_SIZE = int(os.getenv('PLAN_SCHEDULER_QUEUE_SIZE', 200))
+PLAN_SCHEDULER_QUEUE_TIMEOUT_MS = int(os.getenv('PLAN_SCHEDULER_QUEUE_TIMEOUT_MS', 1000))
+
+# Prefetched joke pool (JOKE_POOL_SIZE=0 disables it)
+JOKE_POOL_SIZE = int(os.getenv('JOKE_POOL_SIZE', 100))
+JOKE_POOL_LOW_WATERMARK = int(os.getenv('JOKE_POOL_LOW_WATERMARK', JOKE_POOL_SIZE // 4))
+JOKE_POOL_HIGH_WATERMARK = int(os.getenv('JOKE_POOL_HIGH_WATERMARK', JOKE_POOL_SIZE))
+JOKE_POOL_REFILL_CONCURRENCY = int(os.getenv('JOKE_POOL_REFILL_CONCURRENCY', 4))
+
+# /joke?category= buffers: JOKE_CATEGORY_POOL_SIZE jokes split between categories by
+# demand (re-split every JOKE_CATEGORY_REBALANCE_INTERVAL seconds), plus an index of the
+# last JOKE_CATEGORY_INDEX_SIZE jokes seen, served when a category's buffer is empty
+JOKE_CATEGORY_POOL_SIZE = int(os.getenv('JOKE_CATEGORY_POOL_SIZE', 100))
+JOKE_CATEGORY_INDEX_SIZE = int(os.getenv('JOKE_CATEGORY_INDEX_SIZE', 1000))
+JOKE_CATEGORY_REBALANCE_INTERVAL = float(os.getenv('JOKE_CATEGORY_REBALANCE_INTERVAL', 10.0))
+
+# GET /jokes?count=N: at most JOKES_MAX_COUNT jokes per request, fetched
+# JOKES_FETCH_CONCURRENCY at a time
+JOKES_MAX_COUNT = int(os.getenv('JOKES_MAX_COUNT', 100))
+JOKES_FETCH_CONCURRENCY = int(os.getenv('JOKES_FETCH_CONCURRENCY', 8))
+
+# Where jokes come from: 'upstream', 'corpus' or 'upstream_with_fallback'
+JOKE_SOURCE = os.getenv('JOKE_SOURCE', 'upstream')
+JOKE_CORPUS_PATH = os.getenv('JOKE_CORPUS_PATH', './jokes.corpus')
+
+# Accounts file, JSON or a table compiled with accounts_table.py; checked for changes
+# every ACCOUNTS_POLL_INTERVAL seconds, and immediately on inotify events where
+# available (ACCOUNTS_USE_INOTIFY)
+ACCOUNTS_PATH = os.getenv('ACCOUNTS_PATH', './accounts.json')
+ACCOUNTS_POLL_INTERVAL = float(os.getenv('ACCOUNTS_POLL_INTERVAL', 5.0))
+ACCOUNTS_USE_INOTIFY = os.getenv('ACCOUNTS_USE_INOTIFY', 'true').lower() == 'true'
+# Recently rejected unknown tokens remembered per worker (0 disables the cache)
+ACCOUNTS_NEGATIVE_CACHE_SIZE = int(os.getenv('ACCOUNTS_NEGATIVE_CACHE_SIZE', 10000))
+# False positive rate of the Bloom filter built for compiled accounts tables (0 disables it)
+ACCOUNTS_BLOOM_FALSE_POSITIVE_RATE = float(os.getenv('ACCOUNTS_BLOOM_FALSE_POSITIVE_RATE', 0.01))
+
+# Multi-worker launcher (launcher.py): worker processes (0: one per CPU the process may use,
+# after affinity and any cgroup CPU quota), and where the accounts table compiled from a JSON
+# ACCOUNTS_PATH is shared between them (a tmpfs by default)
+WORKERS = int(os.getenv('WORKERS', 0))
+SHARED_ACCOUNTS_DIR = os.getenv('SHARED_ACCOUNTS_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp')
+
+# Metrics in the Prometheus text format on METRICS_PATH, served without authentication
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+# Under the launcher, worker i also listens on METRICS_WORKER_PORT + i so each worker's
+# metrics can be scraped on their own (0 disables)
+METRICS_WORKER_PORT = int(os.getenv('METRICS_WORKER_PORT', 0))
+
+# Admission control: at most an adaptive number of concurrent requests (AIMD between
+# ADMISSION_MIN_LIMIT and ADMISSION_MAX_LIMIT, backing off when the time to the response
+# start exceeds ADMISSION_TARGET_LATENCY_MS); up to ADMISSION_QUEUE_SIZE more wait at most
+# ADMISSION_QUEUE_TIMEOUT_MS, the rest get a 503 with Retry-After: ADMISSION_RETRY_AFTER
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'true').lower() == 'true'
+ADMISSION_INITIAL_LIMIT = int(os.getenv('ADMISSION_INITIAL_LIMIT', 100))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', 10))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', 1000))
+ADMISSION_TARGET_LATENCY_MS = int(os.getenv('ADMISSION_TARGET_LATENCY_MS', 250))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 50))
+ADMISSION_QUEUE_TIMEOUT_MS = int(os.getenv('ADMISSION_QUEUE_TIMEOUT_MS', 100))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))  # seconds
+
+# Rate limiting
+# Where rate limit state lives: 'redis' (shared by every worker and host) or 'memory'
+# (this process only, for single-process deployments)
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'redis')
+# Check the rate and daily limits in one atomic server-side script instead of GET/SETEX/INCR commands
+RATE_LIMIT_USE_SCRIPT = os.getenv('RATE_LIMIT_USE_SCRIPT', 'true').lower() == 'true'
+# GCRA burst allowance as a share of the per-second limit (at least one request)
+RATE_LIMIT_GCRA_BURST_RATIO = float(os.getenv('RATE_LIMIT_GCRA_BURST_RATIO', 0.2))
+# What RateLimiter answers when Redis is unreachable or its circuit breaker is open:
+# true lets requests through (fail-open), false rejects them (fail-closed)
+RATE_LIMIT_FAIL_OPEN = os.getenv('RATE_LIMIT_FAIL_OPEN', 'true').lower() == 'true'
+# Approximate mode (accounts with "rate_limit_mode": "approximate"): sync local
+# admissions with Redis every RATE_LIMIT_SYNC_INTERVAL_MS, or once a token has
+# min(RATE_LIMIT_SYNC_REQUESTS, RATE_LIMIT_LOCAL_SHARE * rate_limit) unsynced admissions
+RATE_LIMIT_SYNC_INTERVAL_MS = int(os.getenv('RATE_LIMIT_SYNC_INTERVAL_MS', 100))
+RATE_LIMIT_SYNC_REQUESTS = int(os.getenv('RATE_LIMIT_SYNC_REQUESTS', 20))
+RATE_LIMIT_LOCAL_SHARE = float(os.getenv('RATE_LIMIT_LOCAL_SHARE', 0.1))
+# Write-behind daily limits for exact accounts: daily counters are enforced in process
+# and flushed to Redis in batches, one script call per node, every DAILY_LIMIT_FLUSH_INTERVAL_MS
+DAILY_LIMIT_WRITE_BEHIND = os.getenv('DAILY_LIMIT_WRITE_BEHIND', 'false').lower() == 'true'
+DAILY_LIMIT_FLUSH_INTERVAL_MS = int(os.getenv('DAILY_LIMIT_FLUSH_INTERVAL_MS', 250))
+
+# Redis connection pool
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+# Rate limit state sharded by token across Redis nodes with consistent hashing: a
+# comma-separated host:port list (empty keeps it on REDIS_HOST:REDIS_PORT)
+REDIS_NODES = os.getenv('REDIS_NODES', '')
+REDIS_RING_REPLICAS = int(os.getenv('REDIS_RING_REPLICAS', 160))  # virtual nodes per Redis node
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 0.5))          # wait for a free connection (seconds)
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.25))     # seconds
+REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.25))   # seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))  # seconds
+REDIS_RETRIES = int(os.getenv('REDIS_RETRIES', 2))
+REDIS_BACKOFF_BASE = float(os.getenv('REDIS_BACKOFF_BASE', 0.01))         # seconds
+REDIS_BACKOFF_CAP = float(os.getenv('REDIS_BACKOFF_CAP', 0.1))            # seconds
+REDIS_BREAKER_FAILURE_THRESHOLD = int(os.getenv('REDIS_BREAKER_FAILURE_THRESHOLD', 5))
+REDIS_BREAKER_RESET_TIMEOUT = float(os.getenv('REDIS_BREAKER_RESET_TIMEOUT', 5.0))  # seconds
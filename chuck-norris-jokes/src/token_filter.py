@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import settings
+from helpers.bloom_filter import BloomFilter
+
+# Longer tokens are not cached, so a flood of huge headers cannot bloat the cache
+MAX_CACHED_TOKEN_LENGTH = 128
+
+class TokenFilter:
+    """Sheds unknown tokens before they reach the account lookup.
+
+    Two layers, both reset whenever the accounts snapshot changes:
+    - an LRU negative cache of recently rejected tokens, so repeated bad
+      tokens cost one dict lookup instead of a probe of a memory-mapped
+      table (a dict snapshot answers as cheaply, so `reset` can turn it
+      off);
+    - an optional Bloom filter of every known token, so a never-seen unknown
+      token is rejected without probing the accounts table or any backing
+      store. Tokens the filter lets through still need the real lookup.
+    """
+
+    def __init__(self, negative_cache_size: int = settings.ACCOUNTS_NEGATIVE_CACHE_SIZE):
+        self._negative_cache_size = negative_cache_size
+        self._negative: 'OrderedDict[str, None]' = OrderedDict()
+        self._negative_enabled = True
+        self._bloom: Optional[BloomFilter] = None
+        self.negative_cache_hits = 0
+        self.bloom_rejections = 0
+
+    def reset(self, bloom: Optional[BloomFilter] = None, negative_cache: bool = True) -> None:
+        """Start over for a new snapshot, with its Bloom filter if it has one"""
+        self._negative.clear()
+        self._negative_enabled = negative_cache
+        self._bloom = bloom
+
+    def rejects(self, token: str) -> bool:
+        """True when the token is known not to exist; False means look it up"""
+        if token in self._negative:
+            self._negative.move_to_end(token)
+            self.negative_cache_hits += 1
+            return True
+        if self._bloom is not None and token not in self._bloom:
+            self.bloom_rejections += 1
+            return True
+        return False
+
+    def remember(self, token: str) -> None:
+        """Cache a token that missed the account lookup"""
+        if not self._negative_enabled or self._negative_cache_size <= 0 or len(token) > MAX_CACHED_TOKEN_LENGTH:
+            return
+        self._negative[token] = None
+        if len(self._negative) > self._negative_cache_size:
+            self._negative.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'negative_cache_size': len(self._negative),
+            'negative_cache_hits': self.negative_cache_hits,
+            'bloom_filter': self._bloom is not None,
+            'bloom_rejections': self.bloom_rejections
+        }
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Set
+import httpx
+import settings
+from helpers.rolling_percentile import RollingPercentile
+from joke import Joke, UnknownCategoryError
+from metrics import STAGE_SECONDS, UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_DECODE_SECONDS = STAGE_SECONDS.labels('decode')
+_UPSTREAM_SECONDS = UPSTREAM_SECONDS.labels()
+_UPSTREAM_ERRORS = UPSTREAM_REQUESTS.labels('error')
+
+class UpstreamError(Exception):
+    """Custom exception for upstream jokes API errors"""
+    pass
+
+class UpstreamClient:
+    """Async client for the jokes API.
+
+    Keeps a keep-alive connection pool and bounds the number of requests
+    in flight, so one worker never opens more upstream connections than
+    it can reuse. Create it once at startup and close it at shutdown.
+
+    Each attempt is cut off after `attempt_timeout` seconds, and a fetch
+    after `total_timeout`. With hedging, a fetch still unanswered after
+    the `hedge_percentile` latency of recent successful attempts (at least
+    `hedge_min_delay`) sends one more request and takes whichever answers
+    first. Hedges are paid from a budget earning `hedge_budget` per fetch
+    (up to `hedge_burst` saved), so at most that share of fetches is
+    hedged even when upstream is slow across the board.
+    """
+
+    def __init__(
+        self,
+        url: str = settings.UPSTREAM_URL,
+        connect_timeout: float = settings.UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout: float = settings.UPSTREAM_READ_TIMEOUT,
+        max_connections: int = settings.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive: int = settings.UPSTREAM_MAX_KEEPALIVE,
+        max_concurrency: int = settings.UPSTREAM_MAX_CONCURRENCY,
+        attempt_timeout: float = settings.UPSTREAM_ATTEMPT_TIMEOUT_MS / 1000,
+        total_timeout: float = settings.UPSTREAM_TOTAL_TIMEOUT_MS / 1000,
+        hedge: bool = settings.UPSTREAM_HEDGE,
+        hedge_percentile: float = settings.UPSTREAM_HEDGE_PERCENTILE,
+        hedge_min_delay: float = settings.UPSTREAM_HEDGE_MIN_DELAY_MS / 1000,
+        hedge_budget: float = settings.UPSTREAM_HEDGE_BUDGET,
+        hedge_burst: float = settings.UPSTREAM_HEDGE_BURST,
+        transport: httpx.AsyncBaseTransport = None,
+    ):
+        self._url = url
+        self._attempt_timeout = attempt_timeout
+        self._total_timeout = total_timeout
+        self._hedge = hedge
+        self._latency = RollingPercentile(hedge_percentile)
+        self._hedge_min_delay = hedge_min_delay
+        self._hedge_budget = hedge_budget
+        self._hedge_burst = hedge_burst
+        self._hedge_tokens = 0.0
+        self.fetches = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.attempt_timeouts = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            # A longer read would be cut off by the attempt deadline anyway
+            timeout=httpx.Timeout(min(read_timeout, attempt_timeout), connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive
+            ),
+            transport=transport
+        )
+
+    async def fetch_joke(self, category: Optional[str] = None) -> Joke:
+        """Fetch a random joke, from `category` when given"""
+        self.fetches += 1
+        self._hedge_tokens = min(self._hedge_burst, self._hedge_tokens + self._hedge_budget)
+        started = time.perf_counter()
+        deadline = started + self._total_timeout
+        hedge_at = None if self.hedge_delay is None else started + self.hedge_delay
+        hedge = None
+        pending: Set[asyncio.Future] = {asyncio.ensure_future(self._attempt(category))}
+        try:
+            while True:
+                wake_at = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(pending, timeout=max(wake_at - time.perf_counter(), 0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                error = None
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                    else:
+                        error = task.exception()
+                if winner is not None:
+                    if winner is hedge:
+                        self.hedge_wins += 1
+                    return winner.result()
+                # A missing category is not worth waiting on the other attempt for
+                if not pending or isinstance(error, UnknownCategoryError):
+                    raise error
+                if time.perf_counter() >= deadline:
+                    _UPSTREAM_ERRORS.inc()
+                    raise UpstreamError(f"Upstream did not answer within {self._total_timeout}s")
+                if hedge_at is not None and time.perf_counter() >= hedge_at:
+                    hedge_at = None
+                    if self._hedge_tokens >= 1:
+                        self._hedge_tokens -= 1
+                        self.hedges += 1
+                        hedge = asyncio.ensure_future(self._attempt(category))
+                        pending.add(hedge)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @property
+    def hedge_delay(self) -> Optional[float]:
+        """How long a fetch waits before hedging, None without hedging or enough samples"""
+        if not self._hedge or self._latency.value is None:
+            return None
+        return max(self._hedge_min_delay, self._latency.value)
+
+    async def _attempt(self, category: Optional[str]) -> Joke:
+        started = time.perf_counter()
+        try:
+            joke = await asyncio.wait_for(self._fetch(category), self._attempt_timeout)
+        except asyncio.TimeoutError:
+            self.attempt_timeouts += 1
+            _UPSTREAM_ERRORS.inc()
+            logger.error(f"Upstream request timed out after {self._attempt_timeout}s")
+            raise UpstreamError(f"Upstream request timed out after {self._attempt_timeout}s")
+        self._latency.add(time.perf_counter() - started)
+        return joke
+
+    async def _fetch(self, category: Optional[str]) -> Joke:
+        params = None if category is None else {'category': category}
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self._client.get(self._url, params=params)
+            except httpx.HTTPError as e:
+                _UPSTREAM_SECONDS.observe(time.perf_counter() - started)
+                _UPSTREAM_ERRORS.inc()
+                logger.error(f"Failed to fetch joke from upstream: {e}")
+                raise UpstreamError(f"Error fetching joke: {str(e)}")
+            received = time.perf_counter()
+            _UPSTREAM_SECONDS.observe(received - started)
+            UPSTREAM_REQUESTS.labels(str(response.status_code)).inc()
+            if category is not None and response.status_code == 404:
+                raise UnknownCategoryError(f"Unknown joke category: {category}")
+            try:
+                response.raise_for_status()
+                joke = Joke.from_dict(response.json())
+                _DECODE_SECONDS.observe(time.perf_counter() - received)
+                return joke
+            except (httpx.HTTPError, ValueError) as e:
+                logger.error(f"Failed to fetch joke from upstream: {e}")
+                raise UpstreamError(f"Error fetching joke: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'fetches': self.fetches,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            # Share of fetches hedged, and of hedges answering first
+            'hedge_rate': self.hedges / self.fetches if self.fetches else 0.0,
+            'hedge_win_rate': self.hedge_wins / self.hedges if self.hedges else 0.0,
+            'hedge_delay_seconds': self.hedge_delay or 0.0,
+            'attempt_timeouts': self.attempt_timeouts
+        }
+
+    async def close(self) -> None:
+        await self._client.aclose()
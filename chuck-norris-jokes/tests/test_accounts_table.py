@@ -0,0 +1,129 @@
+import json
+import pytest
+from accounts_table import AccountsError, AccountsTable, build_accounts_table, is_accounts_table
+from accounts_watcher import AccountsWatcher
+
+ACCOUNTS = {
+    "1111-2222-3333": {"name": "Test User", "plan": "free", "daily_limit": 50, "rate_limit": 1},
+    "2222-3333-4444": {"name": "Pro User", "plan": "pro", "daily_limit": 12000, "rate_limit": 10},
+    "3333-4444-5555": {"name": "Enterprise User", "plan": "enterprise", "daily_limit": None,
+                       "rate_limit": 100, "rate_limit_mode": "approximate"}
+}
+
+@pytest.fixture
+def accounts_json(tmp_path):
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps(ACCOUNTS))
+    return str(path)
+
+@pytest.fixture
+def table_path(tmp_path, accounts_json):
+    path = str(tmp_path / "accounts.table")
+    build_accounts_table(accounts_json, path)
+    return path
+
+@pytest.fixture
+def table(table_path):
+    table = AccountsTable(table_path)
+    yield table
+    table.close()
+
+def test_build_returns_count(accounts_json, tmp_path):
+    assert build_accounts_table(accounts_json, str(tmp_path / "out.table")) == 3
+
+def test_lookup(table):
+    assert len(table) == 3
+    assert dict(table["3333-4444-5555"]) == {
+        "plan": "enterprise", "daily_limit": None, "rate_limit": 100, "rate_limit_mode": "approximate"
+    }
+    assert table.get("1111-2222-3333")["rate_limit"] == 1
+
+def test_unknown_tokens(table):
+    assert table.get("9999-9999-9999") is None
+    assert table.get("1111-2222-3333-4444-5555") is None
+    assert table.get("") is None
+    assert "9999-9999-9999" not in table
+    with pytest.raises(KeyError):
+        table["9999-9999-9999"]
+
+def test_iterates_tokens(table):
+    assert sorted(table) == sorted(ACCOUNTS)
+
+def test_accounts_share_plan_definitions(tmp_path):
+    """Test that accounts with identical limits point at one interned plan"""
+    accounts = {f"{i:04d}-0000-0000": {"plan": "free", "rate_limit": 1, "daily_limit": 50} for i in range(1000)}
+    source = tmp_path / "accounts.json"
+    source.write_text(json.dumps(accounts))
+    build_accounts_table(str(source), str(tmp_path / "accounts.table"))
+
+    table = AccountsTable(str(tmp_path / "accounts.table"))
+
+    assert len(table) == 1000
+    assert all(table[token] is table["0000-0000-0000"] for token in accounts)
+
+def test_empty_accounts(tmp_path):
+    source = tmp_path / "accounts.json"
+    source.write_text("{}")
+    build_accounts_table(str(source), str(tmp_path / "accounts.table"))
+
+    table = AccountsTable(str(tmp_path / "accounts.table"))
+
+    assert len(table) == 0
+    assert table.get("1111-2222-3333") is None
+
+def test_build_rejects_invalid_accounts(tmp_path):
+    source = tmp_path / "accounts.json"
+    source.write_text(json.dumps({"1111": {"rate_limit": 0}}))
+
+    with pytest.raises(AccountsError):
+        build_accounts_table(str(source), str(tmp_path / "accounts.table"))
+
+def test_invalid_table(tmp_path):
+    path = tmp_path / "accounts.table"
+    path.write_bytes(b"CNJA truncated")
+
+    with pytest.raises(AccountsError):
+        AccountsTable(str(path))
+
+@pytest.mark.parametrize("keep", [40, -7])
+def test_truncated_table(table_path, keep):
+    """Cut inside the plans or the slots: raised as AccountsError, not struct.error or ValueError"""
+    with open(table_path, 'rb') as f:
+        data = f.read()
+    with open(table_path, 'wb') as f:
+        f.write(data[:keep])
+
+    with pytest.raises(AccountsError):
+        AccountsTable(table_path)
+
+@pytest.mark.asyncio
+async def test_watcher_keeps_snapshot_when_table_corrupt(table_path):
+    watcher = AccountsWatcher(table_path, use_inotify=False)
+    previous = watcher.snapshot
+    with open(table_path, 'rb') as f:
+        data = f.read()
+    with open(table_path, 'wb') as f:
+        f.write(data[:40])
+
+    assert await watcher.reload_if_changed() is False
+    assert watcher.snapshot is previous
+    assert watcher.reload_errors == 1
+
+def test_is_accounts_table(accounts_json, table_path, tmp_path):
+    assert is_accounts_table(table_path) is True
+    assert is_accounts_table(accounts_json) is False
+    assert is_accounts_table(str(tmp_path / "missing")) is False
+
+def test_watcher_maps_compiled_table(table_path):
+    watcher = AccountsWatcher(table_path, use_inotify=False)
+
+    assert isinstance(watcher.snapshot, AccountsTable)
+    assert watcher.snapshot.get("2222-3333-4444")["rate_limit"] == 10
+
+def test_watcher_builds_bloom_filter_for_table(table_path):
+    watcher = AccountsWatcher(table_path, use_inotify=False)
+
+    assert watcher.token_filter.rejects("9999-9999-9999") is True
+    assert watcher.token_filter.rejects("1111-2222-3333") is False
+    watcher.token_filter.remember("2222-2222-2222")
+    assert watcher.stats()['negative_cache_size'] == 1
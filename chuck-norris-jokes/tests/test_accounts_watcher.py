@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import Mock
+from accounts_table import AccountsError, validate_accounts
+from accounts_watcher import AccountsWatcher
+from helpers.file_helper import FileError
+
+ACCOUNTS = {
+    "1111-2222-3333": {"plan": "free", "rate_limit": 1, "daily_limit": 50}
+}
+
+def write_accounts(path, accounts, mtime_ns=None):
+    with open(path, 'w') as f:
+        json.dump(accounts, f)
+    if mtime_ns is not None:
+        # Explicit mtimes so back-to-back writes never share a timestamp
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+@pytest.fixture
+def accounts_path(tmp_path):
+    path = str(tmp_path / "accounts.json")
+    write_accounts(path, ACCOUNTS, mtime_ns=1_000_000_000)
+    return path
+
+def test_loads_snapshot_on_creation(accounts_path):
+    watcher = AccountsWatcher(accounts_path, use_inotify=False)
+
+    assert watcher.snapshot == ACCOUNTS
+
+def test_snapshot_is_read_only(accounts_path):
+    watcher = AccountsWatcher(accounts_path, use_inotify=False)
+
+    with pytest.raises(TypeError):
+        watcher.snapshot["new-token"] = {}
+    with pytest.raises(TypeError):
+        watcher.snapshot["1111-2222-3333"]["rate_limit"] = 100
+
+def test_json_snapshot_has_no_negative_cache(accounts_path):
+    """Test that unknown tokens are not cached for a dict snapshot, whose lookup is as cheap"""
+    watcher = AccountsWatcher(accounts_path, use_inotify=False)
+
+    watcher.token_filter.remember("9999-9999-9999")
+
+    assert watcher.token_filter.rejects("9999-9999-9999") is False
+    assert watcher.stats()['negative_cache_size'] == 0
+
+def test_missing_file_raises(tmp_path):
+    # Nothing is read until the accounts are first needed
+    watcher = AccountsWatcher(str(tmp_path / "missing.json"), use_inotify=False)
+    with pytest.raises(FileError):
+        watcher.snapshot
+
+@pytest.mark.parametrize("accounts", [
+    [],
+    {"1111": "free"},
+    {"1111": {"daily_limit": 5}},
+    {"1111": {"rate_limit": 0}},
+    {"1111": {"rate_limit": True}},
+    {"1111": {"rate_limit": 1, "daily_limit": -1}},
+    {"1111": {"rate_limit": 1, "rate_limit_mode": "loose"}},
+    {"1111": {"rate_limit": 1, "rate_limit_algorithm": "token_bucket"}},
+    {"1111": {"rate_limit": 1, "rate_limit_mode": "approximate", "rate_limit_algorithm": "gcra"}},
+])
+def test_validate_rejects_invalid_accounts(accounts):
+    with pytest.raises(AccountsError):
+        validate_accounts(accounts)
+
+@pytest.mark.asyncio
+async def test_unchanged_file_is_not_reread(accounts_path):
+    """Test that the file is only parsed when its signature changes"""
+    file_helper = Mock()
+    file_helper.read_json_file.return_value = ACCOUNTS
+    watcher = AccountsWatcher(accounts_path, file_helper=file_helper, use_inotify=False)
+    assert watcher.snapshot == ACCOUNTS
+
+    assert await watcher.reload_if_changed() is False
+    file_helper.read_json_file.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_changed_file_swaps_snapshot(accounts_path):
+    watcher = AccountsWatcher(accounts_path, use_inotify=False)
+    previous = watcher.snapshot
+    updated = dict(ACCOUNTS, **{"2222-3333-4444": {"plan": "pro", "rate_limit": 10, "daily_limit": 12000}})
+    write_accounts(accounts_path, updated, mtime_ns=2_000_000_000)
+
+    assert await watcher.reload_if_changed() is True
+    assert watcher.snapshot == updated
+    assert previous == ACCOUNTS
+    assert watcher.reloads == 1
+
+@pytest.mark.asyncio
+async def test_replaced_file_is_reloaded(accounts_path, tmp_path):
+    """Test that a file renamed over the original (new inode) is picked up"""
+    watcher = AccountsWatcher(accounts_path, use_inotify=False)
+    replacement = str(tmp_path / "accounts.json.tmp")
+    write_accounts(replacement, {}, mtime_ns=1_000_000_000)
+    os.replace(replacement, accounts_path)
+
+    assert await watcher.reload_if_changed() is True
+    assert watcher.snapshot == {}
+
+@pytest.mark.asyncio
+async def test_invalid_file_keeps_previous_snapshot(accounts_path):
+    watcher = AccountsWatcher(accounts_path, use_inotify=False)
+    assert watcher.snapshot == ACCOUNTS
+    with open(accounts_path, 'w') as f:
+        f.write("{not json")
+
+    assert await watcher.reload_if_changed() is False
+    assert watcher.snapshot == ACCOUNTS
+    assert watcher.reload_errors == 1
+    # The broken file is not parsed again until it changes
+    assert await watcher.reload_if_changed() is False
+    assert watcher.reload_errors == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_inotify", [False, True])
+async def test_watch_loop_reloads(accounts_path, use_inotify):
+    """Test that the background watcher picks up a change, with and without inotify"""
+    watcher = AccountsWatcher(accounts_path, poll_interval=0.01, use_inotify=use_inotify)
+    watcher.start()
+    try:
+        write_accounts(accounts_path, {}, mtime_ns=2_000_000_000)
+        for _ in range(200):
+            if watcher.reloads:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await watcher.close()
+
+    assert watcher.snapshot == {}
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import pytest
+from admission import AdmissionControl, AdmissionController, AIMDLimit
+
+class BlockingApp:
+    """App holding every request until `release` is set"""
+    def __init__(self, status: int = 200):
+        self.status = status
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        await self.release.wait()
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+
+def http_scope(path: str = '/joke') -> dict:
+    return {'type': 'http', 'method': 'GET', 'path': path, 'headers': []}
+
+async def call(middleware, scope):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    return messages
+
+def test_limit_validation():
+    with pytest.raises(ValueError):
+        AIMDLimit(initial=5, min_limit=10, max_limit=100)
+
+def test_limit_increases_while_in_use():
+    limit = AIMDLimit(initial=10, min_limit=1, max_limit=11, target_latency=0.1)
+    limit.on_sample(0.01, in_flight=2)
+    assert limit.limit == 10  # Mostly idle: no evidence the limit is too low
+    for _ in range(10):
+        limit.on_sample(0.01, in_flight=10)
+    assert limit.capacity == 10 and limit.limit > 10.9
+    for _ in range(10):
+        limit.on_sample(0.01, in_flight=11)
+    assert limit.limit == 11
+
+def test_limit_backs_off_once_per_target_latency():
+    limit = AIMDLimit(initial=100, min_limit=10, max_limit=100, target_latency=10.0, backoff=0.5)
+    limit.on_sample(20.0, in_flight=100)
+    limit.on_sample(20.0, in_flight=100, failed=True)
+    assert limit.limit == 50
+
+def test_limit_backs_off_on_failures_down_to_min():
+    limit = AIMDLimit(initial=20, min_limit=10, max_limit=100, target_latency=0.0, backoff=0.5)
+    for _ in range(3):
+        limit.on_sample(0.0, in_flight=1, failed=True)
+    assert limit.limit == 10
+
+@pytest.mark.asyncio
+async def test_released_slot_goes_to_oldest_waiter():
+    controller = AdmissionController(AIMDLimit(1, 1, 1, target_latency=1.0), queue_size=2, queue_timeout=1.0)
+    assert await controller.acquire()
+    first = asyncio.create_task(controller.acquire())
+    second = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.stats()['queued'] == 2
+
+    controller.release(0.01)
+    assert await first
+    assert not second.done()
+    assert controller.in_flight == 1
+    controller.release(0.01)
+    assert await second
+    assert controller.stats() == {
+        'limit': 1.0, 'in_flight': 1, 'queued': 0, 'admitted': 3, 'shed': 0, 'timeouts': 0
+    }
+
+@pytest.mark.asyncio
+async def test_sheds_when_queue_full():
+    controller = AdmissionController(AIMDLimit(1, 1, 1), queue_size=0)
+    assert await controller.acquire()
+    assert not await controller.acquire()
+    assert controller.shed == 1
+
+@pytest.mark.asyncio
+async def test_sheds_after_queue_timeout():
+    controller = AdmissionController(AIMDLimit(1, 1, 1), queue_size=1, queue_timeout=0.01)
+    assert await controller.acquire()
+    assert not await controller.acquire()
+    assert controller.stats()['queued'] == 0
+    assert controller.timeouts == 1 and controller.shed == 1
+    # The abandoned waiter does not swallow the next free slot
+    controller.release(0.01)
+    assert controller.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    controller = AdmissionController(AIMDLimit(1, 1, 1), queue_size=1, queue_timeout=1.0)
+    assert await controller.acquire()
+    waiter = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()  # The client goes away while queued
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert controller.stats()['queued'] == 0
+    controller.release(0.01)
+    assert controller.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_middleware_sheds_with_503_before_the_app():
+    app = BlockingApp()
+    controller = AdmissionController(AIMDLimit(1, 1, 1), queue_size=0)
+    middleware = AdmissionControl(app, controller=controller, retry_after=3)
+
+    admitted = asyncio.create_task(call(middleware, http_scope()))
+    await asyncio.sleep(0)
+    messages = await call(middleware, http_scope())
+    assert messages[0]['status'] == 503
+    assert (b'retry-after', b'3') in messages[0]['headers']
+    assert json.loads(messages[1]['body']) == {'error': 'Server overloaded, retry later!'}
+    assert app.calls == 1
+
+    app.release.set()
+    messages = await admitted
+    assert messages[0]['status'] == 200
+    assert controller.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_middleware_never_sheds_public_paths():
+    app = BlockingApp()
+    app.release.set()
+    controller = AdmissionController(AIMDLimit(1, 1, 1), queue_size=0)
+    assert await controller.acquire()
+    middleware = AdmissionControl(app, controller=controller, public_paths=('/metrics',))
+    messages = await call(middleware, http_scope('/metrics'))
+    assert messages[0]['status'] == 200
+
+@pytest.mark.asyncio
+async def test_middleware_backs_off_on_latency_not_status():
+    app = BlockingApp(status=503)
+    app.release.set()
+    controller = AdmissionController(AIMDLimit(10, 1, 10, target_latency=10.0, backoff=0.5), queue_size=0)
+    middleware = AdmissionControl(app, controller=controller)
+    await call(middleware, http_scope())
+    assert controller.limit.limit == 10
+
+    slow = AdmissionController(AIMDLimit(10, 1, 10, target_latency=0.0, backoff=0.5), queue_size=0)
+    await call(AdmissionControl(app, controller=slow), http_scope())
+    assert slow.limit.limit == 5
+
+    async def failing_app(scope, receive, send):
+        raise RuntimeError("boom")
+    middleware = AdmissionControl(failing_app, controller=controller)
+    with pytest.raises(RuntimeError):
+        await call(middleware, http_scope())
+    assert controller.in_flight == 0
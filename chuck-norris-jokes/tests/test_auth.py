@@ -0,0 +1,210 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from auth import Auth
+from bulk_jokes import request_cost
+from helpers.bloom_filter import BloomFilter
+from memory_rate_limiter import MemoryRateLimiter
+from rate_limit_algorithms import ALGORITHMS
+from token_filter import TokenFilter
+
+ACCOUNTS = {
+    "1111-2222-3333": {"plan": "free", "rate_limit": 1, "daily_limit": 50},
+    "3333-4444-5555": {"plan": "enterprise", "rate_limit": 100, "daily_limit": None,
+                       "rate_limit_mode": "approximate"}
+}
+
+class RecordingApp:
+    def __init__(self):
+        self.scopes = []
+
+    async def __call__(self, scope, receive, send):
+        self.scopes.append(scope)
+        if scope['type'] == 'http':
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+
+def http_scope(token: str = None) -> dict:
+    headers = [(b'host', b'testserver')]
+    if token is not None:
+        headers.append((b'authorization', token.encode('latin-1')))
+    return {'type': 'http', 'method': 'GET', 'path': '/joke', 'headers': headers}
+
+async def call(middleware, scope):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    status = messages[0].get('status')
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return status, body
+
+@pytest.fixture
+def app():
+    return RecordingApp()
+
+@pytest.fixture
+def middleware(app):
+    accounts = Mock()
+    accounts.snapshot = ACCOUNTS
+    accounts.token_filter = TokenFilter(negative_cache_size=10)
+    return Auth(app, accounts=accounts)
+
+@pytest.fixture
+def limiters():
+    with patch('auth.rate_limiter') as exact, patch('auth.hybrid_rate_limiter') as approximate:
+        exact.is_allowed = AsyncMock(return_value=True)
+        approximate.is_allowed = AsyncMock(return_value=True)
+        yield exact, approximate
+
+@pytest.mark.asyncio
+async def test_missing_token(middleware, app, limiters):
+    status, body = await call(middleware, http_scope())
+
+    assert status == 403
+    assert json.loads(body) == {'error': 'Invalid token format!'}
+    assert app.scopes == []
+
+@pytest.mark.asyncio
+async def test_invalid_token_format(middleware, limiters):
+    status, body = await call(middleware, http_scope("invalid-token"))
+
+    assert status == 403
+    assert json.loads(body) == {'error': 'Invalid token format!'}
+
+@pytest.mark.asyncio
+async def test_unknown_token(middleware, limiters):
+    exact, _ = limiters
+
+    status, body = await call(middleware, http_scope("9999-9999-9999"))
+
+    assert status == 403
+    assert json.loads(body) == {'error': 'Invalid token!'}
+    exact.is_allowed.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_unknown_token_is_cached(middleware, limiters):
+    """Test that a repeated unknown token is rejected from the negative cache"""
+    await call(middleware, http_scope("9999-9999-9999"))
+    middleware.accounts.snapshot = Mock(wraps=ACCOUNTS)
+
+    status, body = await call(middleware, http_scope("9999-9999-9999"))
+
+    assert status == 403
+    assert json.loads(body) == {'error': 'Invalid token!'}
+    middleware.accounts.snapshot.get.assert_not_called()
+    assert middleware.accounts.token_filter.negative_cache_hits == 1
+
+@pytest.mark.asyncio
+async def test_bloom_filter_sheds_unknown_token(middleware, limiters):
+    token_filter = middleware.accounts.token_filter
+    token_filter.reset(BloomFilter.from_keys(ACCOUNTS, len(ACCOUNTS)))
+    middleware.accounts.snapshot = Mock(wraps=ACCOUNTS)
+
+    status, _ = await call(middleware, http_scope("9999-9999-9999"))
+
+    assert status == 403
+    middleware.accounts.snapshot.get.assert_not_called()
+    assert token_filter.bloom_rejections == 1
+
+@pytest.mark.asyncio
+async def test_rate_limited(middleware, app, limiters):
+    exact, _ = limiters
+    exact.is_allowed.return_value = False
+
+    status, body = await call(middleware, http_scope("1111-2222-3333"))
+
+    assert status == 429
+    assert json.loads(body) == {'error': 'Rate limit exceeded!'}
+    assert app.scopes == []
+
+@pytest.mark.asyncio
+async def test_authorised_request_reaches_app_with_account(middleware, app, limiters):
+    exact, _ = limiters
+
+    status, body = await call(middleware, http_scope("1111-2222-3333"))
+
+    assert (status, body) == (200, b'ok')
+    assert app.scopes[0]['state']['account'] is ACCOUNTS["1111-2222-3333"]
+    exact.is_allowed.assert_awaited_once_with("1111-2222-3333", 1, 50, "fixed_window", 1)
+
+@pytest.mark.asyncio
+async def test_approximate_account_uses_hybrid_limiter(middleware, limiters):
+    exact, approximate = limiters
+
+    await call(middleware, http_scope("3333-4444-5555"))
+
+    approximate.is_allowed.assert_awaited_once()
+    exact.is_allowed.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_uses_current_snapshot(middleware, limiters):
+    """Test that a reloaded snapshot applies to the next request"""
+    middleware.accounts.snapshot = {}
+
+    status, _ = await call(middleware, http_scope("1111-2222-3333"))
+
+    assert status == 403
+
+@pytest.mark.asyncio
+async def test_non_http_scope_passes_through(middleware, app, limiters):
+    scope = {'type': 'lifespan'}
+
+    await middleware(scope, AsyncMock(), AsyncMock())
+
+    assert app.scopes == [scope]
+
+@pytest.mark.asyncio
+async def test_public_paths_skip_authentication(app, limiters):
+    accounts = Mock()
+    accounts.snapshot = ACCOUNTS
+    accounts.token_filter = TokenFilter(negative_cache_size=10)
+    middleware = Auth(app, accounts=accounts, public_paths=('/metrics',))
+    scope = http_scope()
+    scope['path'] = '/metrics'
+
+    status, _ = await call(middleware, scope)
+
+    assert status == 200
+    assert (await call(middleware, http_scope()))[0] == 403
+    limiters[0].is_allowed.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_request_cost_charged(app, limiters):
+    accounts = Mock()
+    accounts.snapshot = ACCOUNTS
+    accounts.token_filter = TokenFilter(negative_cache_size=10)
+    middleware = Auth(app, accounts=accounts, request_cost=request_cost)
+    scope = http_scope("3333-4444-5555")
+    scope.update(path='/jokes', query_string=b'count=7')
+
+    status, _ = await call(middleware, scope)
+
+    assert status == 200
+    limiters[1].is_allowed.assert_awaited_once_with("3333-4444-5555", 100, None, "fixed_window", 7)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+async def test_cost_over_rate_limit_rejected_for_every_algorithm(app, algorithm):
+    accounts = Mock()
+    accounts.snapshot = {"1111-2222-3333": {"plan": "free", "rate_limit": 2, "daily_limit": 50,
+                                            "rate_limit_algorithm": algorithm}}
+    accounts.token_filter = TokenFilter(negative_cache_size=10)
+    middleware = Auth(app, accounts=accounts, request_cost=request_cost)
+
+    def bulk_scope(count: int) -> dict:
+        scope = http_scope("1111-2222-3333")
+        scope.update(path='/jokes', query_string=f'count={count}'.encode())
+        return scope
+
+    with patch('auth.rate_limiter', MemoryRateLimiter()):
+        status, body = await call(middleware, bulk_scope(3))
+        assert status == 422
+        assert json.loads(body) == {'error': 'Request costs 3 requests, over the rate limit of 2 per second!'}
+        # Nothing was charged, so a request within the limit still fits
+        assert (await call(middleware, bulk_scope(2)))[0] == 200
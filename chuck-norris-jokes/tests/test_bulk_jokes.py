@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from bulk_jokes import request_cost, stream_jokes
+from joke import Joke
+from upstream_client import UpstreamError
+
+class FakeSource:
+    def __init__(self, fail_on: int = None):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+        self.fail_on = fail_on
+
+    async def fetch_joke(self) -> Joke:
+        self.calls += 1
+        call = self.calls
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Later calls finish first, a few loop iterations apart so the consumer sees each one alone
+            for _ in range(5 * (10 - call % 10)):
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        if call == self.fail_on:
+            raise UpstreamError("upstream down")
+        return Joke(str(call), [], "2020-01-05 13:42:25.352697", f"joke {call}")
+
+def scope(path: str, query: bytes = b'') -> dict:
+    return {'type': 'http', 'path': path, 'query_string': query}
+
+@pytest.mark.parametrize('path, query, cost', [
+    ('/joke', b'count=5', 1),
+    ('/jokes', b'count=5', 5),
+    ('/jokes', b'category=dev&count=12', 12),
+    ('/jokes', b'count=1000', 100),
+    ('/jokes', b'count=0', 1),
+    ('/jokes', b'count=lots', 1),
+    ('/jokes', b'', 1),
+])
+def test_request_cost(path, query, cost):
+    assert request_cost(scope(path, query), max_count=100) == cost
+
+@pytest.mark.asyncio
+async def test_streams_all_jokes_with_bounded_concurrency():
+    source = FakeSource()
+
+    jokes = [joke async for joke in stream_jokes(source.fetch_joke, 20, concurrency=4)]
+
+    assert sorted(int(joke.id) for joke in jokes) == list(range(1, 21))
+    assert source.calls == 20
+    assert source.max_in_flight == 4
+
+@pytest.mark.asyncio
+async def test_yields_in_completion_order():
+    source = FakeSource()
+
+    jokes = [joke.id async for joke in stream_jokes(source.fetch_joke, 3, concurrency=3)]
+
+    assert jokes == ['3', '2', '1']
+
+@pytest.mark.asyncio
+async def test_failure_cancels_fetches_in_flight():
+    source = FakeSource(fail_on=4)
+
+    with pytest.raises(UpstreamError):
+        async for _ in stream_jokes(source.fetch_joke, 10, concurrency=4):
+            pass
+
+    await asyncio.sleep(0)
+    assert source.cancelled == 3
+    assert source.calls == 4
+
+@pytest.mark.asyncio
+async def test_closing_early_cancels_fetches_in_flight():
+    source = FakeSource()
+    jokes = stream_jokes(source.fetch_joke, 10, concurrency=4)
+
+    await jokes.__anext__()
+    await jokes.aclose()
+
+    await asyncio.sleep(0)
+    assert source.in_flight == 0
+    assert source.calls == 4
@@ -0,0 +1,182 @@
+import asyncio
+import pytest
+from category_pool import CategoryIndex, CategoryJokePools
+from joke import Joke, UnknownCategoryError
+from upstream_client import UpstreamError
+
+CATEGORIES = ("dev", "food", "sport")
+
+def make_joke(joke_id: str, *categories: str) -> Joke:
+    return Joke(joke_id, list(categories), "2020-01-05 13:42:25.352697", f"joke {joke_id}")
+
+class FakeUpstream:
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    async def fetch_joke(self, category: str) -> Joke:
+        self.calls.append(category)
+        await asyncio.sleep(0)
+        if category not in CATEGORIES:
+            raise UnknownCategoryError(category)
+        if self.fail:
+            raise UpstreamError("upstream down")
+        return make_joke(f"{category}-{len(self.calls)}", category)
+
+async def wait_for(condition) -> None:
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.001)
+    raise AssertionError("Condition not reached")
+
+def test_index_serves_by_category():
+    index = CategoryIndex(size=10)
+    index.add(make_joke("1", "dev", "science"))
+    index.add(make_joke("2", "food"))
+    index.add(make_joke("3"))
+
+    assert len(index) == 2
+    assert index.random_joke("science").id == "1"
+    assert index.random_joke("food").id == "2"
+    assert index.random_joke("music") is None
+    assert index.categories() == ["dev", "food", "science"]
+
+def test_index_evicts_oldest():
+    index = CategoryIndex(size=2)
+    for joke_id in ("1", "2", "3"):
+        index.add(make_joke(joke_id, "dev"))
+    index.add(make_joke("4", "food"))
+
+    assert len(index) == 2
+    assert {index.random_joke("dev").id for _ in range(50)} == {"3"}
+    assert index.random_joke("food").id == "4"
+
+@pytest.mark.asyncio
+async def test_refills_with_refill_fetch_joke():
+    """Test that buffers are refilled through `refill_fetch_joke`, misses through `fetch_joke`"""
+    upstream, refill_upstream = FakeUpstream(), FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=4, rebalance_interval=60,
+                              refill_fetch_joke=refill_upstream.fetch_joke)
+    pools.start()
+
+    await pools.fetch_joke("dev")
+    await wait_for(lambda: pools.stats()['buffered'] == 4)
+    await pools.close()
+
+    assert upstream.calls == ["dev"]
+    assert refill_upstream.calls == ["dev"] * 4
+
+@pytest.mark.asyncio
+async def test_first_request_fetches_then_buffers():
+    """Test that a new category is fetched once and then served from its buffer"""
+    upstream = FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=8, rebalance_interval=60)
+    pools.start()
+
+    joke = await pools.fetch_joke("dev")
+    await wait_for(lambda: pools.stats()['buffered'] == 8)
+    calls = len(upstream.calls)
+    served = [await pools.fetch_joke("dev") for _ in range(4)]
+    await pools.close()
+
+    assert joke.categories == ["dev"]
+    assert pools.targets() == {"dev": 8}
+    assert all(joke.categories == ["dev"] for joke in served)
+    assert len(upstream.calls) == calls
+    assert pools.hits == 4
+    assert pools.misses == 1
+
+@pytest.mark.asyncio
+async def test_empty_buffer_served_from_index():
+    """Test that indexed jokes serve a category without an upstream call"""
+    upstream = FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=0)
+    random_source = pools.indexing(lambda: asyncio.sleep(0, result=make_joke("r1", "food")))
+
+    await random_source()
+    joke = await pools.fetch_joke("food")
+
+    assert joke.id == "r1"
+    assert upstream.calls == []
+    assert pools.index_hits == 1
+
+@pytest.mark.asyncio
+async def test_capacity_split_follows_demand():
+    upstream = FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=10, index=CategoryIndex(size=0))
+    await pools.fetch_joke("dev")
+    await pools.fetch_joke("food")
+    for _ in range(7):
+        await pools.fetch_joke("dev")
+    for _ in range(1):
+        await pools.fetch_joke("food")
+
+    pools._rebalance()
+
+    targets = pools.targets()
+    assert sum(targets.values()) == 10
+    assert targets["dev"] == 8
+    assert targets["food"] == 2
+
+@pytest.mark.asyncio
+async def test_unknown_category():
+    upstream = FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=10)
+
+    with pytest.raises(UnknownCategoryError):
+        await pools.fetch_joke("nope")
+    with pytest.raises(UnknownCategoryError):
+        await pools.fetch_joke("nope")
+    with pytest.raises(UnknownCategoryError):
+        await pools.fetch_joke("../etc")
+
+    assert upstream.calls == ["nope"]
+    assert pools.targets() == {}
+
+@pytest.mark.asyncio
+async def test_upstream_error_propagates_on_miss():
+    upstream = FakeUpstream()
+    upstream.fail = True
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=10)
+
+    with pytest.raises(UpstreamError):
+        await pools.fetch_joke("dev")
+    assert pools.targets() == {}
+
+@pytest.mark.asyncio
+async def test_failing_category_does_not_block_others():
+    """Test that categories are refilled independently of one failing upstream"""
+    upstream = FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=8, rebalance_interval=60, retry_delay=60)
+    await pools.fetch_joke("dev")
+    await pools.fetch_joke("food")
+
+    async def refill_fetch_joke(category: str) -> Joke:
+        if category == "dev":
+            raise UpstreamError("upstream down")
+        return await upstream.fetch_joke(category)
+    pools._refill_fetch_joke = refill_fetch_joke
+
+    with pytest.raises(UpstreamError):
+        await pools._refill()
+
+    assert len(pools._categories["food"].jokes) == pools.targets()["food"] == 4
+    assert not pools._categories["dev"].jokes
+
+@pytest.mark.asyncio
+async def test_category_gone_upstream_is_not_served_from_index():
+    """Test that a category 404ing on refill is dropped and stays unknown despite indexed jokes"""
+    upstream = FakeUpstream()
+    pools = CategoryJokePools(upstream.fetch_joke, capacity=4, rebalance_interval=60)
+    await pools.fetch_joke("dev")
+
+    async def refill_fetch_joke(category: str) -> Joke:
+        raise UnknownCategoryError(category)
+    pools._refill_fetch_joke = refill_fetch_joke
+    await pools._refill()
+
+    assert pools.targets() == {}
+    with pytest.raises(UnknownCategoryError):
+        await pools.fetch_joke("dev")
+    assert pools.index_hits == 0
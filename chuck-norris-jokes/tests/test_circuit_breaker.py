@@ -0,0 +1,80 @@
+import pytest
+from helpers.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+
+def test_starts_closed(breaker):
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() is True
+
+def test_opens_after_consecutive_failures(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.allow_request() is False
+    assert breaker.rejected == 1
+
+def test_success_resets_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
+
+def test_half_open_after_reset_timeout(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is True
+    # Only one probe at a time
+    assert breaker.allow_request() is False
+
+def test_probe_success_closes(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.allow_request()
+
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() is True
+
+def test_probe_failure_reopens(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    clock.now = 15
+    assert breaker.allow_request() is False
+
+def test_lost_probe_expires(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.allow_request()  # Probe never reports back
+
+    clock.now = 20
+
+    assert breaker.allow_request() is True
@@ -0,0 +1,50 @@
+import pytest
+from helpers.consistent_hash import ConsistentHashRing
+
+TOKENS = [f"{i:04d}-{i * 7 % 10000:04d}" for i in range(5000)]
+
+def test_empty_ring():
+    with pytest.raises(LookupError):
+        ConsistentHashRing().node_for("1111-2222-3333")
+
+def test_same_nodes_map_keys_the_same_way():
+    """Test that rings built separately (e.g. in other workers) agree"""
+    first = ConsistentHashRing(["redis-a:6379", "redis-b:6379", "redis-c:6379"])
+    second = ConsistentHashRing(["redis-c:6379", "redis-a:6379", "redis-b:6379"])
+
+    assert all(first.node_for(token) == second.node_for(token) for token in TOKENS)
+
+def test_keys_spread_evenly():
+    ring = ConsistentHashRing(["redis-a:6379", "redis-b:6379", "redis-c:6379", "redis-d:6379"])
+
+    counts = {}
+    for token in TOKENS:
+        node = ring.node_for(token)
+        counts[node] = counts.get(node, 0) + 1
+
+    assert len(counts) == 4
+    assert all(abs(count - len(TOKENS) / 4) < len(TOKENS) / 4 * 0.25 for count in counts.values())
+
+def test_adding_a_node_moves_only_its_share():
+    """Test that a new node only takes keys, about 1/N of them"""
+    ring = ConsistentHashRing(["redis-a:6379", "redis-b:6379", "redis-c:6379"])
+    before = {token: ring.node_for(token) for token in TOKENS}
+
+    ring.add("redis-d:6379")
+
+    moved = [token for token in TOKENS if ring.node_for(token) != before[token]]
+    assert all(ring.node_for(token) == "redis-d:6379" for token in moved)
+    assert 0.15 < len(moved) / len(TOKENS) < 0.35
+
+def test_removing_a_node_moves_only_its_keys():
+    ring = ConsistentHashRing(["redis-a:6379", "redis-b:6379", "redis-c:6379"])
+    before = {token: ring.node_for(token) for token in TOKENS}
+
+    ring.remove("redis-b:6379")
+
+    assert all(ring.node_for(token) == node for token, node in before.items() if node != "redis-b:6379")
+    assert len(ring) == 2
+
+def test_duplicate_node():
+    with pytest.raises(ValueError):
+        ConsistentHashRing(["redis-a:6379", "redis-a:6379"])
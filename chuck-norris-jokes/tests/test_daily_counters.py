@@ -0,0 +1,201 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from redis import ConnectionError
+from daily_counters import DailyCounters
+from helpers.circuit_breaker import CircuitBreaker
+from rate_limit_algorithms import SECONDS_IN_DAY, SYNC_COUNTERS_SCRIPT
+
+KEY = "daily:test-token:900"
+
+class TestDailyCounters:
+    @pytest.fixture
+    def script(self):
+        return AsyncMock()
+
+    @pytest.fixture
+    def redis_mock(self, script):
+        redis = AsyncMock()
+        redis.get.return_value = None
+        redis.register_script = Mock(return_value=script)
+        return redis
+
+    @pytest.fixture
+    def counters(self, redis_mock):
+        with patch('daily_counters.get_async_redis', return_value=redis_mock):
+            yield DailyCounters(breaker=CircuitBreaker())
+
+    @pytest.mark.asyncio
+    async def test_charges_locally_after_first_read(self, counters, redis_mock):
+        """Test that only the first charge of a counter reads Redis"""
+        redis_mock.get.return_value = b"3"
+
+        results = [await counters.charge(KEY, limit=5) for _ in range(3)]
+
+        assert results == [True, True, False]
+        redis_mock.get.assert_awaited_once_with(KEY)
+        assert counters.stats()['pending'] == 2
+
+    @pytest.mark.asyncio
+    async def test_charge_amount(self, counters):
+        assert await counters.charge(KEY, limit=5, amount=4) is True
+        assert await counters.charge(KEY, limit=5, amount=2) is False
+        assert await counters.charge(KEY, limit=5, amount=1) is True
+
+    def test_init_registers_script(self, counters, redis_mock):
+        redis_mock.register_script.assert_called_once_with(SYNC_COUNTERS_SCRIPT)
+
+    @pytest.mark.asyncio
+    async def test_flush_pushes_pending_increments(self, counters, script, redis_mock):
+        """Test that pending increments are pushed in one script call and refresh the total"""
+        other = "daily:other-token:900"
+        await counters.charge(KEY, limit=100)
+        await counters.charge(KEY, limit=100)
+        await counters.charge(other, limit=100)
+        totals = {KEY: 40, other: 7}
+        # Replies follow the order of the keys
+        script.side_effect = lambda keys, args, client: [totals[key] for key in keys]
+
+        assert await counters.flush() is True
+
+        script.assert_awaited_once()
+        keys, args = script.await_args.kwargs['keys'], script.await_args.kwargs['args']
+        # Increments, then the TTL each counter gets only when its increment creates it
+        assert dict(zip(keys, args)) == {KEY: 2, other: 1}
+        assert args[len(keys):] == [SECONDS_IN_DAY] * 2
+        assert script.await_args.kwargs['client'] is redis_mock
+        assert counters._counts[KEY].count == 40
+        assert counters.stats()['pending'] == 0
+        assert counters.flushes == 1
+
+    @pytest.mark.asyncio
+    async def test_flush_per_node(self, counters, script, redis_mock):
+        """Test that counters kept on another node are flushed with one script call on that node"""
+        node = AsyncMock()
+        node.get.return_value = None
+        await counters.charge(KEY, limit=100)
+        await counters.charge("daily:other-token:900", limit=100, client=node)
+        script.return_value = [1]
+
+        assert await counters.flush() is True
+
+        script.assert_any_await(keys=[KEY], args=[1, SECONDS_IN_DAY], client=redis_mock)
+        script.assert_any_await(keys=["daily:other-token:900"], args=[1, SECONDS_IN_DAY], client=node)
+        assert script.await_count == 2
+        node.get.assert_awaited_once_with("daily:other-token:900")
+
+    @pytest.mark.asyncio
+    async def test_open_node_breaker_skips_only_that_node(self, counters, script, redis_mock):
+        """Test that a node whose breaker is open keeps its increments while the others flush"""
+        node = AsyncMock()
+        node.get.return_value = None
+        breaker = CircuitBreaker(failure_threshold=1)
+        await counters.charge(KEY, limit=100)
+        await counters.charge("daily:other-token:900", limit=100, client=node, breaker=breaker)
+        breaker.record_failure()
+        script.return_value = [1]
+
+        assert await counters.flush() is False
+
+        script.assert_awaited_once_with(keys=[KEY], args=[1, SECONDS_IN_DAY], client=redis_mock)
+        assert counters._counts["daily:other-token:900"].pending == 1
+        assert counters._dirty == {"daily:other-token:900"}
+
+    @pytest.mark.asyncio
+    async def test_flush_failure_keeps_pending(self, counters, script):
+        await counters.charge(KEY, limit=100)
+        script.side_effect = ConnectionError("down")
+
+        assert await counters.flush() is False
+
+        assert counters.stats()['pending'] == 1
+        assert counters.flush_errors == 1
+
+    @pytest.mark.asyncio
+    async def test_flush_without_counters_skips_redis(self, counters, script):
+        assert await counters.flush() is True
+        script.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_read_failure_counts_from_zero(self, counters, redis_mock):
+        redis_mock.get.side_effect = ConnectionError("down")
+
+        assert await counters.charge(KEY, limit=1) is True
+        assert await counters.charge(KEY, limit=1) is False
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_pending(self, counters, script, redis_mock):
+        """Test that pending increments are pushed on shutdown"""
+        counters.start()
+        await counters.charge(KEY, limit=100)
+        script.return_value = [1]
+
+        await counters.close()
+
+        script.assert_awaited_once_with(keys=[KEY], args=[1, SECONDS_IN_DAY], client=redis_mock)
+        assert counters.stats()['pending'] == 0
+
+    @pytest.mark.asyncio
+    async def test_close_waits_for_running_flush(self, counters, script, redis_mock):
+        """Test that a shutdown during a flush neither loses nor repeats its increments"""
+        counters._flush_interval = 0.001
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_script(keys, args, client):
+            started.set()
+            await release.wait()
+            return [5]
+        script.side_effect = slow_script
+        await counters.charge(KEY, limit=100, amount=5)
+        counters.start()
+        await started.wait()
+
+        closing = asyncio.create_task(counters.close())
+        await asyncio.sleep(0.01)
+        release.set()
+        await closing
+
+        script.assert_awaited_once_with(keys=[KEY], args=[5, SECONDS_IN_DAY], client=redis_mock)
+        assert counters._counts[KEY].count == 5
+        assert counters.stats()['pending'] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_flush_keeps_increments(self, counters, script, redis_mock):
+        """Test that increments of a cancelled flush are pushed by the next one"""
+        started = asyncio.Event()
+
+        async def hanging_script(keys, args, client):
+            started.set()
+            await asyncio.Event().wait()
+        script.side_effect = hanging_script
+        await counters.charge(KEY, limit=100, amount=5)
+        flush = asyncio.create_task(counters.flush())
+        await started.wait()
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        assert counters.stats()['pending'] == 5
+
+        script.side_effect = None
+        script.return_value = [5]
+        await counters.close()
+
+        script.assert_awaited_with(keys=[KEY], args=[5, SECONDS_IN_DAY], client=redis_mock)
+        assert counters._counts[KEY].count == 5
+        assert counters.stats()['pending'] == 0
+
+    @pytest.mark.asyncio
+    async def test_prunes_idle_counters_oldest_first(self, counters, script):
+        counters._idle_timeout = 0
+        other = "daily:other-token:900"
+        await counters.charge(KEY, limit=100)
+        await counters.charge(other, limit=100)
+        script.return_value = [1, 1]
+        # Both pending: nothing can go yet
+        counters._prune_idle()
+        assert counters.stats()['counters'] == 2
+
+        await counters.flush()
+        counters._prune_idle()
+        assert counters.stats()['counters'] == 0
@@ -0,0 +1,229 @@
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from redis import ConnectionError
+from helpers.circuit_breaker import CircuitBreaker
+from hybrid_rate_limiter import HybridRateLimiter, SYNC_COUNTERS_SCRIPT
+from rate_limiter import SECONDS_IN_DAY
+from redis_connection import RedisShards
+
+class TestHybridRateLimiter:
+    @pytest.fixture(autouse=True)
+    def frozen_time(self):
+        with patch('hybrid_rate_limiter.get_current_timestamp', return_value=1000), \
+             patch('hybrid_rate_limiter.get_start_of_day_timestamp', return_value=900):
+            yield
+
+    @pytest.fixture
+    def script(self):
+        return AsyncMock()
+
+    @pytest.fixture
+    def redis_mock(self, script):
+        redis = AsyncMock()
+        redis.register_script = Mock(return_value=script)
+        return redis
+
+    @pytest.fixture
+    def limiter(self, redis_mock):
+        with patch('hybrid_rate_limiter.get_async_redis', return_value=redis_mock):
+            yield HybridRateLimiter(sync_requests=5, local_share=0.5, breaker=CircuitBreaker())
+
+    def test_init_registers_script(self, limiter, redis_mock):
+        redis_mock.register_script.assert_called_once_with(SYNC_COUNTERS_SCRIPT)
+
+    def test_batch_size(self, limiter):
+        assert limiter._batch_size(rate_limit=1) == 1
+        assert limiter._batch_size(rate_limit=4) == 2
+        assert limiter._batch_size(rate_limit=100) == 5
+
+    @pytest.mark.asyncio
+    async def test_decides_locally_below_batch(self, limiter, script):
+        """Test that admissions below the batch size never call Redis"""
+        for _ in range(5):
+            assert await limiter.is_allowed("test-token", rate_limit=100) is True
+
+        script.assert_not_awaited()
+        assert limiter.local_decisions == 5
+
+    @pytest.mark.asyncio
+    async def test_syncs_inline_after_batch(self, limiter, script, redis_mock):
+        """Test that a full batch of unsynced admissions is synced before the next decision"""
+        script.return_value = [5]
+        for _ in range(6):
+            await limiter.is_allowed("test-token", rate_limit=100)
+
+        script.assert_awaited_once_with(keys=["rate:test-token:1000"], args=[5, 1], client=redis_mock)
+
+    @pytest.mark.asyncio
+    async def test_enforces_local_limit(self, limiter, script):
+        """Test that the limit is enforced on local state alone"""
+        results = [await limiter.is_allowed("test-token", rate_limit=2) for _ in range(3)]
+
+        assert results == [True, True, False]
+
+    @pytest.mark.asyncio
+    async def test_cost_charges_several_requests(self, limiter, script):
+        """Test that a bulk request is admitted only when all of its cost fits"""
+        assert await limiter.is_allowed("test-token", rate_limit=5, daily_limit=50, cost=3) is True
+        assert await limiter.is_allowed("test-token", rate_limit=5, daily_limit=50, cost=3) is False
+        assert await limiter.is_allowed("test-token", rate_limit=5, daily_limit=50, cost=2) is True
+
+        state = limiter._states["test-token"]
+        assert (state.rate_pending, state.daily_pending) == (5, 5)
+
+    @pytest.mark.asyncio
+    async def test_cost_never_exceeds_batch_unsynced(self, limiter, script):
+        """Test that a costly admission syncs instead of piling past the batch size"""
+        script.side_effect = lambda keys, args, client: args[:len(keys)]
+        # rate_limit 100: batch of 5
+        assert await limiter.is_allowed("test-token", rate_limit=100, cost=4) is True
+        script.assert_not_awaited()
+        assert await limiter.is_allowed("test-token", rate_limit=100, cost=2) is True
+        script.assert_awaited_once()  # 4 + 2 would exceed the batch: synced first
+        assert limiter._states["test-token"].rate_pending == 2
+
+        assert await limiter.is_allowed("test-token", rate_limit=100, cost=20) is True
+        # Synced before the decision, and the cost over a batch pushed right after it
+        assert script.await_count == 3
+        assert limiter._states["test-token"].rate_pending == 0
+
+    @pytest.mark.asyncio
+    async def test_global_count_denies(self, limiter, script):
+        """Test that counts from other workers learned on sync deny locally"""
+        script.return_value = [100]
+        for _ in range(5):
+            await limiter.is_allowed("test-token", rate_limit=100)
+
+        assert await limiter.is_allowed("test-token", rate_limit=100) is False
+
+    @pytest.mark.asyncio
+    async def test_sync_pushes_rate_and_daily(self, limiter, script, redis_mock):
+        """Test that one script call pushes both counters with their TTLs"""
+        script.return_value = [2, 40]
+        await limiter.is_allowed("test-token", rate_limit=100, daily_limit=50)
+        await limiter.is_allowed("test-token", rate_limit=100, daily_limit=50)
+
+        assert await limiter.sync(["test-token"]) is True
+
+        script.assert_awaited_once_with(
+            keys=["rate:test-token:1000", "daily:test-token:900"],
+            args=[2, 2, 1, SECONDS_IN_DAY],
+            client=redis_mock
+        )
+        state = limiter._states["test-token"]
+        assert (state.rate_count, state.rate_pending) == (2, 0)
+        assert (state.daily_count, state.daily_pending) == (40, 0)
+
+    @pytest.mark.asyncio
+    async def test_sync_batches_per_node(self, redis_mock, script):
+        """Test that a sharded sync makes one script call per node holding pending tokens"""
+        shards = RedisShards({'redis-a:6379': AsyncMock(), 'redis-b:6379': AsyncMock()})
+        tokens = [f"{i}-{i}" for i in range(20)]
+        with patch('hybrid_rate_limiter.get_async_redis', return_value=redis_mock), \
+             patch('hybrid_rate_limiter.get_async_redis_shards', return_value=shards):
+            limiter = HybridRateLimiter(sync_requests=5, local_share=0.5, breaker=CircuitBreaker())
+        script.side_effect = lambda keys, args, client: [1] * len(keys)
+        for token in tokens:
+            await limiter.is_allowed(token, rate_limit=100)
+
+        assert await limiter.sync(tokens) is True
+
+        clients = [call.kwargs["client"] for call in script.await_args_list]
+        assert sorted(map(id, clients)) == sorted(map(id, shards.clients.values()))
+        for call in script.await_args_list:
+            for key in call.kwargs["keys"]:
+                assert shards.for_token(key.split(":")[1]) is call.kwargs["client"]
+        assert all(state.rate_pending == 0 for state in limiter._states.values())
+
+    @pytest.mark.asyncio
+    async def test_daily_limit_from_global_count(self, limiter, script):
+        """Test that the daily limit uses the synced global count"""
+        script.return_value = [1, 50]
+        await limiter.is_allowed("test-token", rate_limit=100, daily_limit=50)
+        await limiter.sync(["test-token"])
+
+        assert await limiter.is_allowed("test-token", rate_limit=100, daily_limit=50) is False
+
+    @pytest.mark.asyncio
+    async def test_sync_without_pending_skips_redis(self, limiter, script):
+        assert await limiter.sync(["test-token"]) is True
+        script.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_sync_failure_keeps_pending(self, limiter, script):
+        """Test that admissions stay pending when Redis fails"""
+        script.side_effect = ConnectionError("down")
+        await limiter.is_allowed("test-token", rate_limit=100)
+
+        assert await limiter.sync(["test-token"]) is False
+        assert limiter._states["test-token"].rate_pending == 1
+
+    @pytest.mark.asyncio
+    async def test_fail_closed_when_sync_fails(self, redis_mock, script):
+        """Test that a failed inline sync rejects when failing closed"""
+        with patch('hybrid_rate_limiter.get_async_redis', return_value=redis_mock):
+            limiter = HybridRateLimiter(sync_requests=1, breaker=CircuitBreaker(), fail_open=False)
+        script.side_effect = ConnectionError("down")
+
+        assert await limiter.is_allowed("test-token", rate_limit=100) is True
+        assert await limiter.is_allowed("test-token", rate_limit=100) is False
+
+    @pytest.mark.asyncio
+    async def test_fail_open_keeps_local_limit(self, redis_mock, script):
+        """Test that failing open still enforces the limit locally"""
+        with patch('hybrid_rate_limiter.get_async_redis', return_value=redis_mock):
+            limiter = HybridRateLimiter(sync_requests=1, breaker=CircuitBreaker(), fail_open=True)
+        script.side_effect = ConnectionError("down")
+
+        results = [await limiter.is_allowed("test-token", rate_limit=3) for _ in range(4)]
+
+        assert results == [True, True, True, False]
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_pending(self, limiter, script, redis_mock):
+        """Test that closing pushes the remaining admissions"""
+        script.return_value = [1]
+        await limiter.is_allowed("test-token", rate_limit=100)
+
+        await limiter.close()
+
+        script.assert_awaited_once_with(keys=["rate:test-token:1000"], args=[1, 1], client=redis_mock)
+
+    @pytest.mark.asyncio
+    async def test_new_window_resets_rate_state(self, limiter, script):
+        """Test that a new second starts with a fresh local rate count"""
+        for _ in range(2):
+            await limiter.is_allowed("test-token", rate_limit=2)
+
+        with patch('hybrid_rate_limiter.get_current_timestamp', return_value=1001):
+            assert await limiter.is_allowed("test-token", rate_limit=2) is True
+
+    @pytest.mark.asyncio
+    async def test_tracks_unsynced_tokens(self, limiter, script):
+        """Test that only tokens with unsynced admissions are synced, and stay unsynced when the sync fails"""
+        await limiter.is_allowed("test-token", rate_limit=100)
+        await limiter.is_allowed("other-token", rate_limit=100)
+        script.return_value = [1]
+        await limiter.sync(["other-token"])
+        assert limiter._unsynced == {"test-token"}
+
+        script.side_effect = ConnectionError("down")
+        assert await limiter.sync(list(limiter._unsynced)) is False
+        assert limiter._unsynced == {"test-token"}
+
+    @pytest.mark.asyncio
+    async def test_prunes_idle_tokens_oldest_first(self, limiter, script):
+        """Test that idle synced tokens are dropped, stopping at the first one still in use"""
+        script.return_value = [1]
+        with patch('hybrid_rate_limiter.time.monotonic', return_value=0.0):
+            await limiter.is_allowed("old-token", rate_limit=100)
+            await limiter.is_allowed("test-token", rate_limit=100)
+        with patch('hybrid_rate_limiter.time.monotonic', return_value=100.0):
+            await limiter.is_allowed("new-token", rate_limit=100)
+        await limiter.sync(["old-token", "new-token"])
+
+        with patch('hybrid_rate_limiter.time.monotonic', return_value=100.0):
+            limiter._prune_idle()
+
+        # test-token is idle but not synced yet: it and the tokens after it stay
+        assert list(limiter._states) == ["test-token", "new-token"]
@@ -0,0 +1,38 @@
+import json
+import pytest
+from fastapi.responses import JSONResponse
+from joke import Joke
+
+UPSTREAM_JOKE = {
+    "id": "abc",
+    "categories": ["dev"],
+    "created_at": "2020-01-05 13:42:25.352697",
+    "value": "Chuck Norris can divide by zero. “Zero” agrees."
+}
+
+def test_from_dict():
+    joke = Joke.from_dict(UPSTREAM_JOKE)
+
+    assert (joke.id, joke.categories, joke.createdAt, joke.joke) == (
+        "abc", ["dev"], "2020-01-05 13:42:25.352697", UPSTREAM_JOKE["value"]
+    )
+
+@pytest.mark.parametrize("categories", [["dev"], [], None])
+def test_json_matches_json_response(categories):
+    """Test that the pre-encoded body is byte-identical to the previous JSONResponse output"""
+    joke = Joke("abc", categories, "2020-01-05 13:42:25.352697", UPSTREAM_JOKE["value"])
+    expected = JSONResponse({
+        "id": "abc", "categories": categories, "createdAt": "2020-01-05 13:42:25.352697",
+        "joke": UPSTREAM_JOKE["value"]
+    }).body
+
+    assert joke.json == expected
+    assert list(json.loads(joke.json)) == ["id", "categories", "createdAt", "joke"]
+
+def test_equality():
+    assert Joke.from_dict(UPSTREAM_JOKE) == Joke.from_dict(dict(UPSTREAM_JOKE))
+    assert Joke.from_dict(UPSTREAM_JOKE) != Joke.from_dict(dict(UPSTREAM_JOKE, id="other"))
+
+def test_has_no_instance_dict():
+    with pytest.raises(AttributeError):
+        Joke.from_dict(UPSTREAM_JOKE).extra = 1
@@ -0,0 +1,150 @@
+import io
+import json
+import pytest
+from joke import Joke, UnknownCategoryError
+from joke_corpus import JokeCorpus, CorpusError, PREFIX, _iter_json_array, build_corpus
+from joke_source import FallbackJokeSource
+from upstream_client import UpstreamError
+
+UPSTREAM_JOKES = [
+    {
+        "categories": [],
+        "created_at": "2020-01-05 13:42:19.576875",
+        "id": f"joke-{i}",
+        "value": f"Chuck Norris joke number {i} – with unicode"
+    }
+    for i in range(50)
+]
+
+@pytest.fixture
+def corpus_path(tmp_path):
+    input_path = tmp_path / "jokes.json"
+    input_path.write_text(json.dumps(UPSTREAM_JOKES))
+    output_path = tmp_path / "jokes.corpus"
+    build_corpus(str(input_path), str(output_path))
+    return str(output_path)
+
+def test_build_corpus_returns_count(tmp_path):
+    """Test that building reports the number of ingested jokes"""
+    input_path = tmp_path / "jokes.json"
+    input_path.write_text(json.dumps(UPSTREAM_JOKES))
+
+    assert build_corpus(str(input_path), str(tmp_path / "jokes.corpus")) == 50
+
+def test_build_corpus_from_ndjson(tmp_path):
+    """Test that NDJSON input is ingested line by line"""
+    input_path = tmp_path / "jokes.ndjson"
+    input_path.write_text("\n".join(json.dumps(joke) for joke in UPSTREAM_JOKES[:3]) + "\n")
+    output_path = tmp_path / "jokes.corpus"
+
+    assert build_corpus(str(input_path), str(output_path)) == 3
+    corpus = JokeCorpus(str(output_path))
+    assert corpus.get_joke(2).id == "joke-2"
+    corpus.close()
+
+def test_build_corpus_invalid_input(tmp_path):
+    """Test that invalid input raises CorpusError"""
+    input_path = tmp_path / "jokes.json"
+    input_path.write_text("[{invalid")
+
+    with pytest.raises(CorpusError):
+        build_corpus(str(input_path), str(tmp_path / "jokes.corpus"))
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 16])
+def test_json_array_is_parsed_incrementally(chunk_size):
+    """Test that array elements are decoded across chunk boundaries"""
+    text = " [\n" + ",\n ".join(json.dumps(joke) for joke in UPSTREAM_JOKES[:5]) + " ] "
+
+    assert list(_iter_json_array(io.StringIO(text), chunk_size)) == UPSTREAM_JOKES[:5]
+    assert list(_iter_json_array(io.StringIO("[]"), chunk_size)) == []
+
+@pytest.mark.parametrize('text', ['{"id": 1}', '[{"id": 1} {"id": 2}]', '[{"id": 1},', '[{"id": 1'])
+def test_invalid_json_array(text):
+    with pytest.raises(ValueError):
+        list(_iter_json_array(io.StringIO(text), chunk_size=4))
+
+def test_get_joke_by_index(corpus_path):
+    """Test that every record round-trips into the same Joke"""
+    corpus = JokeCorpus(corpus_path)
+
+    assert len(corpus) == 50
+    for i, obj in enumerate(UPSTREAM_JOKES):
+        assert corpus.get_joke(i) == Joke.from_dict(obj)
+    corpus.close()
+
+def test_random_joke(corpus_path):
+    """Test that random jokes come from the corpus"""
+    corpus = JokeCorpus(corpus_path)
+
+    ids = {corpus.random_joke().id for _ in range(500)}
+    corpus.close()
+
+    assert ids <= {obj["id"] for obj in UPSTREAM_JOKES}
+    assert len(ids) > 1
+
+def test_random_joke_from_category(tmp_path):
+    """Test that the category index only picks jokes of the category"""
+    jokes = [dict(joke, categories=["dev"] if i % 5 == 0 else ["food", "travel"])
+             for i, joke in enumerate(UPSTREAM_JOKES)]
+    input_path = tmp_path / "jokes.json"
+    input_path.write_text(json.dumps(jokes))
+    build_corpus(str(input_path), str(tmp_path / "jokes.corpus"))
+    corpus = JokeCorpus(str(tmp_path / "jokes.corpus"))
+
+    dev_ids = {corpus.random_joke("dev").id for _ in range(200)}
+    travel = corpus.random_joke("travel")
+
+    assert corpus.categories() == ["dev", "food", "travel"]
+    assert dev_ids == {f"joke-{i}" for i in range(0, 50, 5)}
+    assert travel.categories == ["food", "travel"]
+    with pytest.raises(UnknownCategoryError):
+        corpus.random_joke("music")
+    corpus.close()
+
+def test_old_version_asks_for_rebuild(tmp_path):
+    """Test that corpus files written before the category index are rejected"""
+    record = json.dumps(UPSTREAM_JOKES[0], separators=(',', ':')).encode('utf-8')
+    path = tmp_path / "v1.corpus"
+    path.write_bytes(PREFIX.pack(b"CNJC", 1) + (1).to_bytes(8, 'little') + (0).to_bytes(8, 'little') +
+                     len(record).to_bytes(8, 'little') + record)
+
+    with pytest.raises(CorpusError, match="rebuild"):
+        JokeCorpus(str(path))
+
+def test_open_missing_corpus(tmp_path):
+    """Test that a missing corpus raises CorpusError"""
+    with pytest.raises(CorpusError):
+        JokeCorpus(str(tmp_path / "missing.corpus"))
+
+def test_open_invalid_corpus(tmp_path):
+    """Test that a file without the corpus header raises CorpusError"""
+    path = tmp_path / "invalid.corpus"
+    path.write_bytes(b"this is not a corpus file")
+
+    with pytest.raises(CorpusError):
+        JokeCorpus(str(path))
+
+def test_open_empty_corpus(tmp_path):
+    """Test that a corpus without jokes raises CorpusError"""
+    input_path = tmp_path / "jokes.json"
+    input_path.write_text("[]")
+    output_path = tmp_path / "jokes.corpus"
+    build_corpus(str(input_path), str(output_path))
+
+    with pytest.raises(CorpusError):
+        JokeCorpus(str(output_path))
+
+@pytest.mark.asyncio
+async def test_fallback_source_uses_corpus_on_upstream_error(corpus_path):
+    """Test that upstream failures are served from the corpus"""
+    async def failing_upstream():
+        raise UpstreamError("upstream down")
+
+    corpus = JokeCorpus(corpus_path)
+    source = FallbackJokeSource(failing_upstream, corpus.fetch_joke)
+
+    joke = await source.fetch_joke()
+    corpus.close()
+
+    assert joke.id.startswith("joke-")
+    assert source.fallbacks == 1
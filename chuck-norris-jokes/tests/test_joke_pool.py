@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from joke import Joke
+from joke_pool import JokePool
+from upstream_client import UpstreamError
+
+class FakeUpstream:
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+
+    async def fetch_joke(self) -> Joke:
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(0)
+        if self.fail:
+            raise UpstreamError("upstream down")
+        return Joke(str(call), [], "2020-01-05 13:42:25.352697", f"joke {call}")
+
+async def wait_for_size(pool: JokePool, size: int) -> None:
+    for _ in range(100):
+        if len(pool) >= size:
+            return
+        await asyncio.sleep(0.001)
+    raise AssertionError(f"Pool did not reach {size} jokes")
+
+def test_invalid_watermarks():
+    """Test that inconsistent watermarks are rejected"""
+    with pytest.raises(ValueError):
+        JokePool(FakeUpstream().fetch_joke, size=10, low_watermark=5, high_watermark=20)
+    with pytest.raises(ValueError):
+        JokePool(FakeUpstream().fetch_joke, size=10, low_watermark=5, high_watermark=5)
+
+@pytest.mark.asyncio
+async def test_start_fills_to_high_watermark():
+    """Test that the background task fills the pool on start"""
+    upstream = FakeUpstream()
+    pool = JokePool(upstream.fetch_joke, size=10, low_watermark=2, high_watermark=8, refill_concurrency=3)
+
+    pool.start()
+    await wait_for_size(pool, 8)
+    await pool.close()
+
+    assert len(pool) == 8
+    assert upstream.calls == 8
+
+@pytest.mark.asyncio
+async def test_refills_with_refill_fetch_joke():
+    """Test that refills use their own source while misses use the direct one"""
+    upstream, refill_upstream = FakeUpstream(), FakeUpstream()
+    pool = JokePool(upstream.fetch_joke, size=10, low_watermark=2, high_watermark=8,
+                    refill_fetch_joke=refill_upstream.fetch_joke)
+
+    await pool.fetch_joke()
+    pool.start()
+    await wait_for_size(pool, 8)
+    await pool.close()
+
+    assert upstream.calls == 1
+    assert refill_upstream.calls == 8
+
+@pytest.mark.asyncio
+async def test_fetch_joke_hit():
+    """Test that pooled jokes are served without calling upstream"""
+    upstream = FakeUpstream()
+    pool = JokePool(upstream.fetch_joke, size=10, low_watermark=2, high_watermark=10)
+    pool.start()
+    await wait_for_size(pool, 10)
+    calls_before = upstream.calls
+
+    jokes = [await pool.fetch_joke() for _ in range(5)]
+    await pool.close()
+
+    assert len({joke.id for joke in jokes}) == 5
+    assert upstream.calls == calls_before
+    assert pool.stats() == {'size': 5, 'hits': 5, 'misses': 0}
+
+@pytest.mark.asyncio
+async def test_fetch_joke_miss_falls_back_to_upstream():
+    """Test that an empty pool fetches directly and counts a miss"""
+    upstream = FakeUpstream()
+    pool = JokePool(upstream.fetch_joke, size=10, low_watermark=2, high_watermark=10)
+
+    joke = await pool.fetch_joke()
+
+    assert joke.joke == "joke 1"
+    assert pool.misses == 1
+    assert pool.hits == 0
+
+@pytest.mark.asyncio
+async def test_refill_after_low_watermark():
+    """Test that draining below the low watermark triggers a refill"""
+    upstream = FakeUpstream()
+    pool = JokePool(upstream.fetch_joke, size=4, low_watermark=1, high_watermark=4)
+    pool.start()
+    await wait_for_size(pool, 4)
+
+    for _ in range(3):
+        await pool.fetch_joke()
+    await wait_for_size(pool, 4)
+    await pool.close()
+
+    assert upstream.calls == 7
+
+@pytest.mark.asyncio
+async def test_refill_failure_is_retried():
+    """Test that upstream failures do not kill the refill task"""
+    upstream = FakeUpstream(fail=True)
+    pool = JokePool(upstream.fetch_joke, size=4, low_watermark=1, high_watermark=4, retry_delay=0.001)
+    pool.start()
+    await asyncio.sleep(0.01)
+    upstream.fail = False
+
+    await wait_for_size(pool, 4)
+    await pool.close()
+
+    assert len(pool) == 4
@@ -0,0 +1,175 @@
+import asyncio
+import pytest
+from joke import Joke
+from joke_source import CoalescingJokeSource, ScheduledJokeSource
+from plan_scheduler import PlanScheduler
+from upstream_client import UpstreamError
+
+class FakeUpstream:
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+        self.release = asyncio.Event()
+
+    async def fetch_joke(self) -> Joke:
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        if self.fail:
+            raise UpstreamError("upstream down")
+        return Joke(str(call), [], "2020-01-05 13:42:25.352697", f"joke {call}")
+
+async def burst(source: CoalescingJokeSource, upstream: FakeUpstream, callers: int) -> list:
+    tasks = [asyncio.create_task(source.fetch_joke()) for _ in range(callers)]
+    await asyncio.sleep(0)
+    upstream.release.set()
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+def test_invalid_fan_out():
+    with pytest.raises(ValueError):
+        CoalescingJokeSource(FakeUpstream().fetch_joke, max_fan_out=0)
+
+@pytest.mark.asyncio
+async def test_single_caller_gets_own_fetch():
+    upstream = FakeUpstream()
+    upstream.release.set()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=4)
+
+    joke = await source.fetch_joke()
+
+    assert joke.id == "1"
+    assert source.stats() == {'callers': 1, 'fetches': 1, 'shared': 0, 'amplification': 1.0}
+
+@pytest.mark.asyncio
+async def test_burst_is_capped_by_fan_out():
+    """Test that N concurrent callers cause at most max_fan_out upstream fetches"""
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=4)
+
+    jokes = await burst(source, upstream, 10)
+
+    assert upstream.calls == 4
+    assert all(isinstance(joke, Joke) for joke in jokes)
+    assert source.amplification == 2.5
+    assert source.shared == 6
+
+@pytest.mark.asyncio
+async def test_callers_get_distinct_jokes_when_possible():
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=4)
+
+    jokes = await burst(source, upstream, 4)
+
+    assert sorted(joke.id for joke in jokes) == ["1", "2", "3", "4"]
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=1)
+
+    jokes = await burst(source, upstream, 5)
+
+    assert upstream.calls == 1
+    assert {joke.id for joke in jokes} == {"1"}
+
+@pytest.mark.asyncio
+async def test_next_burst_starts_new_batch():
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=1)
+    await burst(source, upstream, 3)
+
+    joke = await source.fetch_joke()
+
+    assert joke.id == "2"
+    assert source.fetches == 2
+
+@pytest.mark.asyncio
+async def test_failure_reaches_every_waiter():
+    upstream = FakeUpstream(fail=True)
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=2)
+
+    results = await burst(source, upstream, 5)
+
+    assert all(isinstance(result, UpstreamError) for result in results)
+
+@pytest.mark.asyncio
+async def test_partial_failure_shares_successful_jokes():
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=2)
+    original = upstream.fetch_joke
+
+    async def second_fails():
+        call = upstream.calls + 1
+        joke = await original()
+        if call == 2:
+            raise UpstreamError("throttled")
+        return joke
+
+    source._fetch_joke = second_fails
+
+    jokes = await burst(source, upstream, 3)
+
+    assert [joke.id for joke in jokes] == ["1", "1", "1"]
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_is_skipped():
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke, max_fan_out=2)
+    first = asyncio.create_task(source.fetch_joke())
+    second = asyncio.create_task(source.fetch_joke())
+    await asyncio.sleep(0)
+    first.cancel()
+    upstream.release.set()
+
+    joke = await second
+
+    assert joke.id == "1"
+
+@pytest.mark.asyncio
+async def test_close_fails_waiters():
+    upstream = FakeUpstream()
+    source = CoalescingJokeSource(upstream.fetch_joke)
+    waiter = asyncio.create_task(source.fetch_joke())
+    await asyncio.sleep(0)
+
+    await source.close()
+
+    with pytest.raises(UpstreamError):
+        await waiter
+
+@pytest.mark.asyncio
+async def test_categories_are_coalesced_separately():
+    calls = []
+
+    async def fetch_joke(category=None):
+        calls.append(category)
+        await asyncio.sleep(0)
+        return Joke(str(len(calls)), [category] if category else [], "2020-01-05 13:42:25.352697", "joke")
+
+    source = CoalescingJokeSource(fetch_joke, max_fan_out=1)
+
+    jokes = await asyncio.gather(source.fetch_joke("dev"), source.fetch_joke("dev"), source.fetch_joke())
+
+    assert sorted(calls, key=str) == [None, "dev"]
+    assert jokes[0] is jokes[1]
+    assert jokes[0].categories == ["dev"]
+    assert jokes[2].categories == []
+
+@pytest.mark.asyncio
+async def test_scheduled_source_runs_fetches_for_current_plan():
+    scheduler = PlanScheduler(concurrency=1, weights={'pro': 2, 'free': 1})
+    in_flight = []
+
+    async def fetch_joke(category=None):
+        in_flight.append(scheduler.in_flight)
+        return Joke("1", [category] if category else [], "2020-01-05 13:42:25.352697", "joke")
+
+    source = ScheduledJokeSource(fetch_joke, scheduler, lambda: 'pro')
+
+    assert (await source.fetch_joke("dev")).categories == ["dev"]
+    await source.fetch_joke()
+
+    assert in_flight == [1, 1]
+    assert scheduler.in_flight == 0
+    gauges = {labels['plan']: value for labels, value in scheduler.plan_gauges()[1][2]}
+    assert gauges == {'pro': 2, 'free': 0}
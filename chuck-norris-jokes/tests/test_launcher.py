@@ -0,0 +1,82 @@
+import json
+import os
+from accounts_table import AccountsTable
+from launcher import AccountsCompiler, available_cpus, shared_table_path
+
+ACCOUNTS = {
+    "1111-2222-3333": {"plan": "free", "rate_limit": 1, "daily_limit": 50},
+    "2222-3333-4444": {"plan": "pro", "rate_limit": 10, "daily_limit": 12000}
+}
+
+def write_accounts(path, accounts):
+    path.write_text(json.dumps(accounts))
+    # Make sure the change is visible even on filesystems with coarse timestamps
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def make_compiler(tmp_path):
+    source = tmp_path / "accounts.json"
+    write_accounts(source, ACCOUNTS)
+    return AccountsCompiler(str(source), str(tmp_path / "accounts.table"), use_inotify=False)
+
+def test_build_compiles_table(tmp_path):
+    compiler = make_compiler(tmp_path)
+
+    assert compiler.build() == 2
+
+    table = AccountsTable(compiler.table_path)
+    assert table["2222-3333-4444"]["rate_limit"] == 10
+
+def test_rebuild_only_when_source_changes(tmp_path):
+    compiler = make_compiler(tmp_path)
+    compiler.build()
+
+    assert compiler.rebuild_if_changed() is False
+
+    write_accounts(tmp_path / "accounts.json", {**ACCOUNTS, "5555-6666-7777": {"rate_limit": 3}})
+
+    assert compiler.rebuild_if_changed() is True
+    assert compiler.builds == 2
+    assert len(AccountsTable(compiler.table_path)) == 3
+
+def test_invalid_source_keeps_previous_table(tmp_path):
+    compiler = make_compiler(tmp_path)
+    compiler.build()
+    (tmp_path / "accounts.json").write_text("{not json")
+
+    assert compiler.rebuild_if_changed() is False
+    assert compiler.build_errors == 1
+    assert len(AccountsTable(compiler.table_path)) == 2
+
+def test_close_removes_table(tmp_path):
+    compiler = make_compiler(tmp_path)
+    compiler.build()
+    compiler.start()
+
+    compiler.close()
+    compiler.close()
+
+    assert not os.path.exists(compiler.table_path)
+
+def test_shared_table_path_is_per_process(tmp_path):
+    assert shared_table_path(str(tmp_path)) == str(tmp_path / f"chuck-norris-accounts-{os.getpid()}.table")
+
+def test_available_cpus_capped_by_cgroup_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(8)))
+    assert available_cpus(str(tmp_path)) == 8
+
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert available_cpus(str(tmp_path)) == 8
+
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert available_cpus(str(tmp_path)) == 2
+
+def test_available_cpus_reads_cgroup_v1_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(8)))
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+    assert available_cpus(str(tmp_path)) == 8
+
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("50000\n")
+    assert available_cpus(str(tmp_path)) == 1
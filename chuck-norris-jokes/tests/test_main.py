@@ -1,8 +1,9 @@
 from fastapi.testclient import TestClient
 from main import app, Auth
+import main
 from unittest.mock import patch
 from redis_connection import get_redis
-from helpers.cached_accounts_file_helper import CachedAccountsFileHelper
+from accounts_watcher import AccountsWatcher
 import json
 import os
 import pytest
@@ -13,7 +14,7 @@ TEST_ACCOUNTS = {
         "rate_limit": 10,
         "daily_limit": 100
     },
-    "test-token": {
+    "4444-5555-6666": {
         "rate_limit": 5,
         "daily_limit": 50
     }
@@ -24,22 +25,24 @@ TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_ACCOUNTS_PATH = os.path.join(TEST_DIR, "test_accounts.json")
 
 @pytest.fixture(autouse=True)
-def setup_and_cleanup():
+def setup_and_cleanup(monkeypatch):
     """Create test accounts file before tests and clean up after"""
     # Setup: Create test accounts file
     with open(TEST_ACCOUNTS_PATH, 'w') as f:
         json.dump(TEST_ACCOUNTS, f)
     
-    # Initialize app with test accounts file
-    file_helper = CachedAccountsFileHelper()
-    app.middleware_stack = None  # Clear existing middleware
+    # Initialize app with test accounts file; startup starts main.accounts_watcher
+    accounts = AccountsWatcher(TEST_ACCOUNTS_PATH)
+    monkeypatch.setattr(main, 'accounts_watcher', accounts)
+    app.user_middleware.clear()  # Clear existing middleware
+    app.middleware_stack = None
     app.add_middleware(
         Auth,
-        accounts_path=TEST_ACCOUNTS_PATH,
-        file_helper=file_helper
+        accounts=accounts
     )
     
-    yield  # Run tests
+    with client:  # Run startup/shutdown handlers around each test
+        yield  # Run tests
     
     # Cleanup: Remove test accounts file
     try:
@@ -70,8 +73,9 @@ def test_200_with_valid_token():
     assert "joke" in response.json()
     assert isinstance(response.json()["joke"], str)
 
-@patch('rate_limiter.RateLimiter._is_within_daily_limit')
-@patch('rate_limiter.RateLimiter._is_within_rate_limit')
+@patch('auth.rate_limiter._use_script', False)
+@patch('rate_limiter.AsyncRateLimiter._is_within_daily_limit')
+@patch('rate_limiter.AsyncRateLimiter._is_within_rate_limit')
 def test_rate_limiting(mock_rate_check, mock_daily_check):
     """Test rate limiting functionality"""
     headers = {"Authorization": "1111-2222-3333"}
@@ -88,11 +92,12 @@ def test_rate_limiting(mock_rate_check, mock_daily_check):
     response = client.get("/joke", headers=headers)
     assert response.status_code == 429
 
-@patch('rate_limiter.RateLimiter._is_within_daily_limit')
-@patch('rate_limiter.RateLimiter._is_within_rate_limit')
+@patch('auth.rate_limiter._use_script', False)
+@patch('rate_limiter.AsyncRateLimiter._is_within_daily_limit')
+@patch('rate_limiter.AsyncRateLimiter._is_within_rate_limit')
 def test_daily_limit(mock_rate_check, mock_daily_check):
     """Test daily limit functionality"""
-    headers = {"Authorization": "test-token"}
+    headers = {"Authorization": "4444-5555-6666"}
     
     # Configure mocks
     mock_rate_check.return_value = True  # Rate limit always passes
@@ -105,4 +110,19 @@ def test_daily_limit(mock_rate_check, mock_daily_check):
     
     # Sixth request should fail due to daily limit
     response = client.get("/joke", headers=headers)
-    assert response.status_code == 429
\ No newline at end of file
+    assert response.status_code == 429
+
+
+def test_bulk_jokes_streamed_as_ndjson():
+    """Test that /jokes returns one JSON joke per line"""
+    response = client.get("/jokes?count=3", headers={"Authorization": "1111-2222-3333"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert len(lines) == 3
+    assert all(isinstance(json.loads(line)["joke"], str) for line in lines)
+
+def test_bulk_jokes_count_validated():
+    """Test that counts outside 1..JOKES_MAX_COUNT are rejected"""
+    response = client.get("/jokes?count=0", headers={"Authorization": "1111-2222-3333"})
+    assert response.status_code == 422
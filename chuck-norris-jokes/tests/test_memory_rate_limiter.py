@@ -0,0 +1,84 @@
+import pytest
+from unittest.mock import patch
+from memory_rate_limiter import DAILY_EXPIRY_SPREAD, MemoryRateLimiter
+from rate_limit_algorithms import GCRA, SLIDING_WINDOW
+
+NOW = 1700000000.25
+
+@pytest.fixture
+def clock():
+    now = [NOW]
+    with patch('memory_rate_limiter.time.time', side_effect=lambda: now[0]):
+        yield now
+
+@pytest.fixture
+def limiter():
+    return MemoryRateLimiter()
+
+def test_fixed_window(limiter, clock):
+    results = [limiter.check_limits("test-token", rate_limit=2, daily_limit=50) for _ in range(3)]
+
+    assert results == [(True, 1, 1), (True, 2, 2), (False, 3, 2)]
+    clock[0] += 1
+    assert limiter.check_limits("test-token", rate_limit=2, daily_limit=50) == (True, 1, 3)
+
+def test_daily_limit(limiter, clock):
+    for _ in range(3):
+        assert limiter.check_limits("test-token", rate_limit=10, daily_limit=3)[0] is True
+        clock[0] += 1
+
+    assert limiter.check_limits("test-token", rate_limit=10, daily_limit=3) == (False, 1, 4)
+
+def test_without_daily_limit(limiter, clock):
+    assert limiter.check_limits("test-token", rate_limit=2) == (True, 1, None)
+
+def test_cost(limiter, clock):
+    assert limiter.check_limits("test-token", rate_limit=5, daily_limit=50, cost=4) == (True, 4, 4)
+    assert limiter.check_limits("test-token", rate_limit=5, daily_limit=50, cost=2) == (False, 6, 4)
+
+def test_sliding_window_weighs_previous_second(limiter, clock):
+    for _ in range(4):
+        limiter.check_limits("test-token", rate_limit=4, algorithm=SLIDING_WINDOW)
+    clock[0] += 1  # A quarter into the next second: 3 of the previous 4 still count
+
+    results = [limiter.check_limits("test-token", rate_limit=4, algorithm=SLIDING_WINDOW)[0] for _ in range(2)]
+
+    assert results == [True, False]
+
+def test_gcra_spaces_requests(limiter, clock):
+    # Burst of 20% of 10: two requests may queue
+    results = [limiter.check_limits("test-token", rate_limit=10, algorithm=GCRA)[0] for _ in range(3)]
+    assert results == [True, True, False]
+
+    clock[0] += 0.1
+    assert limiter.check_limits("test-token", rate_limit=10, algorithm=GCRA)[0] is True
+
+@pytest.mark.asyncio
+async def test_is_allowed(limiter, clock):
+    assert await limiter.is_allowed("test-token", rate_limit=1, daily_limit=50) is True
+    assert await limiter.is_allowed("test-token", rate_limit=1, daily_limit=50) is False
+
+def test_idle_tokens_expire(limiter, clock):
+    """Test that state is dropped once neither its second nor its daily count matter"""
+    limiter.check_limits("rate-only", rate_limit=2)
+    limiter.check_limits("daily", rate_limit=2, daily_limit=50)
+    clock[0] += 10
+    limiter.check_limits("other", rate_limit=2)
+
+    assert limiter.stats() == {'tokens': 2, 'expired': 1}
+    clock[0] += 86400
+    limiter.check_limits("other", rate_limit=2)
+    assert limiter.stats()['tokens'] == 1
+
+def test_daily_expiry_spread_by_token(limiter, clock):
+    """Test that tokens charged the same day are not all dropped at the same time"""
+    for i in range(20):
+        limiter.check_limits(f"token-{i}", rate_limit=2, daily_limit=50)
+    day_end = (int(NOW) // 86400 + 1) * 86400
+
+    clock[0] = day_end + 2
+    limiter.check_limits("other", rate_limit=2)
+    assert 1 < limiter.stats()['tokens'] <= 21
+    clock[0] = day_end + DAILY_EXPIRY_SPREAD + 2
+    limiter.check_limits("other", rate_limit=2)
+    assert limiter.stats()['tokens'] == 1
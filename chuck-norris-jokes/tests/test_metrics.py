@@ -0,0 +1,74 @@
+import pytest
+from metrics import Metrics, stats_gauges
+
+@pytest.fixture
+def registry():
+    return Metrics(prefix='test_', enabled=True)
+
+def test_counter(registry):
+    rejected = registry.counter('rejected_total', 'Rejected requests', ('status', 'plan'))
+    rejected.labels('429', 'free').inc()
+    rejected.labels('429', 'free').inc()
+    rejected.labels('403', 'none').inc(3)
+
+    text = registry.render().decode()
+
+    assert '# TYPE test_rejected_total counter' in text
+    assert 'test_rejected_total{status="429",plan="free"} 2' in text
+    assert 'test_rejected_total{status="403",plan="none"} 3' in text
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = registry.histogram('latency_seconds', 'Latency', ('stage',), buckets=(0.1, 1.0))
+    stage = latency.labels('auth')
+    for value in (0.05, 0.1, 0.5, 5.0):
+        stage.observe(value)
+
+    lines = registry.render().decode().splitlines()
+
+    assert 'test_latency_seconds_bucket{stage="auth",le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="auth",le="1.0"} 3' in lines
+    assert 'test_latency_seconds_bucket{stage="auth",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_sum{stage="auth"} 5.65' in lines
+    assert 'test_latency_seconds_count{stage="auth"} 4' in lines
+
+def test_labels_bind_one_series(registry):
+    counter = registry.counter('total', 'Total', ('client',))
+    assert counter.labels('sync') is counter.labels('sync')
+    with pytest.raises(ValueError):
+        counter.labels('sync', 'extra')
+
+def test_disabled_registry_records_nothing():
+    registry = Metrics(prefix='test_', enabled=False)
+    counter = registry.counter('total', 'Total', ('client',))
+    counter.labels('sync').inc()
+    registry.histogram('seconds', 'Seconds').labels().observe(1.0)
+
+    text = registry.render().decode()
+
+    assert 'test_total{' not in text
+    assert 'test_seconds_count' not in text
+
+def test_label_values_are_escaped(registry):
+    registry.counter('total', 'Total', ('plan',)).labels('a "b"\\c').inc()
+    assert 'test_total{plan="a \\"b\\"\\\\c"} 1' in registry.render().decode()
+
+def test_collectors_render_gauges(registry):
+    registry.add_collector(lambda: stats_gauges('joke_pool', {'size': 7, 'hits': 3}))
+    registry.add_collector(lambda: stats_gauges('redis', {
+        'circuit_breaker': 'closed',
+        'async_pool': {'max_connections': 50, 'in_use_connections': 2}
+    }))
+
+    lines = registry.render().decode().splitlines()
+
+    assert '# TYPE test_joke_pool_size gauge' in lines
+    assert 'test_joke_pool_size 7.0' in lines
+    assert 'test_redis_circuit_breaker{circuit_breaker="closed"} 1' in lines
+    assert 'test_redis_async_pool_in_use_connections 2.0' in lines
+
+def test_stats_gauges_skip_non_numeric_values():
+    families = stats_gauges('accounts', {'accounts': 3, 'inotify': True, 'path': None})
+    assert families == [
+        ('accounts_accounts', 'accounts accounts', [({}, 3.0)]),
+        ('accounts_inotify', 'accounts inotify', [({}, 1.0)])
+    ]
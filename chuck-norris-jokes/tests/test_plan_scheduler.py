@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from plan_scheduler import PlanScheduler, SchedulerOverloadedError, parse_plan_weights
+
+WEIGHTS = {'enterprise': 4, 'pro': 2, 'free': 1}
+
+def scheduler(**kwargs) -> PlanScheduler:
+    options = {'concurrency': 1, 'weights': WEIGHTS, 'queue_size': 100, 'queue_timeout': 1.0}
+    options.update(kwargs)
+    return PlanScheduler(**options)
+
+async def queue_up(plan_scheduler: PlanScheduler, plan: str, order: list) -> asyncio.Task:
+    async def wait():
+        await plan_scheduler.acquire(plan)
+        order.append(plan)
+    task = asyncio.create_task(wait())
+    await asyncio.sleep(0)
+    return task
+
+def test_parse_plan_weights():
+    assert parse_plan_weights(' enterprise=10, pro=2.5,free=1,') == {'enterprise': 10, 'pro': 2.5, 'free': 1}
+    with pytest.raises(ValueError):
+        parse_plan_weights('free')
+    with pytest.raises(ValueError):
+        parse_plan_weights('free=0')
+
+@pytest.mark.asyncio
+async def test_run_takes_free_slot_at_once():
+    plan_scheduler = scheduler()
+
+    async def fetch(category):
+        assert plan_scheduler.in_flight == 1
+        return category
+    assert await plan_scheduler.run('free', fetch, 'dev') == 'dev'
+    assert plan_scheduler.stats() == {'in_flight': 0, 'queued': 0}
+
+@pytest.mark.asyncio
+async def test_slots_shared_by_weight():
+    plan_scheduler = scheduler()
+    await plan_scheduler.acquire('free')
+    order = []
+    tasks = [await queue_up(plan_scheduler, plan, order) for plan in ['free'] * 4 + ['enterprise'] * 8]
+    for _ in tasks:
+        plan_scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    # Weights 4:1, so enterprise gets 4 slots for each free one while both wait
+    assert order[:5].count('enterprise') == 4
+    assert order[:10].count('enterprise') == 8
+
+@pytest.mark.asyncio
+async def test_idle_plan_builds_no_credit():
+    plan_scheduler = scheduler()
+    await plan_scheduler.acquire('free')
+    order = []
+    tasks = [await queue_up(plan_scheduler, 'free', order) for _ in range(3)]
+    for _ in range(3):
+        plan_scheduler.release()
+        await asyncio.sleep(0)
+    tasks += [await queue_up(plan_scheduler, plan, order) for plan in ('pro', 'pro', 'free')]
+    for _ in range(3):
+        plan_scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert order == ['free', 'free', 'free', 'pro', 'pro', 'free']
+
+@pytest.mark.asyncio
+async def test_full_queue_evicts_lighter_plan():
+    plan_scheduler = scheduler(queue_size=2)
+    await plan_scheduler.acquire('pro')
+    order = []
+    free_first = await queue_up(plan_scheduler, 'free', order)
+    free_last = await queue_up(plan_scheduler, 'free', order)
+    enterprise = await queue_up(plan_scheduler, 'enterprise', order)
+    with pytest.raises(SchedulerOverloadedError):
+        await free_last
+    # Nothing lighter than free to evict: the newcomer is shed
+    with pytest.raises(SchedulerOverloadedError):
+        await plan_scheduler.acquire('free')
+    plan_scheduler.release()
+    plan_scheduler.release()
+    await asyncio.gather(free_first, enterprise)
+    assert order == ['enterprise', 'free']
+    gauges = {name: dict((labels['plan'], value) for labels, value in samples)
+              for name, _, samples in plan_scheduler.plan_gauges()}
+    assert gauges['plan_scheduler_shed'] == {'enterprise': 0, 'pro': 0, 'free': 2}
+    assert gauges['plan_scheduler_queue_depth'] == {'enterprise': 0, 'pro': 0, 'free': 0}
+
+@pytest.mark.asyncio
+async def test_queue_timeout_sheds():
+    plan_scheduler = scheduler(queue_timeout=0.01)
+    await plan_scheduler.acquire('free')
+    with pytest.raises(SchedulerOverloadedError):
+        await plan_scheduler.acquire('free')
+    assert plan_scheduler.queued == 0
+    plan_scheduler.release()
+    assert plan_scheduler.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    plan_scheduler = scheduler()
+    await plan_scheduler.acquire('free')
+    waiter = asyncio.create_task(plan_scheduler.acquire('pro'))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert plan_scheduler.queued == 0
+    plan_scheduler.release()
+    assert plan_scheduler.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_unknown_plan_gets_default_weight():
+    plan_scheduler = scheduler(default_weight=1)
+    await plan_scheduler.run('none', asyncio.sleep, 0)
+    assert [value for labels, value in plan_scheduler.plan_gauges()[1][2] if labels['plan'] == 'none'] == [1]
@@ -1,7 +1,10 @@
 import pytest
-from unittest.mock import Mock, patch, call
-from redis import Redis
-from rate_limiter import RateLimiter, SECONDS_IN_DAY
+from unittest.mock import AsyncMock, Mock, patch, call
+from redis import Redis, ConnectionError
+from helpers.circuit_breaker import CircuitBreaker, OPEN
+from rate_limit_algorithms import ALGORITHMS, GCRA, SLIDING_WINDOW
+from rate_limiter import AsyncRateLimiter, RateLimiter, SECONDS_IN_DAY
+from redis_connection import RedisShards
 
 class TestRateLimiter:
     @pytest.fixture
@@ -15,12 +18,27 @@ class TestRateLimiter:
             
     @pytest.fixture
     def limiter(self, mock_get_redis):
-        return RateLimiter()
+        return RateLimiter(use_script=False)
+
+    @pytest.fixture
+    def script_mock(self, mock_get_redis):
+        script = Mock()
+        mock_get_redis.register_script.return_value = script
+        return script
+
+    @pytest.fixture
+    def script_limiter(self, mock_get_redis, script_mock):
+        return RateLimiter(use_script=True)
 
     def test_init(self, mock_get_redis):
         limiter = RateLimiter()
         assert limiter.redis is mock_get_redis
 
+    def test_init_registers_script(self, mock_get_redis):
+        RateLimiter()
+        registered = [c.args[0] for c in mock_get_redis.register_script.call_args_list]
+        assert registered == [algorithm.script for algorithm in ALGORITHMS.values()]
+
     def test_increment_key_new(self, limiter, mock_get_redis):
         mock_get_redis.get.return_value = None
         
@@ -30,12 +48,18 @@ class TestRateLimiter:
         mock_get_redis.setex.assert_called_once_with("test:key", 60, 1)
 
     def test_increment_key_existing(self, limiter, mock_get_redis):
-        mock_get_redis.incr.return_value = 6
+        mock_get_redis.incrby.return_value = 6
         
         count = limiter._increment_key("test:key", expiration=60)
         
         assert count == 6
-        mock_get_redis.incr.assert_called_once_with("test:key")
+        mock_get_redis.incrby.assert_called_once_with("test:key", 1)
+
+    def test_increment_key_by_amount(self, limiter, mock_get_redis):
+        mock_get_redis.get.return_value = None
+
+        assert limiter._increment_key("test:key", expiration=60, amount=5) == 5
+        mock_get_redis.setex.assert_called_once_with("test:key", 60, 5)
 
     def test_is_within_limit_under(self, limiter):
         assert limiter._is_within_limit(count=3, limit=5) is True
@@ -104,4 +128,274 @@ class TestRateLimiter:
              patch.object(RateLimiter, '_is_within_daily_limit', return_value=False):
             assert limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is False
 
- 
\ No newline at end of file
+    def test_check_limits_single_script_call(self, script_limiter, script_mock, mock_get_redis):
+        """Test that both limits are checked with one script invocation"""
+        script_mock.return_value = [1, 2, 10]
+        with patch('rate_limiter.time.time', return_value=1700000000.25):
+            result = script_limiter.check_limits("test-token", rate_limit=2, daily_limit=50)
+
+        assert result == (True, 2, 10)
+        script_mock.assert_called_once_with(
+            keys=["rate:test-token:1700000000", "daily:test-token:1699920000"],
+            args=[2, 50, SECONDS_IN_DAY, 1700000000250, 0, 1],
+            client=mock_get_redis
+        )
+        mock_get_redis.get.assert_not_called()
+        mock_get_redis.incrby.assert_not_called()
+
+    def test_check_limits_passes_cost(self, script_limiter, script_mock):
+        """Test that a bulk request is charged in the same script call"""
+        script_mock.return_value = [1, 5, 5]
+
+        assert script_limiter.is_allowed("test-token", rate_limit=10, daily_limit=50, cost=5) is True
+        assert script_mock.call_args.kwargs["args"][5] == 5
+
+    def test_check_limits_without_daily_limit(self, script_limiter, script_mock):
+        """Test that a missing daily limit is passed as -1 and reported as None"""
+        script_mock.return_value = [1, 1, -1]
+
+        result = script_limiter.check_limits("test-token", rate_limit=2)
+
+        assert result == (True, 1, None)
+        assert script_mock.call_args.kwargs["args"][1] == -1
+
+    def test_is_allowed_script_allows(self, script_limiter, script_mock):
+        """Test that script mode returns the script decision"""
+        script_mock.return_value = [1, 1, 1]
+        assert script_limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is True
+
+    def test_is_allowed_script_denies(self, script_limiter, script_mock):
+        """Test that script mode denies when the script denies"""
+        script_mock.return_value = [0, 3, 10]
+        assert script_limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is False
+
+    def test_check_limits_gcra_uses_one_key_per_token(self, script_limiter, script_mock):
+        """Test that GCRA keeps its state in a single key per token"""
+        script_mock.return_value = [1, 1, -1]
+        with patch('rate_limiter.time.time', return_value=1700000000.25):
+            script_limiter.check_limits("test-token", rate_limit=10, algorithm=GCRA)
+
+        assert script_mock.call_args.kwargs["keys"][0] == "gcra:test-token"
+        assert script_mock.call_args.kwargs["args"][4] == 2  # burst of 20% of 10
+
+    def test_check_limits_sliding_window_reads_previous_window(self, script_limiter, script_mock):
+        """Test that the sliding window also passes the previous window key"""
+        script_mock.return_value = [1, 1, -1]
+        with patch('rate_limiter.time.time', return_value=1700000000.25):
+            script_limiter.check_limits("test-token", rate_limit=10, algorithm=SLIDING_WINDOW)
+
+        assert script_mock.call_args.kwargs["keys"] == [
+            "rate:test-token:1700000000",
+            "daily:test-token:1699920000",
+            "rate:test-token:1699999999"
+        ]
+
+    def test_check_limits_unknown_algorithm(self, script_limiter):
+        with pytest.raises(ValueError):
+            script_limiter.check_limits("test-token", rate_limit=10, algorithm="leaky")
+
+    def test_is_allowed_non_fixed_algorithm_uses_script(self, limiter, mock_get_redis):
+        """Test that algorithms without a command path run their script even in command mode"""
+        mock_get_redis.register_script.return_value.return_value = [1, 1, -1]
+        limiter._register_scripts()
+
+        assert limiter.is_allowed("test-token", rate_limit=2, algorithm=GCRA) is True
+        mock_get_redis.get.assert_not_called()
+
+    def test_is_allowed_script_skips_commands(self, script_limiter, script_mock):
+        """Test that script mode does not use the command-based checks"""
+        script_mock.return_value = [1, 1, 1]
+        with patch.object(RateLimiter, '_is_within_rate_limit') as rate_check:
+            script_limiter.is_allowed("test-token", rate_limit=2, daily_limit=50)
+        rate_check.assert_not_called()
+
+class TestAsyncRateLimiter:
+    @pytest.fixture
+    def redis_mock(self):
+        redis = AsyncMock()
+        redis.register_script = Mock(return_value=AsyncMock())
+        return redis
+
+    @pytest.fixture
+    def mock_get_async_redis(self, redis_mock):
+        with patch('rate_limiter.get_async_redis', return_value=redis_mock):
+            yield redis_mock
+
+    @pytest.fixture
+    def limiter(self, mock_get_async_redis):
+        return AsyncRateLimiter(use_script=False)
+
+    @pytest.fixture
+    def script_limiter(self, mock_get_async_redis):
+        return AsyncRateLimiter(use_script=True)
+
+    def test_init(self, mock_get_async_redis):
+        limiter = AsyncRateLimiter()
+        assert limiter.redis is mock_get_async_redis
+        registered = [c.args[0] for c in mock_get_async_redis.register_script.call_args_list]
+        assert registered == [algorithm.script for algorithm in ALGORITHMS.values()]
+
+    @pytest.mark.asyncio
+    async def test_sharded_keys_go_to_the_token_node(self, mock_get_async_redis):
+        """Test that a token's script call runs on the node the ring assigns it"""
+        nodes = {'redis-a:6379': AsyncMock(), 'redis-b:6379': AsyncMock()}
+        shards = RedisShards(nodes)
+        script = mock_get_async_redis.register_script.return_value
+        script.return_value = [1, 1, 1]
+        with patch('rate_limiter.get_async_redis_shards', return_value=shards):
+            limiter = AsyncRateLimiter(use_script=True)
+
+        for token in ("1111-2222-3333", "3333-4444-5555", "5555-6666-7777"):
+            await limiter.is_allowed(token, rate_limit=2, daily_limit=50)
+            assert script.call_args.kwargs["client"] is shards.for_token(token)
+
+    @pytest.mark.asyncio
+    async def test_failing_node_opens_only_its_breaker(self, mock_get_async_redis):
+        """Test that the tokens of a healthy node keep their limits while another node fails"""
+        nodes = {'redis-a:6379': AsyncMock(), 'redis-b:6379': AsyncMock()}
+        shards = RedisShards(nodes)
+        token = "1111-2222-3333"
+        other = next(t for t in (f"{i}-{i}" for i in range(100))
+                     if shards.for_token(t) is not shards.for_token(token))
+        script = mock_get_async_redis.register_script.return_value
+
+        def run_script(keys, args, client):
+            if client is shards.for_token(token):
+                raise ConnectionError("down")
+            return [0, 3, 3]
+        script.side_effect = run_script
+        with patch('rate_limiter.get_async_redis_shards', return_value=shards):
+            limiter = AsyncRateLimiter(use_script=True, fail_open=True)
+
+        for _ in range(5):
+            assert await limiter.is_allowed(token, rate_limit=2) is True
+
+        assert shards.breaker_for(token).state == OPEN
+        assert shards.breaker_for(other).state != OPEN
+        assert await limiter.is_allowed(other, rate_limit=2) is False
+
+    @pytest.mark.asyncio
+    async def test_write_behind_daily_limit(self, mock_get_async_redis):
+        """Test that write-behind mode checks only the rate limit in Redis"""
+        script = mock_get_async_redis.register_script.return_value
+        script.return_value = [1, 1, -1]
+        daily_counters = Mock()
+        daily_counters.charge = AsyncMock(return_value=False)
+        limiter = AsyncRateLimiter(use_script=True, daily_counters=daily_counters)
+
+        with patch('rate_limiter.get_start_of_day_timestamp', return_value=900):
+            assert await limiter.is_allowed("test-token", rate_limit=2, daily_limit=50, cost=3) is False
+
+        assert script.call_args.kwargs["args"][1] == -1
+        daily_counters.charge.assert_awaited_once_with("daily:test-token:900", 50, 3, mock_get_async_redis,
+                                                        limiter._breaker)
+
+    @pytest.mark.asyncio
+    async def test_increment_key_new(self, limiter, mock_get_async_redis):
+        mock_get_async_redis.get.return_value = None
+
+        count = await limiter._increment_key("test:key", expiration=60)
+
+        assert count == 1
+        mock_get_async_redis.setex.assert_awaited_once_with("test:key", 60, 1)
+
+    @pytest.mark.asyncio
+    async def test_increment_key_existing(self, limiter, mock_get_async_redis):
+        mock_get_async_redis.get.return_value = b"5"
+        mock_get_async_redis.incrby.return_value = 6
+
+        count = await limiter._increment_key("test:key", expiration=60)
+
+        assert count == 6
+        mock_get_async_redis.incrby.assert_awaited_once_with("test:key", 1)
+
+    @pytest.mark.asyncio
+    async def test_is_within_rate_limit_over(self, limiter):
+        """Test rate limit when over limit"""
+        with patch.object(AsyncRateLimiter, '_increment_key', AsyncMock(return_value=3)):
+            assert await limiter._is_within_rate_limit("test-token", rate_limit=2) is False
+
+    @pytest.mark.asyncio
+    async def test_is_within_daily_limit_at_limit(self, limiter):
+        """Test daily limit when at limit"""
+        with patch.object(AsyncRateLimiter, '_increment_key', AsyncMock(return_value=50)):
+            assert await limiter._is_within_daily_limit("test-token", daily_limit=50) is True
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_both_limits_pass(self, limiter):
+        """Test when both rate and daily limits pass"""
+        with patch.object(AsyncRateLimiter, '_is_within_rate_limit', AsyncMock(return_value=True)), \
+             patch.object(AsyncRateLimiter, '_is_within_daily_limit', AsyncMock(return_value=True)):
+            assert await limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is True
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_rate_limit_fail_skips_daily(self, limiter):
+        """Test that a failed rate check does not charge the daily limit"""
+        daily_check = AsyncMock(return_value=True)
+        with patch.object(AsyncRateLimiter, '_is_within_rate_limit', AsyncMock(return_value=False)), \
+             patch.object(AsyncRateLimiter, '_is_within_daily_limit', daily_check):
+            assert await limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is False
+        daily_check.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_daily_limit_fail(self, limiter):
+        """Test when daily limit fails"""
+        with patch.object(AsyncRateLimiter, '_is_within_rate_limit', AsyncMock(return_value=True)), \
+             patch.object(AsyncRateLimiter, '_is_within_daily_limit', AsyncMock(return_value=False)):
+            assert await limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is False
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_script(self, script_limiter, mock_get_async_redis):
+        """Test that script mode awaits one script call and returns its decision"""
+        script = mock_get_async_redis.register_script.return_value
+        script.return_value = [0, 3, 10]
+
+        assert await script_limiter.is_allowed("test-token", rate_limit=2, daily_limit=50) is False
+        script.assert_awaited_once()
+        mock_get_async_redis.get.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_fail_open_on_redis_error(self, mock_get_async_redis):
+        """Test that Redis errors allow the request when failing open"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        limiter = AsyncRateLimiter(use_script=True, breaker=breaker, fail_open=True)
+        mock_get_async_redis.register_script.return_value.side_effect = ConnectionError("down")
+
+        assert await limiter.is_allowed("test-token", rate_limit=2) is True
+
+    @pytest.mark.asyncio
+    async def test_is_allowed_fail_closed_on_redis_error(self, mock_get_async_redis):
+        """Test that Redis errors reject the request when failing closed"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        limiter = AsyncRateLimiter(use_script=True, breaker=breaker, fail_open=False)
+        mock_get_async_redis.register_script.return_value.side_effect = ConnectionError("down")
+
+        assert await limiter.is_allowed("test-token", rate_limit=2) is False
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_skips_redis(self, mock_get_async_redis):
+        """Test that an open breaker answers with the policy without calling Redis"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        limiter = AsyncRateLimiter(use_script=True, breaker=breaker, fail_open=False)
+        script = mock_get_async_redis.register_script.return_value
+        script.side_effect = ConnectionError("down")
+
+        for _ in range(2):
+            await limiter.is_allowed("test-token", rate_limit=2)
+        assert breaker.state == OPEN
+
+        assert await limiter.is_allowed("test-token", rate_limit=2) is False
+        assert script.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_success_closes_breaker_count(self, mock_get_async_redis):
+        """Test that a successful check resets the breaker failure count"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        limiter = AsyncRateLimiter(use_script=True, breaker=breaker)
+        script = mock_get_async_redis.register_script.return_value
+        script.side_effect = [ConnectionError("down"), [1, 1, -1], ConnectionError("down")]
+
+        for _ in range(3):
+            await limiter.is_allowed("test-token", rate_limit=2)
+
+        assert breaker.state != OPEN
@@ -1,7 +1,9 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from redis import Redis, ConnectionError
-from redis_connection import get_redis
+from redis import Redis, ConnectionError, TimeoutError
+from redis_connection import (
+    get_async_redis, get_async_redis_shards, get_circuit_breaker, get_redis, get_redis_stats, parse_redis_nodes
+)
 import redis_connection
 import logging
 
@@ -9,6 +11,10 @@ import logging
 def reset_singleton():
     """Reset the module-level singleton before each test"""
     redis_connection._redis_client = None
+    redis_connection._async_redis_client = None
+    redis_connection._redis_shards = None
+    redis_connection._async_redis_shards = None
+    redis_connection._circuit_breaker = None
     yield
 
 @pytest.fixture(autouse=True)
@@ -18,22 +24,32 @@ def setup_logging(caplog):
     yield
 
 @pytest.fixture
-def mock_redis():
+def mock_pool():
+    with patch('redis_connection.BlockingConnectionPool') as mock:
+        yield mock
+
+@pytest.fixture
+def mock_redis(mock_pool):
     with patch('redis_connection.Redis') as mock:
         # Configure the mock Redis instance
         mock_instance = MagicMock()
         mock.return_value = mock_instance
         yield mock
 
-def test_get_redis_creates_connection_once(mock_redis):
+def test_get_redis_creates_connection_once(mock_redis, mock_pool):
     """Test that Redis connection is created only once"""
     # First call
     redis1 = get_redis()
     # Second call
     redis2 = get_redis()
     
-    # Redis constructor should be called only once
-    mock_redis.assert_called_once_with(host='localhost', port=6379, db=0)
+    # Redis constructor should be called only once, on a bounded pool
+    mock_redis.assert_called_once_with(connection_pool=mock_pool.return_value)
+    pool_kwargs = mock_pool.call_args.kwargs
+    assert pool_kwargs['host'] == 'localhost'
+    assert pool_kwargs['port'] == 6379
+    assert pool_kwargs['max_connections'] == 50
+    assert pool_kwargs['retry'] is not None
     # Both calls should return the same instance
     assert redis1 == redis2
 
@@ -64,4 +80,83 @@ def test_get_redis_logs_failure(mock_redis, caplog):
     with pytest.raises(ConnectionError):
         get_redis()
     
-    assert "Failed to connect to Redis" in caplog.text 
\ No newline at end of file
+    assert "Failed to connect to Redis" in caplog.text
+
+def test_get_redis_retries_after_connection_error(mock_redis):
+    """Test that a failed connection is not cached"""
+    mock_redis.return_value.ping.side_effect = [ConnectionError("Connection failed"), True]
+
+    with pytest.raises(ConnectionError):
+        get_redis()
+    get_redis()
+
+    assert mock_redis.call_count == 2
+
+def test_get_async_redis_creates_client_once():
+    """Test that the async client is created once and not pinged at creation"""
+    with patch('redis_connection.aioredis.BlockingConnectionPool') as mock_pool, \
+         patch('redis_connection.aioredis.Redis') as mock:
+        client1 = get_async_redis()
+        client2 = get_async_redis()
+
+    mock.assert_called_once_with(connection_pool=mock_pool.return_value)
+    mock.return_value.ping.assert_not_called()
+    assert client1 is client2
+
+def test_commands_are_retried_on_connection_errors():
+    """Test that the retry policy covers failed commands, not just connecting"""
+    connection = redis_connection._async_client('localhost', 6379).connection_pool.make_connection()
+    assert ConnectionError in connection.retry_on_error and TimeoutError in connection.retry_on_error
+
+def test_get_circuit_breaker_is_shared():
+    """Test that all callers share one circuit breaker"""
+    assert get_circuit_breaker() is get_circuit_breaker()
+
+def test_get_redis_stats_reports_pool_and_breaker():
+    """Test that pool utilisation and breaker state are reported"""
+    get_async_redis()
+
+    stats = get_redis_stats()
+
+    assert stats['circuit_breaker'] == 'closed'
+    assert stats['async_pool'] == {
+        'max_connections': 50,
+        'created_connections': 0,
+        'in_use_connections': 0
+    }
+
+def test_parse_redis_nodes():
+    assert parse_redis_nodes("") == []
+    assert parse_redis_nodes("redis-a:6380, redis-b ,") == [("redis-a", 6380), ("redis-b", 6379)]
+
+def test_single_node_is_not_sharded():
+    with patch('redis_connection.settings.REDIS_NODES', 'redis-a:6379'):
+        assert get_async_redis_shards() is None
+
+def test_async_shards_route_tokens_to_their_node():
+    """Test that each node gets its own pool and a token always maps to the same client"""
+    with patch('redis_connection.settings.REDIS_NODES', 'redis-a:6379,redis-b:6380'):
+        shards = get_async_redis_shards()
+
+    assert set(shards.clients) == {'redis-a:6379', 'redis-b:6380'}
+    hosts = {client.connection_pool.connection_kwargs['host'] for client in shards.clients.values()}
+    assert hosts == {'redis-a', 'redis-b'}
+    assert shards.for_token("1111-2222-3333") is shards.for_token("1111-2222-3333")
+    assert get_async_redis_shards() is shards
+    assert get_redis_stats()['shards'] == 2
+
+def test_shards_have_a_breaker_per_node():
+    """Test that a node's failures open only its own breaker"""
+    with patch('redis_connection.settings.REDIS_NODES', 'redis-a:6379,redis-b:6380'):
+        shards = get_async_redis_shards()
+    token = "1111-2222-3333"
+    other = next(t for t in (f"{i}-{i}" for i in range(100))
+                 if shards.for_token(t) is not shards.for_token(token))
+
+    for _ in range(5):
+        shards.breaker_for(token).record_failure()
+
+    assert shards.breaker_for(token).allow_request() is False
+    assert shards.breaker_for(other).allow_request() is True
+    assert get_circuit_breaker().allow_request() is True
+    assert get_redis_stats()['shard_breakers_open'] == 1
@@ -0,0 +1,40 @@
+import pytest
+from helpers.rolling_percentile import RollingPercentile
+
+def test_validation():
+    with pytest.raises(ValueError):
+        RollingPercentile(100)
+    with pytest.raises(ValueError):
+        RollingPercentile(95, size=10, min_samples=20)
+
+def test_unknown_until_min_samples():
+    percentile = RollingPercentile(50, min_samples=3, refresh_every=1)
+    percentile.add(1.0)
+    percentile.add(2.0)
+    assert percentile.value is None
+    percentile.add(3.0)
+    assert percentile.value == 2.0
+
+def test_nearest_rank():
+    percentile = RollingPercentile(95, size=100, min_samples=100)
+    for sample in range(1, 101):
+        percentile.add(float(sample))
+    assert percentile.value == 95.0
+
+def test_refreshed_every_n_samples():
+    percentile = RollingPercentile(90, size=10, min_samples=10, refresh_every=5)
+    for _ in range(10):
+        percentile.add(1.0)
+    assert percentile.value == 1.0
+    for _ in range(4):
+        percentile.add(9.0)
+    assert percentile.value == 1.0
+    percentile.add(9.0)
+    assert percentile.value == 9.0
+
+def test_window_keeps_last_samples():
+    percentile = RollingPercentile(50, size=4, min_samples=4, refresh_every=1)
+    for sample in (100.0, 100.0, 100.0, 100.0, 1.0, 1.0, 1.0):
+        percentile.add(sample)
+    assert len(percentile) == 4
+    assert percentile.value == 1.0
@@ -0,0 +1,74 @@
+import pytest
+from helpers.timing_wheel import TimingWheel
+
+def test_invalid_wheel():
+    with pytest.raises(ValueError):
+        TimingWheel(resolution=0)
+
+def test_expires_keys_once_their_tick_is_over():
+    wheel = TimingWheel()
+    wheel.expire(100.0)
+    wheel.schedule("a", 101.5)
+    wheel.schedule("b", 103.0)
+
+    assert wheel.expire(101.9) == []
+    assert wheel.expire(102.0) == ["a"]
+    assert wheel.expire(104.5) == ["b"]
+    assert len(wheel) == 0
+
+def test_reschedule_moves_the_key():
+    wheel = TimingWheel()
+    wheel.expire(100.0)
+    wheel.schedule("a", 101.0)
+    wheel.schedule("a", 105.0)
+
+    assert wheel.expire(103.0) == []
+    assert "a" in wheel
+    assert wheel.expire(106.0) == ["a"]
+
+def test_keys_far_ahead_are_not_visited():
+    """Test that expiring a tick touches only its own bucket"""
+    wheel = TimingWheel()
+    wheel.expire(100.0)
+    wheel.schedule("soon", 101.0)
+    for i in range(1000):
+        wheel.schedule(i, 5000.0)
+
+    assert wheel.expire(102.0) == ["soon"]
+    assert list(wheel._buckets) == [5000]
+    assert len(wheel.expire(5001.0)) == 1000
+
+def test_past_deadline_expires_with_next_tick():
+    wheel = TimingWheel()
+    wheel.expire(100.0)
+    wheel.schedule("late", 50.0)
+
+    assert wheel.expire(100.5) == []
+    assert wheel.expire(101.0) == ["late"]
+
+def test_keys_scheduled_before_first_expire():
+    wheel = TimingWheel()
+    wheel.schedule("a", 10.0)
+    wheel.schedule("b", 500.0)
+
+    assert wheel.expire(100.0) == ["a"]
+    assert "b" in wheel
+
+def test_long_pause():
+    wheel = TimingWheel()
+    wheel.expire(100.0)
+    for i in range(10):
+        wheel.schedule(i, 100.0 + i)
+
+    assert sorted(wheel.expire(100000.0)) == list(range(10))
+    assert len(wheel) == 0
+
+def test_cancel():
+    wheel = TimingWheel()
+    wheel.expire(100.0)
+    wheel.schedule("a", 101.0)
+    wheel.cancel("a")
+    wheel.cancel("missing")
+
+    assert wheel.expire(103.0) == []
+    assert len(wheel) == 0
@@ -0,0 +1,76 @@
+import pytest
+from helpers.bloom_filter import BloomFilter
+from token_filter import TokenFilter, MAX_CACHED_TOKEN_LENGTH
+
+KNOWN = [f"{i:04d}-0000-0000" for i in range(1000)]
+
+@pytest.fixture
+def token_filter():
+    return TokenFilter(negative_cache_size=2)
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.from_keys(KNOWN, len(KNOWN))
+
+    assert all(token in bloom for token in KNOWN)
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter.from_keys(KNOWN, len(KNOWN), false_positive_rate=0.01)
+    unknown = [f"{i:04d}-1111-1111" for i in range(10000)]
+
+    assert sum(token in bloom for token in unknown) < 300
+
+def test_bloom_filter_rejects_invalid_rate():
+    with pytest.raises(ValueError):
+        BloomFilter(10, false_positive_rate=1)
+
+def test_passes_everything_by_default(token_filter):
+    assert token_filter.rejects("9999-9999-9999") is False
+
+def test_remembered_token_is_rejected(token_filter):
+    token_filter.remember("9999-9999-9999")
+
+    assert token_filter.rejects("9999-9999-9999") is True
+    assert token_filter.negative_cache_hits == 1
+
+def test_negative_cache_evicts_least_recently_used(token_filter):
+    token_filter.remember("1")
+    token_filter.remember("2")
+    token_filter.rejects("1")
+    token_filter.remember("3")
+
+    assert token_filter.rejects("1") is True
+    assert token_filter.rejects("2") is False
+    assert token_filter.rejects("3") is True
+
+def test_long_tokens_are_not_cached(token_filter):
+    token = "1" * (MAX_CACHED_TOKEN_LENGTH + 1)
+    token_filter.remember(token)
+
+    assert token_filter.rejects(token) is False
+
+def test_disabled_negative_cache():
+    token_filter = TokenFilter(negative_cache_size=0)
+    token_filter.remember("9999-9999-9999")
+
+    assert token_filter.rejects("9999-9999-9999") is False
+
+def test_reset_can_disable_negative_cache(token_filter):
+    token_filter.reset(negative_cache=False)
+    token_filter.remember("9999-9999-9999")
+
+    assert token_filter.rejects("9999-9999-9999") is False
+
+def test_bloom_filter_rejects_unknown(token_filter):
+    token_filter.reset(BloomFilter.from_keys(KNOWN, len(KNOWN)))
+
+    assert token_filter.rejects(KNOWN[0]) is False
+    assert token_filter.rejects("not-a-known-token") is True
+    assert token_filter.bloom_rejections == 1
+
+def test_reset_clears_negative_cache(token_filter):
+    """Test that a token rejected before a reload is looked up again after it"""
+    token_filter.remember("9999-9999-9999")
+
+    token_filter.reset()
+
+    assert token_filter.rejects("9999-9999-9999") is False
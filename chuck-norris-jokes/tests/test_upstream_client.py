@@ -0,0 +1,200 @@
+import asyncio
+import httpx
+import pytest
+from joke import Joke, UnknownCategoryError
+from upstream_client import UpstreamClient, UpstreamError
+
+UPSTREAM_JOKE = {
+    "categories": ["dev"],
+    "created_at": "2020-01-05 13:42:25.352697",
+    "id": "F6v0fEXeREek9FnF6_9k4A",
+    "value": "Chuck Norris' first car was Optimus Prime."
+}
+
+def make_client(handler, **kwargs) -> UpstreamClient:
+    return UpstreamClient(
+        url="http://upstream.test/jokes/random",
+        transport=httpx.MockTransport(handler),
+        **kwargs
+    )
+
+@pytest.mark.asyncio
+async def test_fetch_joke_success():
+    """Test that the upstream payload is parsed into a Joke"""
+    client = make_client(lambda request: httpx.Response(200, json=UPSTREAM_JOKE))
+
+    joke = await client.fetch_joke()
+    await client.close()
+
+    assert joke == Joke(
+        "F6v0fEXeREek9FnF6_9k4A",
+        ["dev"],
+        "2020-01-05 13:42:25.352697",
+        "Chuck Norris' first car was Optimus Prime."
+    )
+
+@pytest.mark.asyncio
+async def test_fetch_joke_http_error():
+    """Test that upstream error statuses raise UpstreamError"""
+    client = make_client(lambda request: httpx.Response(503))
+
+    with pytest.raises(UpstreamError):
+        await client.fetch_joke()
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_fetch_joke_invalid_json():
+    """Test that an invalid upstream body raises UpstreamError"""
+    client = make_client(lambda request: httpx.Response(200, content=b"not json"))
+
+    with pytest.raises(UpstreamError):
+        await client.fetch_joke()
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_fetch_joke_timeout():
+    """Test that upstream timeouts raise UpstreamError"""
+    def handler(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    client = make_client(handler)
+
+    with pytest.raises(UpstreamError):
+        await client.fetch_joke()
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_fetch_joke_bounded_concurrency():
+    """Test that no more than max_concurrency requests are in flight"""
+    in_flight = 0
+    max_in_flight = 0
+
+    class SlowTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json=UPSTREAM_JOKE)
+
+    client = UpstreamClient(
+        url="http://upstream.test/jokes/random",
+        max_concurrency=2,
+        transport=SlowTransport()
+    )
+
+    await asyncio.gather(*(client.fetch_joke() for _ in range(6)))
+    await client.close()
+
+    assert max_in_flight == 2
+
+@pytest.mark.asyncio
+async def test_fetch_joke_from_category():
+    """Test that the category is passed upstream as a query parameter"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=UPSTREAM_JOKE)
+
+    client = make_client(handler)
+
+    joke = await client.fetch_joke("dev")
+    await client.close()
+
+    assert requests[0].url.params["category"] == "dev"
+    assert joke.categories == ["dev"]
+
+@pytest.mark.asyncio
+async def test_fetch_joke_unknown_category():
+    """Test that upstream's 404 for a category raises UnknownCategoryError"""
+    client = make_client(lambda request: httpx.Response(404, json={"message": "No jokes for category"}))
+
+    with pytest.raises(UnknownCategoryError):
+        await client.fetch_joke("nope")
+    await client.close()
+
+class ScriptedTransport(httpx.AsyncBaseTransport):
+    """Answers request n after delays[n] seconds, instantly past the script"""
+    def __init__(self, delays):
+        self.delays = delays
+        self.requests = 0
+
+    async def handle_async_request(self, request):
+        delay = self.delays[self.requests] if self.requests < len(self.delays) else 0
+        self.requests += 1
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=UPSTREAM_JOKE)
+
+async def warm_up(client: UpstreamClient, fetches: int = 20) -> None:
+    """Enough fast fetches to know the latency percentile and earn one hedge at a 5% budget"""
+    for _ in range(fetches):
+        await client.fetch_joke()
+
+def hedging_client(transport, **kwargs) -> UpstreamClient:
+    options = {'hedge': True, 'hedge_min_delay': 0.01, 'hedge_budget': 0.05,
+               'attempt_timeout': 5.0, 'total_timeout': 5.0}
+    options.update(kwargs)
+    return UpstreamClient(url="http://upstream.test/jokes/random", transport=transport, **options)
+
+@pytest.mark.asyncio
+async def test_no_hedging_before_latency_known():
+    client = hedging_client(ScriptedTransport([]))
+    assert client.hedge_delay is None
+    await warm_up(client)
+    assert client.hedge_delay == 0.01  # Fast upstream: the floor applies
+    await client.close()
+    assert hedging_client(ScriptedTransport([]), hedge=False).hedge_delay is None
+
+@pytest.mark.asyncio
+async def test_slow_request_is_hedged():
+    transport = ScriptedTransport([0] * 20 + [1.0])
+    client = hedging_client(transport)
+    await warm_up(client)
+
+    started = asyncio.get_running_loop().time()
+    joke = await client.fetch_joke()
+    assert asyncio.get_running_loop().time() - started < 0.5
+    await client.close()
+
+    assert joke.id == UPSTREAM_JOKE['id']
+    assert transport.requests == 22
+    stats = client.stats()
+    assert stats['hedges'] == 1 and stats['hedge_wins'] == 1
+    assert stats['hedge_rate'] == 1 / 21 and stats['hedge_win_rate'] == 1.0
+
+@pytest.mark.asyncio
+async def test_hedges_limited_by_budget():
+    transport = ScriptedTransport([0] * 20 + [0.05, 0.05])
+    client = hedging_client(transport)
+    await warm_up(client)
+    await client.fetch_joke()  # Spends the one hedge earned
+    await client.fetch_joke()  # Waits on the primary
+    await client.close()
+    assert client.hedges == 1
+    assert transport.requests == 23
+
+@pytest.mark.asyncio
+async def test_attempt_timeout():
+    client = hedging_client(ScriptedTransport([1.0]), attempt_timeout=0.01)
+    with pytest.raises(UpstreamError):
+        await client.fetch_joke()
+    await client.close()
+    assert client.attempt_timeouts == 1
+
+@pytest.mark.asyncio
+async def test_read_timeout_capped_by_attempt_timeout():
+    client = hedging_client(ScriptedTransport([]), read_timeout=5.0, attempt_timeout=2.0)
+    assert client._client.timeout.read == 2.0
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_total_timeout_covers_hedge():
+    transport = ScriptedTransport([0] * 20 + [1.0, 1.0])
+    client = hedging_client(transport, total_timeout=0.05)
+    await warm_up(client)
+    with pytest.raises(UpstreamError):
+        await client.fetch_joke()
+    await client.close()
+    assert client.hedges == 1 and client.hedge_wins == 0